@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+比较树遍历求值器与闭包编译求值器在相同程序上的执行耗时。
+闭包编译求值器的耗时包含把语法树转换为闭包的时间。
+运行方式：python -m benchmark.closure_evaluator
+"""
+import sys
+
+from monkey_evaluate import closure_evaluator, evaluator
+from monkey_object.object import Environment
+from monkey_parser import parser
+from util.timer import Timer
+from benchmark.vm_dispatch import PROGRAMS
+
+EVALUATORS = {
+    "tree": evaluator.evaluate,
+    "closure": closure_evaluator.evaluate,
+}
+
+
+def run_program(source: str, evaluate):
+    program = parser.parse(source)
+    timer = Timer()
+    timer.start()
+    result = evaluate(program, Environment())
+    timer.stop()
+    return result, timer.elapse()
+
+
+def main():
+    # 两种求值器都借助 Python 的递归实现 Monkey 的函数调用
+    sys.setrecursionlimit(20000)
+    for name, source in PROGRAMS.items():
+        for kind, evaluate in EVALUATORS.items():
+            result, elapsed = run_program(source, evaluate)
+            print(f"{name:<10} {kind:<7} {elapsed:>10}  result={result.inspect()}")
+
+
+if __name__ == '__main__':
+    main()
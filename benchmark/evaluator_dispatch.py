@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+比较求值器两种节点分派方式（按 type(node) 查表与原先的 isinstance 分支链）的执行耗时。
+分支链按原先 evaluate 中的顺序排列，各分支调用与查表相同的求值函数。
+运行方式：python -m benchmark.evaluator_dispatch
+"""
+import sys
+
+from monkey_ast import ast
+from monkey_evaluate import evaluator
+from monkey_evaluate.evaluator import *
+from monkey_object.object import Environment
+from monkey_parser import parser
+from util.timer import Timer
+from benchmark.vm_dispatch import PROGRAMS
+from test.interpreter import evaluator_test
+
+# evaluator_test 中能正常运行的用例，整体重复 REPEAT 次
+TESTS = [
+    evaluator_test.test_eval_integer_expression,
+    evaluator_test.test_eval_boolean_expression,
+    evaluator_test.test_if_else_expression,
+    evaluator_test.test_bang_operator,
+    evaluator_test.test_return_statements,
+    evaluator_test.test_error_handling,
+    evaluator_test.test_let_statements,
+    evaluator_test.test_string_concat,
+    evaluator_test.test_builtin_functions,
+    evaluator_test.test_array_index_expression,
+    evaluator_test.test_hash_index_expression,
+    evaluator_test.test_bulk_builtins,
+    evaluator_test.test_loops,
+    evaluator_test.test_assignments,
+    evaluator_test.test_lexical_scoping,
+]
+REPEAT = 50
+
+
+def evaluate_chain(node: ast.Node, env: Environment):
+    if isinstance(node, ast.IntegerLiteral):
+        return eval_integer_literal(node, env)
+    if isinstance(node, ast.Boolean):
+        return eval_boolean(node, env)
+    elif isinstance(node, ast.Program):
+        return eval_program(node, env)
+    elif isinstance(node, ast.ExpressionStatement):
+        return eval_expression_statement(node, env)
+    elif isinstance(node, ast.PrefixExpression):
+        return eval_prefix_expression(node, env)
+    elif isinstance(node, ast.InfixExpression):
+        return eval_infix(node, env)
+    elif isinstance(node, ast.IFExpression):
+        return eval_if_expression(node, env)
+    elif isinstance(node, ast.WhileExpression):
+        return eval_while_expression(node, env)
+    elif isinstance(node, ast.ForExpression):
+        return eval_for_expression(node, env)
+    elif isinstance(node, ast.BlockStatement):
+        return evaluate_block_statement(node, env)
+    elif isinstance(node, ast.ReturnStatement):
+        return eval_return_statement(node, env)
+    elif isinstance(node, ast.LetStatement):
+        return eval_let_statement(node, env)
+    elif isinstance(node, ast.AssignExpression):
+        return eval_assign_expression(node, env)
+    elif isinstance(node, ast.Identifier):
+        return eval_identifier(node, env)
+    elif isinstance(node, ast.FunctionLiteral):
+        return eval_function_literal(node, env)
+    elif isinstance(node, ast.CallExpression):
+        return eval_call_expression(node, env)
+    elif isinstance(node, ast.StringLiteral):
+        return eval_string_literal(node, env)
+    elif isinstance(node, ast.ArrayLiteral):
+        return eval_array_literal(node, env)
+    elif isinstance(node, ast.IndexExpression):
+        return eval_index(node, env)
+    elif isinstance(node, ast.HashLiteral):
+        return eval_hash_literal(node, env)
+    return NULL
+
+
+DISPATCHES = {
+    "table": evaluator.evaluate,
+    "chain": evaluate_chain,
+}
+
+
+def run_tests():
+    for _ in range(REPEAT):
+        for test in TESTS:
+            if test() is not True:
+                raise Exception(f"{test.__name__} failed")
+    return None
+
+
+def run_program(source: str):
+    return evaluator.evaluate(parser.parse(source), Environment())
+
+
+def timed(dispatch: str, fn, *args):
+    # 求值函数递归时按模块全局名字调用 evaluate，替换它即可切换整棵树的分派方式
+    table = evaluator.evaluate
+    evaluator.evaluate = DISPATCHES[dispatch]
+    timer = Timer()
+    timer.start()
+    try:
+        result = fn(*args)
+    finally:
+        timer.stop()
+        evaluator.evaluate = table
+    return result, timer.elapse()
+
+
+def main():
+    sys.setrecursionlimit(20000)
+    for dispatch in DISPATCHES:
+        _, elapsed = timed(dispatch, run_tests)
+        print(f"{'tests':<10} {dispatch:<7} {elapsed:>10}")
+    for name, source in PROGRAMS.items():
+        for dispatch in DISPATCHES:
+            result, elapsed = timed(dispatch, run_program, source)
+            print(f"{name:<10} {dispatch:<7} {elapsed:>10}  result={result.inspect()}")
+
+
+if __name__ == '__main__':
+    main()
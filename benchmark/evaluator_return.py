@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+求值器在 return 密集的递归程序上的执行耗时。
+运行方式：python -m benchmark.evaluator_return
+"""
+import sys
+
+from monkey_evaluate import closure_evaluator, evaluator, stack_evaluator
+from monkey_object.object import Environment
+from monkey_parser import parser
+from util.timer import Timer
+
+PROGRAMS = {
+    "fibonacci": """
+    let fibonacci = fn(x) {
+        if (x < 2) {
+            return x;
+        }
+        return fibonacci(x - 1) + fibonacci(x - 2);
+    };
+    fibonacci(20);
+    """,
+    "ackermann": """
+    let ackermann = fn(m, n) {
+        if (m == 0) {
+            return n + 1;
+        }
+        if (n == 0) {
+            return ackermann(m - 1, 1);
+        }
+        return ackermann(m - 1, ackermann(m, n - 1));
+    };
+    ackermann(2, 200);
+    """,
+    "search": """
+    let find = fn(arr, x) {
+        for (y in arr) {
+            if (y == x) {
+                return true;
+            }
+        }
+        return false;
+    };
+    let count = fn(n, arr) {
+        if (n == 0) {
+            return 0;
+        }
+        if (find(arr, n)) {
+            return 1 + count(n - 1, arr);
+        }
+        return count(n - 1, arr);
+    };
+    count(300, range(150));
+    """,
+}
+
+EVALUATORS = {
+    "tree": evaluator.evaluate,
+    "closure": closure_evaluator.evaluate,
+    "stack": stack_evaluator.evaluate,
+}
+
+
+def run_program(source: str, evaluate):
+    program = parser.parse(source)
+    timer = Timer()
+    timer.start()
+    result = evaluate(program, Environment())
+    timer.stop()
+    return result, timer.elapse()
+
+
+def main():
+    sys.setrecursionlimit(20000)
+    for name, source in PROGRAMS.items():
+        for kind, evaluate in EVALUATORS.items():
+            result, elapsed = run_program(source, evaluate)
+            print(f"{name:<10} {kind:<7} {elapsed:>10}  result={result.inspect()}")
+
+
+if __name__ == '__main__':
+    main()
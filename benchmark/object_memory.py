@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+统计运行时对象、栈帧、词法单元和语法树节点的平均内存占用（字节/个）。
+每种对象都与一个不带 __slots__ 的子类比较，后者带有 __dict__，相当于改用 __slots__ 之前的表示。
+运行方式：python -m benchmark.object_memory
+"""
+import tracemalloc
+
+from monkey_ast import ast
+from monkey_object import object
+from monkey_token.token import Token, IDENT, PLUS
+from monkey_vm.frame import Frame
+
+COUNT = 20000
+
+
+def with_dict(cls):
+    """不声明 __slots__ 的子类，实例重新带上 __dict__"""
+    return type(cls.__name__, (cls,), {})
+
+
+FN = object.CompiledFunction(instructions=b"", decoded=[])
+CLOSURE = object.Closure(fn=FN, free=[])
+TOKEN = Token(IDENT, "x")
+
+FACTORIES = {
+    "Integer": (object.Integer, lambda cls, i: cls((1 << 20) + i)),
+    "String": (object.String, lambda cls, i: cls("s")),
+    "HashPair": (object.HashPair, lambda cls, i: cls(object.TRUE, object.NULL)),
+    "Array": (object.Array, lambda cls, i: cls([])),
+    "Closure": (object.Closure, lambda cls, i: cls(fn=FN, free=[])),
+    "Frame": (Frame, lambda cls, i: cls(CLOSURE, 0)),
+    "Token": (Token, lambda cls, i: cls(PLUS, "+")),
+    "Identifier": (ast.Identifier, lambda cls, i: cls(TOKEN, "x")),
+    "InfixExpression": (ast.InfixExpression, lambda cls, i: cls(TOKEN, "+", None, None)),
+}
+
+
+def bytes_per_object(make) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [make(i) for i in range(COUNT)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # 扣除保存对象的列表本身
+    size = after - before - 8 * len(objects)
+    return size / COUNT
+
+
+def bytes_per_array_element(cls, make_array=object.Array) -> float:
+    """整数数组中每个元素的开销：元素对象本身加上列表中的指针"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    array = make_array([cls((1 << 20) + i) for i in range(COUNT)])
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / array.length()
+
+
+def main():
+    print(f"{'object':<16} {'__dict__':>10} {'__slots__':>10}")
+    for name, (cls, factory) in FACTORIES.items():
+        plain = with_dict(cls)
+        dict_size = bytes_per_object(lambda i: factory(plain, i))
+        slot_size = bytes_per_object(lambda i: factory(cls, i))
+        print(f"{name:<16} {dict_size:>10.1f} {slot_size:>10.1f}")
+    dict_size = bytes_per_array_element(with_dict(object.Integer))
+    slot_size = bytes_per_array_element(object.Integer)
+    print(f"{'array element':<16} {dict_size:>10.1f} {slot_size:>10.1f}")
+    # 数组字面量中的整数存放在 array('q') 中，装箱的 Integer 创建后即被释放
+    typed_size = bytes_per_array_element(object.Integer, object.new_array)
+    print(f"{'typed element':<16} {'':>10} {typed_size:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+比较栈虚拟机与寄存器虚拟机在相同程序上的指令条数和执行耗时。
+运行方式：python -m benchmark.register_vm
+"""
+from monkey_code import code
+from monkey_compiler.compiler import Compiler
+from monkey_compiler.register_compiler import RegisterCompiler
+from monkey_object import object
+from monkey_parser import parser
+from monkey_vm import vm
+from monkey_vm.register_vm import RegisterVM
+from util.timer import Timer
+from benchmark.vm_dispatch import PROGRAMS
+
+
+def stack_instruction_count(bytecode) -> int:
+    count = len(code.decode(bytecode.instructions))
+    for constant in bytecode.constants:
+        if isinstance(constant, object.CompiledFunction):
+            count += len(code.decode(constant.instructions))
+    return count
+
+
+def register_instruction_count(fn: object.RegisterFunction) -> int:
+    count = len(fn.instructions)
+    for constant in fn.registers:
+        if isinstance(constant, object.RegisterFunction):
+            count += register_instruction_count(constant)
+    return count
+
+
+def run_stack(source: str):
+    comp = Compiler()
+    err = comp.compile(parser.parse(source))
+    if err is not None:
+        raise Exception(f"compiler error: {err}")
+    bytecode = comp.bytecode()
+    machine = vm.VM(bytecode)
+    timer = Timer()
+    timer.start()
+    err = machine.run()
+    timer.stop()
+    if err is not None:
+        raise Exception(f"vm error: {err}")
+    return machine.last_popped_stack_elem(), stack_instruction_count(bytecode), timer.elapse()
+
+
+def run_register(source: str):
+    comp = RegisterCompiler()
+    err = comp.compile(parser.parse(source))
+    if err is not None:
+        raise Exception(f"compiler error: {err}")
+    main_fn = comp.bytecode()
+    machine = RegisterVM(main_fn)
+    timer = Timer()
+    timer.start()
+    err = machine.run()
+    timer.stop()
+    if err is not None:
+        raise Exception(f"vm error: {err}")
+    return machine.last_result(), register_instruction_count(main_fn), timer.elapse()
+
+
+def main():
+    for name, source in PROGRAMS.items():
+        for backend, run in [("stack", run_stack), ("register", run_register)]:
+            result, count, elapsed = run(source)
+            print(f"{name:<10} {backend:<9} instructions={count:<4} {elapsed:>10}  result={result.inspect()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+比较虚拟机两种指令分派方式（if/elif 分支链与查表）的执行耗时。
+运行方式：python -m benchmark.vm_dispatch
+"""
+from monkey_compiler.compiler import Compiler
+from monkey_parser import parser
+from monkey_vm import vm
+from util.timer import Timer
+
+PROGRAMS = {
+    "fibonacci": """
+    let fibonacci = fn(x) {
+        if (x == 0) {
+            return 0;
+        } else {
+            if (x == 1) {
+                return 1;
+            } else {
+                fibonacci(x - 1) + fibonacci(x - 2);
+            }
+        }
+    };
+    fibonacci(20);
+    """,
+    "closures": """
+    let newAdder = fn(a, b) {
+        let c = a + b;
+        fn(d) { c + d + a + b };
+    };
+    let countDown = fn(x, adder) {
+        if (x == 0) {
+            return adder(0);
+        } else {
+            adder(x);
+            countDown(x - 1, adder);
+        }
+    };
+    let run = fn(n) {
+        if (n == 0) {
+            return 0;
+        } else {
+            countDown(500, newAdder(n, 1)) + run(n - 1);
+        }
+    };
+    run(40);
+    """,
+}
+
+
+def run_program(source: str, dispatch: str):
+    comp = Compiler()
+    err = comp.compile(parser.parse(source))
+    if err is not None:
+        raise Exception(f"compiler error: {err}")
+    machine = vm.VM(comp.bytecode(), dispatch=dispatch)
+    timer = Timer()
+    timer.start()
+    err = machine.run()
+    timer.stop()
+    if err is not None:
+        raise Exception(f"vm error: {err}")
+    return machine.last_popped_stack_elem(), timer.elapse()
+
+
+def main():
+    for name, source in PROGRAMS.items():
+        for dispatch in [vm.DISPATCH_SWITCH, vm.DISPATCH_TABLE]:
+            result, elapsed = run_program(source, dispatch)
+            print(f"{name:<10} {dispatch:<7} {elapsed:>10}  result={result.inspect()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,13 @@
 from abc import abstractmethod
-from dataclasses import dataclass
-from typing import Dict
+import dataclasses
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, Optional
 
 from monkey_token.token import Token
 
 
 class Node:
+    __slots__ = ()
 
     @abstractmethod
     def literal(self) -> str:
@@ -17,6 +19,7 @@ class Node:
 
 
 class Statement(Node):
+    __slots__ = ()
     token = None
     expression = None
 
@@ -33,6 +36,7 @@ class Statement(Node):
 
 
 class Expression(Node):
+    __slots__ = ()
     token = None
     value = None
     operator = None
@@ -51,7 +55,7 @@ class Expression(Node):
         return self.string()
 
 
-@dataclass
+@dataclass(slots=True)
 class Program(Node):
     statements: list[Statement]
 
@@ -74,10 +78,13 @@ class Program(Node):
         return self.string()
 
 
-@dataclass
+@dataclass(slots=True)
 class Identifier(Expression):
     token: Token
     value: str
+    # 词法地址：向外跨过几层作用域、在那一层的第几个槽位，由 monkey_evaluate/resolver.py 填写
+    depth: Optional[int] = field(default=None, compare=False, repr=False)
+    slot: int = field(default=0, compare=False, repr=False)
 
     def literal(self):
         return self.token.literal
@@ -99,7 +106,7 @@ class Identifier(Expression):
         return cls(exp.token, exp.value)
 
 
-@dataclass
+@dataclass(slots=True)
 class LetStatement(Statement):
     token: Token = None
     name: Identifier = None
@@ -127,7 +134,7 @@ class LetStatement(Statement):
         return cls(stmt.token, stmt.name, stmt.value)
 
 
-@dataclass
+@dataclass(slots=True)
 class ReturnStatement(Statement):
     token: Token = None
     return_value: Expression = None
@@ -145,7 +152,7 @@ class ReturnStatement(Statement):
         return f"{self.literal()} {'' if self.return_value is None else self.return_value};"
 
 
-@dataclass
+@dataclass(slots=True)
 class ExpressionStatement(Statement):
     token: Token = None
     expression: Expression = None
@@ -169,7 +176,7 @@ class ExpressionStatement(Statement):
         return f"{self.string()}"
 
 
-@dataclass
+@dataclass(slots=True)
 class IntegerLiteral(Expression):
     token: Token = None
     value: int = 0
@@ -194,7 +201,7 @@ class IntegerLiteral(Expression):
         return cls(exp.token, exp.value)
 
 
-@dataclass
+@dataclass(slots=True)
 class StringLiteral(Expression):
     token: Token = None
     value: str = None
@@ -219,7 +226,7 @@ class StringLiteral(Expression):
         return cls(exp.token, exp.value)
 
 
-@dataclass
+@dataclass(slots=True)
 class PrefixExpression(Expression):
     token: Token = None
     operator: str = None
@@ -243,7 +250,7 @@ class PrefixExpression(Expression):
         return self.string()
 
 
-@dataclass
+@dataclass(slots=True)
 class InfixExpression(Expression):
     token: Token = None
     operator: str = None
@@ -272,7 +279,7 @@ class InfixExpression(Expression):
         return self.string()
 
 
-@dataclass
+@dataclass(slots=True)
 class Boolean(Expression):
     token: Token
     value: bool
@@ -297,7 +304,7 @@ class Boolean(Expression):
         return cls(exp.token, exp.value)
 
 
-@dataclass
+@dataclass(slots=True)
 class BlockStatement(Statement):
     token: Token = None
     statements: list[Statement] = None
@@ -318,7 +325,7 @@ class BlockStatement(Statement):
         return self.string()
 
 
-@dataclass
+@dataclass(slots=True)
 class IFExpression(Expression):
     token: Token = None
     condition: Expression = None
@@ -348,12 +355,68 @@ class IFExpression(Expression):
         return cls(exp.token, exp.condition, exp.consequence, exp.alternative)
 
 
-@dataclass
+@dataclass(slots=True)
+class WhileExpression(Expression):
+    """while (condition) { body }，结果为 null"""
+    token: Token = None
+    condition: Expression = None
+    body: BlockStatement = None
+
+    def expression(self):
+        pass
+
+    def literal(self) -> str:
+        return self.token.literal
+
+    def string(self):
+        return f"while ({self.condition.string()}) {{{self.body.string()}}}"
+
+    def __repr__(self):
+        return self.string()
+
+    @classmethod
+    def copy(cls, exp: Expression):
+        return cls(exp.token, exp.condition, exp.body)
+
+
+@dataclass(slots=True)
+class ForExpression(Expression):
+    """for (variable in iterable) { body }，依次把数组的每个元素绑定到 variable，结果为 null"""
+    token: Token = None
+    variable: Identifier = None
+    iterable: Expression = None
+    body: BlockStatement = None
+    # 函数中的循环每次迭代使用的作用域 (循环变量 -> 槽位)，以及循环变量在外层作用域中的词法地址，
+    # 由 monkey_evaluate/resolver.py 填写；顶层的循环变量是全局变量，layout 为 None
+    layout: Optional[Dict[str, int]] = field(default=None, compare=False, repr=False)
+    depth: int = field(default=0, compare=False, repr=False)
+    slot: int = field(default=0, compare=False, repr=False)
+
+    def expression(self):
+        pass
+
+    def literal(self) -> str:
+        return self.token.literal
+
+    def string(self):
+        return f"for ({self.variable.string()} in {self.iterable.string()}) {{{self.body.string()}}}"
+
+    def __repr__(self):
+        return self.string()
+
+    @classmethod
+    def copy(cls, exp: Expression):
+        return cls(exp.token, exp.variable, exp.iterable, exp.body)
+
+
+@dataclass(slots=True)
 class FunctionLiteral(Expression):
     name: str=''
     token: Token = None
     parameters: list[Identifier] = None
     body: BlockStatement = None
+    # 变量名 -> 槽位，由 monkey_evaluate/resolver.py 填写
+    layout: Optional[Dict[str, int]] = field(default=None, compare=False, repr=False)
 
     def expression(self):
         pass
@@ -377,7 +440,7 @@ class FunctionLiteral(Expression):
         return cls(exp.name, exp.token, exp.parameters, exp.body)
 
 
-@dataclass
+@dataclass(slots=True)
 class CallExpression(Expression):
     token: Token = None
     function: Expression = None
@@ -403,7 +466,7 @@ class CallExpression(Expression):
         return cls(exp.token, exp.function, exp.arguments)
 
 
-@dataclass
+@dataclass(slots=True)
 class ArrayLiteral(Expression):
     token: Token = None
     elements: list[Expression] = None
@@ -428,7 +491,7 @@ class ArrayLiteral(Expression):
         return cls(exp.token, exp.elements)
 
 
-@dataclass
+@dataclass(slots=True)
 class HashLiteral(Expression):
     token: Token = None
     pairs: Dict[Expression, Expression] = None
@@ -457,7 +520,7 @@ class HashLiteral(Expression):
         return cls(exp.token, exp.pairs)
 
 
-@dataclass
+@dataclass(slots=True)
 class IndexExpression(Expression):
     token: Token = None
     left: Expression = None
@@ -480,7 +543,31 @@ class IndexExpression(Expression):
         return cls(exp.token, exp.left, exp.index)
 
 
-@dataclass
+@dataclass(slots=True)
+class AssignExpression(Expression):
+    """name = value，修改已定义的变量，结果为赋给变量的值"""
+    token: Token = None
+    name: Identifier = None
+    value: Expression = None
+
+    def expression(self):
+        pass
+
+    def literal(self) -> str:
+        return self.token.literal
+
+    def string(self):
+        return f"({self.name.string()} = {self.value.string()})"
+
+    def __repr__(self):
+        return self.string()
+
+    @classmethod
+    def copy(cls, exp: Expression):
+        return cls(exp.token, exp.name, exp.value)
+
+
+@dataclass(slots=True)
 class MacroLiteral(Expression):
     token: Token = None
     parameters: list[Expression] = None
@@ -511,3 +598,18 @@ class MacroLiteral(Expression):
     @classmethod
     def copy(cls, exp: Expression):
         return cls(exp.token, exp.parameters, exp.body)
+
+
+def children(node: Node) -> Iterator[Node]:
+    """node 的直接子节点"""
+    for f in dataclasses.fields(node):
+        value = getattr(node, f.name)
+        if isinstance(value, Node):
+            yield value
+        elif isinstance(value, list):
+            yield from (v for v in value if isinstance(v, Node))
+        elif isinstance(value, dict):
+            for key, val in value.items():
+                if isinstance(key, Node):
+                    yield key
+                    yield val
@@ -22,6 +22,12 @@ def modify(node: Node, modifier: Callable[[Node], Node]) -> Node:
         node.condition = modify(node.condition, modifier)
         node.consequence = modify(node.consequence, modifier)
         node.alternative = modify(node.alternative, modifier)
+    elif isinstance(node, WhileExpression):
+        node.condition = modify(node.condition, modifier)
+        node.body = modify(node.body, modifier)
+    elif isinstance(node, ForExpression):
+        node.iterable = modify(node.iterable, modifier)
+        node.body = modify(node.body, modifier)
     elif isinstance(node, BlockStatement):
         for i, stmt in enumerate(node.statements):
             node.statements[i] = modify(stmt, modifier)
@@ -29,6 +35,8 @@ def modify(node: Node, modifier: Callable[[Node], Node]) -> Node:
         node.return_value = modify(node.return_value, modifier)
     elif isinstance(node, LetStatement):
         node.value = modify(node.value, modifier)
+    elif isinstance(node, AssignExpression):
+        node.value = modify(node.value, modifier)
     elif isinstance(node, FunctionLiteral):
         for i, param in enumerate(node.parameters):
             node.parameters[i] = modify(param, modifier)
@@ -35,6 +35,22 @@ OpGetBuiltin = 27
 OpClosure = 28
 OpGetFree = 29
 OpCurrentClosure = 30
+# 超级指令：由编译器的窥孔优化把常见指令序列合并而成
+OpGetLocalConstantAdd = 31
+OpConstantGreaterThanJumpNotTruthy = 32
+OpGetGlobalCall = 33
+OpGetLocalGetLocal = 34
+# 尾调用：复用当前栈帧调用闭包，调用内置函数时与 OpCall 相同
+OpTailCall = 35
+OpConstantCall = 36
+# 被闭包捕获且会被赋值的局部变量保存在 object.Cell 中，见 monkey_compiler/cells.py
+OpMakeCell = 37
+OpGetCell = 38
+OpSetCell = 39
+OpGetFreeCell = 40
+OpSetFree = 41
+# for-in 循环：弹出被遍历的值，是数组时压入它的长度，否则报错
+OpForLength = 42
 
 
 @dataclass
@@ -73,6 +89,25 @@ definitions: Dict[Opcode, Definition] = {
     OpClosure: Definition(name="OpClosure", operand_widths=[2, 1]),
     OpGetFree: Definition(name="OpGetFree", operand_widths=[1]),
     OpCurrentClosure: Definition(name="OpCurrentClosure", operand_widths=[]),
+    OpGetLocalConstantAdd: Definition(name="OpGetLocalConstantAdd", operand_widths=[1, 2]),
+    OpConstantGreaterThanJumpNotTruthy: Definition(name="OpConstantGreaterThanJumpNotTruthy", operand_widths=[2, 2]),
+    OpGetGlobalCall: Definition(name="OpGetGlobalCall", operand_widths=[2, 1]),
+    OpGetLocalGetLocal: Definition(name="OpGetLocalGetLocal", operand_widths=[1, 1]),
+    OpTailCall: Definition(name="OpTailCall", operand_widths=[1]),
+    OpConstantCall: Definition(name="OpConstantCall", operand_widths=[2, 1]),
+    OpMakeCell: Definition(name="OpMakeCell", operand_widths=[1]),
+    OpGetCell: Definition(name="OpGetCell", operand_widths=[1]),
+    OpSetCell: Definition(name="OpSetCell", operand_widths=[1]),
+    OpGetFreeCell: Definition(name="OpGetFreeCell", operand_widths=[1]),
+    OpSetFree: Definition(name="OpSetFree", operand_widths=[1]),
+    OpForLength: Definition(name="OpForLength", operand_widths=[]),
+}
+
+# 操作数是跳转目标的指令：操作码 -> 跳转目标所在的操作数下标
+jump_operands: Dict[Opcode, int] = {
+    OpJump: 0,
+    OpJumpNotTruthy: 0,
+    OpConstantGreaterThanJumpNotTruthy: 1,
 }
 
 @dataclass
@@ -158,4 +193,45 @@ def read_uint16(ins: bytes) -> int:
 
 def read_uint8(data):
     """从字节串读取1个无符号字节(8位)"""
-    return data[0] if data else 0
\ No newline at end of file
+    return data[0] if data else 0
+
+
+DecodedInstruction = Tuple[Opcode, int, int]
+
+
+def decode(ins: bytes) -> List[DecodedInstruction]:
+    """
+    把字节码预解码为 (操作码, 操作数1, 操作数2) 元组列表，缺省的操作数补0。
+    跳转指令的目标由字节偏移改写为元组下标，执行时不再需要切片和查表。
+    遇到未定义的操作码时停止解码，由虚拟机在执行到该指令时报错。
+    """
+    decoded = []
+    offsets = {}
+    i = 0
+    while i < len(ins):
+        op = ins[i]
+        offsets[i] = len(decoded)
+        define = definitions.get(op, None)
+        if define is None:
+            decoded.append((op, 0, 0))
+            break
+        operands = [0, 0]
+        offset = i + 1
+        for j, width in enumerate(define.operand_widths):
+            if width == 2:
+                operands[j] = struct.unpack_from('>H', ins, offset)[0]
+            elif width == 1:
+                operands[j] = ins[offset]
+            offset += width
+        decoded.append((op, operands[0], operands[1]))
+        i = offset
+    offsets[i] = len(decoded)
+    for idx, (op, operand, extra) in enumerate(decoded):
+        pos = jump_operands.get(op, None)
+        if pos is None:
+            continue
+        if pos == 0:
+            decoded[idx] = (op, offsets.get(operand, len(decoded)), extra)
+        else:
+            decoded[idx] = (op, operand, offsets.get(extra, len(decoded)))
+    return decoded
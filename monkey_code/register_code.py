@@ -0,0 +1,123 @@
+"""
+寄存器虚拟机的指令集。
+
+每条指令是定长元组 (操作码, a, b, c)，缺省的操作数补0。
+局部变量、参数、临时值和常量都位于栈帧的寄存器中，指令直接指明源寄存器和目的寄存器。
+"""
+from dataclasses import dataclass
+from io import StringIO
+from typing import Dict, List, Tuple
+
+Opcode = int
+Instruction = Tuple[Opcode, int, int, int]
+
+# 操作数类型：R 寄存器，I 下标或数量，J 跳转目标（指令下标）
+REGISTER = 'R'
+INDEX = 'I'
+JUMP = 'J'
+
+OpMove = 1
+OpGetGlobal = 2
+OpSetGlobal = 3
+OpGetBuiltin = 4
+OpGetFree = 5
+OpCurrentClosure = 6
+OpAdd = 7
+OpSub = 8
+OpMul = 9
+OpDiv = 10
+OpEqual = 11
+OpNotEqual = 12
+OpGreaterThan = 13
+OpMinus = 14
+OpBang = 15
+OpJump = 16
+OpJumpNotTruthy = 17
+OpArray = 18
+OpHash = 19
+OpIndex = 20
+OpCall = 21
+OpReturn = 22
+OpClosure = 23
+OpTailCall = 24
+OpMakeCell = 25
+OpGetCell = 26
+OpSetCell = 27
+OpGetFreeCell = 28
+OpSetFree = 29
+OpForLength = 30
+
+
+@dataclass
+class Definition:
+    name: str
+    operands: str
+
+
+definitions: Dict[Opcode, Definition] = {
+    # a = b
+    OpMove: Definition(name="OpMove", operands="RR"),
+    # a = globals[b]
+    OpGetGlobal: Definition(name="OpGetGlobal", operands="RI"),
+    # globals[a] = b
+    OpSetGlobal: Definition(name="OpSetGlobal", operands="IR"),
+    OpGetBuiltin: Definition(name="OpGetBuiltin", operands="RI"),
+    OpGetFree: Definition(name="OpGetFree", operands="RI"),
+    OpCurrentClosure: Definition(name="OpCurrentClosure", operands="R"),
+    # a = b op c
+    OpAdd: Definition(name="OpAdd", operands="RRR"),
+    OpSub: Definition(name="OpSub", operands="RRR"),
+    OpMul: Definition(name="OpMul", operands="RRR"),
+    OpDiv: Definition(name="OpDiv", operands="RRR"),
+    OpEqual: Definition(name="OpEqual", operands="RRR"),
+    OpNotEqual: Definition(name="OpNotEqual", operands="RRR"),
+    OpGreaterThan: Definition(name="OpGreaterThan", operands="RRR"),
+    # a = op b
+    OpMinus: Definition(name="OpMinus", operands="RR"),
+    OpBang: Definition(name="OpBang", operands="RR"),
+    OpJump: Definition(name="OpJump", operands="J"),
+    # a 为假时跳转到 b
+    OpJumpNotTruthy: Definition(name="OpJumpNotTruthy", operands="RJ"),
+    # a = [b, b+1, ..., b+c-1]
+    OpArray: Definition(name="OpArray", operands="RRI"),
+    # a = {b: b+1, ..., b+c-2: b+c-1}
+    OpHash: Definition(name="OpHash", operands="RRI"),
+    # a = b[c]
+    OpIndex: Definition(name="OpIndex", operands="RRR"),
+    # a = b(b+1, ..., b+c)
+    OpCall: Definition(name="OpCall", operands="RRI"),
+    OpReturn: Definition(name="OpReturn", operands="R"),
+    # a = 闭包(函数原型 b, 自由变量 c, c+1, ...)，自由变量个数由函数原型给出
+    OpClosure: Definition(name="OpClosure", operands="RRR"),
+    # 与 OpCall 相同，但被调闭包原地复用当前栈帧，返回值直接交给当前函数的调用者
+    OpTailCall: Definition(name="OpTailCall", operands="RRI"),
+    # a = Cell(b)
+    OpMakeCell: Definition(name="OpMakeCell", operands="RR"),
+    # a = b.value
+    OpGetCell: Definition(name="OpGetCell", operands="RR"),
+    # a.value = b
+    OpSetCell: Definition(name="OpSetCell", operands="RR"),
+    # a = free[b].value
+    OpGetFreeCell: Definition(name="OpGetFreeCell", operands="RI"),
+    # free[a].value = b
+    OpSetFree: Definition(name="OpSetFree", operands="IR"),
+    # a = b 的长度，b 不是数组时报错（for-in 循环）
+    OpForLength: Definition(name="OpForLength", operands="RR"),
+}
+
+
+def make(op: Opcode, *operands) -> Instruction:
+    padded = list(operands) + [0] * (3 - len(operands))
+    return op, padded[0], padded[1], padded[2]
+
+
+def to_string(instructions: List[Instruction]) -> str:
+    out = StringIO()
+    for i, ins in enumerate(instructions):
+        define = definitions.get(ins[0], None)
+        if define is None:
+            out.write(f"{i:04d} ERROR: opcode {ins[0]} undefined\n")
+            continue
+        operands = " ".join(str(operand) for operand in ins[1: 1 + len(define.operands)])
+        out.write(f"{i:04d} {define.name} {operands}".rstrip() + "\n")
+    return out.getvalue()
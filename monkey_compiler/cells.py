@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+赋值语句的静态分析。
+
+闭包创建时复制自由变量的值，此后闭包与外层函数对变量的修改互相不可见。
+被内层函数引用、同时又被赋值的局部变量改为保存一个 object.Cell：
+闭包复制的是 Cell 本身，读写都经过 Cell，双方看到的就是同一个变量。
+分析只按名字进行，同名的其他变量也会被放进 Cell，结果偏保守但总是正确的。
+"""
+from typing import Set
+
+from monkey_ast import ast
+from monkey_ast.ast import children
+
+
+def assigned_names(node: ast.Node) -> Set[str]:
+    """node 中所有赋值表达式的目标，包括嵌套函数中的"""
+    names = set()
+    if isinstance(node, ast.AssignExpression):
+        names.add(node.name.value)
+    for child in children(node):
+        names |= assigned_names(child)
+    return names
+
+
+def cell_names(body: ast.BlockStatement) -> Set[str]:
+    """函数体中既被赋值、又被内层函数引用的变量名"""
+    assigned = set()
+    captured = set()
+
+    def visit(node: ast.Node, nested: bool):
+        if isinstance(node, ast.AssignExpression):
+            assigned.add(node.name.value)
+        elif isinstance(node, ast.Identifier) and nested:
+            captured.add(node.value)
+        elif isinstance(node, ast.FunctionLiteral):
+            nested = True
+        for child in children(node):
+            visit(child, nested)
+
+    visit(body, False)
+    return assigned & captured
@@ -1,7 +1,9 @@
-from typing import List
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from monkey_ast import ast
 from monkey_code import code
+from monkey_compiler.cells import assigned_names, cell_names
+from monkey_compiler.fold import fold_constants
 from monkey_compiler.symbol_table import *
 from monkey_object import builtins
 from monkey_object import object
@@ -32,12 +34,120 @@ class CompilationScope:
     instructions: code.Instructions
     last_instruction: EmittedInstruction
     previous_instruction: EmittedInstruction
+    # 函数中需要放进 Cell 的局部变量名，见 cells.cell_names
+    cells: Set[str]
 
     def __init__(self, instructions: code.Instructions, last_instruction: EmittedInstruction,
-                 previous_instruction: EmittedInstruction):
+                 previous_instruction: EmittedInstruction, cells: Set[str] = None):
         self.instructions = instructions
         self.last_instruction = last_instruction
         self.previous_instruction = previous_instruction
+        self.cells = set() if cells is None else cells
+
+# 窥孔优化时合并的指令序列及对应的超级指令
+superinstructions = [
+    ((code.OpGetLocal, code.OpConstant, code.OpAdd), code.OpGetLocalConstantAdd),
+    ((code.OpConstant, code.OpGreaterThan, code.OpJumpNotTruthy), code.OpConstantGreaterThanJumpNotTruthy),
+    ((code.OpGetGlobal, code.OpCall), code.OpGetGlobalCall),
+    ((code.OpConstant, code.OpCall), code.OpConstantCall),
+    ((code.OpGetLocal, code.OpGetLocal), code.OpGetLocalGetLocal),
+]
+
+
+def fuse_superinstructions(ins: code.Instructions) -> code.Instructions:
+    """
+    窥孔优化：把 superinstructions 中的指令序列合并为一条超级指令，并修正跳转目标。
+    序列中除第一条以外的指令如果是跳转目标，则不合并。
+    """
+    parsed = []
+    view = memoryview(ins)
+    i = 0
+    while i < len(ins):
+        define, err = code.lookup(ins[i])
+        if err is not None:
+            return ins
+        operands, n = code.read_operands(define, view[i + 1:])
+        parsed.append((i, ins[i], operands))
+        i += 1 + n
+    end = i
+    targets = set()
+    for _, op, operands in parsed:
+        pos = code.jump_operands.get(op, None)
+        if pos is not None:
+            targets.add(operands[pos])
+
+    fused = []
+    i = 0
+    while i < len(parsed):
+        for pattern, super_op in superinstructions:
+            window = parsed[i: i + len(pattern)]
+            if len(window) != len(pattern):
+                continue
+            if any(op != expected for (_, op, _), expected in zip(window, pattern)):
+                continue
+            if any(offset in targets for offset, _, _ in window[1:]):
+                continue
+            operands = [operand for _, _, ops in window for operand in ops]
+            fused.append((window[0][0], super_op, operands))
+            i += len(pattern)
+            break
+        else:
+            fused.append(parsed[i])
+            i += 1
+
+    new_offsets = {}
+    pos = 0
+    for offset, op, _ in fused:
+        new_offsets[offset] = pos
+        pos += 1 + sum(code.definitions[op].operand_widths)
+    new_offsets[end] = pos
+    out = code.Instructions()
+    for _, op, operands in fused:
+        jump = code.jump_operands.get(op, None)
+        if jump is not None:
+            operands = list(operands)
+            operands[jump] = new_offsets.get(operands[jump], operands[jump])
+        out += code.make(op, *operands)
+    return out
+
+
+def mark_tail_calls(ins: code.Instructions) -> code.Instructions:
+    """
+    把函数体中处于尾部位置的 OpCall 原地改写为 OpTailCall。
+    调用之后执行的下一条指令（紧跟其后，或经过 OpJump 到达）是 OpReturnValue 时，调用处于尾部位置。
+    两条指令宽度相同，不需要修正跳转目标；OpReturnValue 保留在原处，供调用内置函数时返回。
+    """
+    i = 0
+    while i < len(ins):
+        define, err = code.lookup(ins[i])
+        if err is not None:
+            return ins
+        end = i + 1 + sum(define.operand_widths)
+        if ins[i] == code.OpCall and next_executed_op(ins, end) == code.OpReturnValue:
+            ins[i] = code.OpTailCall
+        i = end
+    return ins
+
+
+def next_executed_op(ins: code.Instructions, pos: int) -> Optional[code.Opcode]:
+    """从 pos 开始跟随无条件跳转，返回实际执行的下一条指令的操作码"""
+    seen = set()
+    while pos < len(ins) and ins[pos] == code.OpJump and pos not in seen:
+        seen.add(pos)
+        pos = code.read_uint16(ins[pos + 1:])
+    if pos >= len(ins):
+        return None
+    return ins[pos]
+
+
+def constant_key(obj: object.Object) -> Optional[Tuple[str, Any]]:
+    """整数和字符串常量的去重键，其他常量不参与去重"""
+    if type(obj) is object.Integer and type(obj.value) is int:
+        return object.INTEGER_OBJ, obj.value
+    if type(obj) is object.String:
+        return object.STRING_OBJ, obj.value
+    return None
+
 
 @dataclass()
 class Compiler:
@@ -48,10 +158,29 @@ class Compiler:
     symbol_table: SymbolTable = None
     scopes: List[CompilationScope] = None
     scope_index: int = 0
+    # 是否启用优化（常量折叠、超级指令）
+    optimize: bool = False
+    # 整数和字符串常量的去重索引：(类型, 值) -> 常量池下标
+    constant_indexes: Dict[Tuple[str, Any], int] = None
+    # 当前所在代码块的嵌套深度，0 表示程序的顶层语句
+    block_depth: int = 0
+    # 已编译的 for 循环个数，用来生成隐藏变量的名字
+    loop_count: int = 0
+    # 程序中被赋值过的变量名，这些全局变量不能当作常量引用
+    reassigned: Set[str] = None
+    # 由 new_with_state 创建时为 True：同一个程序分多次编译（如 REPL），
+    # 之后的输入可能给任何全局变量赋值，因此不把全局变量当作常量引用
+    incremental: bool = False
 
-    def __init__(self):
+    def __init__(self, optimize: bool = False):
+        self.optimize = optimize
         self.instructions = code.Instructions()
         self.constants = []
+        self.constant_indexes = {}
+        self.block_depth = 0
+        self.loop_count = 0
+        self.reassigned = set()
+        self.incremental = False
         self.last_instruction = EmittedInstruction(op_code=0, pos=0)
         self.previous_instruction = EmittedInstruction(op_code=0, pos=0)
         self.symbol_table = SymbolTable()
@@ -64,14 +193,22 @@ class Compiler:
         self.scope_index = 0
 
     @staticmethod
-    def new_with_state(s: SymbolTable, constants: List[object.Object]):
-        compiler = Compiler()
+    def new_with_state(s: SymbolTable, constants: List[object.Object], optimize: bool = False):
+        compiler = Compiler(optimize)
+        compiler.incremental = True
         compiler.symbol_table = s
         compiler.constants = constants
+        for i, constant in enumerate(constants):
+            key = constant_key(constant)
+            if key is not None:
+                compiler.constant_indexes.setdefault(key, i)
         return compiler
 
     def compile(self, node: ast.Node):
         if isinstance(node, ast.Program):
+            if self.optimize:
+                node = fold_constants(node)
+                self.reassigned = assigned_names(node)
             for s in node.statements:
                 err = self.compile(s)
                 if err is not None:
@@ -153,24 +290,34 @@ class Compiler:
                     self.remove_last_pop()
             after_alternative_pos = len(self.current_instructions())
             self.change_operand(jump_pos, after_alternative_pos)
+        elif isinstance(node, ast.WhileExpression):
+            return self.compile_while_expression(node)
+        elif isinstance(node, ast.ForExpression):
+            return self.compile_for_expression(node)
         elif isinstance(node, ast.IntegerLiteral):
-            integer = object.Integer(node.value)
+            integer = object.new_integer(node.value)
             pos = self.add_constant(integer)
             self.emit(code.OpConstant, pos)
         elif isinstance(node, ast.BlockStatement):
+            self.block_depth += 1
             for s in node.statements:
                 err = self.compile(s)
                 if err is not None:
+                    self.block_depth -= 1
                     return err
+            self.block_depth -= 1
         elif isinstance(node, ast.LetStatement):
-            symbol = self.symbol_table.define(node.name.value)
+            symbol = self.define(node.name.value)
+            symbol.assignments += 1
             err = self.compile(node.value)
             if err is not None:
                 return err
-            if symbol.scope == GlobalScope:
-                self.emit(code.OpSetGlobal, symbol.index)
-            else:
-                self.emit(code.OpSetLocal, symbol.index)
+            if self.optimize and not self.incremental and self.block_depth == 0 \
+                    and symbol.scope == GlobalScope and symbol.name not in self.reassigned:
+                symbol.constant_index = self.global_constant(node.value)
+            self.store_symbol(symbol)
+        elif isinstance(node, ast.AssignExpression):
+            return self.compile_assign_expression(node)
         elif isinstance(node, ast.Identifier):
             symbol, ok = self.symbol_table.resolve(node.value)
             if not ok:
@@ -206,10 +353,15 @@ class Compiler:
             self.emit(code.OpIndex)
         elif isinstance(node, ast.FunctionLiteral):
             self.enter_scope()
+            self.scopes[self.scope_index].cells = cell_names(node.body)
             if node.name != "":
                 self.symbol_table.define_function_name(node.name)
             for p in node.parameters:
-                self.symbol_table.define(p.value)
+                symbol = self.define(p.value)
+                if symbol.cell:
+                    # 参数由调用者放在栈槽中，进入函数时再装进 Cell
+                    self.emit(code.OpGetLocal, symbol.index)
+                    self.emit(code.OpMakeCell, symbol.index)
             err = self.compile(node.body)
             if err is not None:
                 return err
@@ -219,9 +371,15 @@ class Compiler:
                 self.emit(code.OpReturn)
             free_symbols = self.symbol_table.free_symbols
             num_locals = self.symbol_table.num_definitions
-            instructions = self.leave_scope()
+            instructions = mark_tail_calls(self.leave_scope())
+            if self.optimize:
+                instructions = fuse_superinstructions(instructions)
             for s in free_symbols:
-                self.load_symbol(s)
+                if s.cell:
+                    # 传给闭包的是 Cell 本身
+                    self.emit(code.OpGetLocal if s.scope == LocalScope else code.OpGetFree, s.index)
+                else:
+                    self.load_symbol(s)
             compiled_function = object.CompiledFunction(
                 instructions=instructions,
                 num_locals=num_locals,
@@ -245,15 +403,134 @@ class Compiler:
             self.emit(code.OpCall, len(node.arguments))
         return None
 
-    def load_symbol(self, symbol):
+    def compile_while_expression(self, node: ast.WhileExpression):
+        """
+        循环条件;  OpJumpNotTruthy 循环结束;  循环体;  OpJump 循环条件;  循环结束: OpNull
+        循环体中的表达式语句各自弹出结果，每次迭代结束时栈恢复原状。
+        """
+        loop_start = len(self.current_instructions())
+        err = self.compile(node.condition)
+        if err is not None:
+            return err
+        jump_not_truthy_pos = self.emit(code.OpJumpNotTruthy, 9999)
+        err = self.compile(node.body)
+        if err is not None:
+            return err
+        self.emit(code.OpJump, loop_start)
+        self.change_operand(jump_not_truthy_pos, len(self.current_instructions()))
+        self.emit(code.OpNull)
+        return None
+
+    def compile_for_expression(self, node: ast.ForExpression):
+        """
+        数组、长度和下标保存在隐藏变量中（名字不是合法标识符，不会与用户变量冲突），
+        之后与 while 循环相同：while (length > index) { variable = array[index]; 循环体; index = index + 1 }
+        函数中的循环变量每次迭代都是新的绑定：闭包创建时复制变量的值，需要放进 Cell 的循环变量
+        每次迭代都装进新的 Cell（见 store_symbol）。顶层的循环变量是全局变量。
+        """
+        err = self.compile(node.iterable)
+        if err is not None:
+            return err
+        self.loop_count += 1
+        array = self.symbol_table.define(f"for.{self.loop_count}.array")
+        self.store_symbol(array)
+        self.load_symbol(array)
+        self.emit(code.OpForLength)
+        length = self.symbol_table.define(f"for.{self.loop_count}.length")
+        self.store_symbol(length)
+        self.emit(code.OpConstant, self.add_constant(object.new_integer(0)))
+        index = self.symbol_table.define(f"for.{self.loop_count}.index")
+        self.store_symbol(index)
+
+        loop_start = len(self.current_instructions())
+        self.load_symbol(length)
+        self.load_symbol(index)
+        self.emit(code.OpGreaterThan)
+        jump_not_truthy_pos = self.emit(code.OpJumpNotTruthy, 9999)
+        self.load_symbol(array)
+        self.load_symbol(index)
+        self.emit(code.OpIndex)
+        self.store_symbol(self.define(node.variable.value))
+        err = self.compile(node.body)
+        if err is not None:
+            return err
+        self.load_symbol(index)
+        self.emit(code.OpConstant, self.add_constant(object.new_integer(1)))
+        self.emit(code.OpAdd)
+        self.store_symbol(index)
+        self.emit(code.OpJump, loop_start)
+        self.change_operand(jump_not_truthy_pos, len(self.current_instructions()))
+        self.emit(code.OpNull)
+        return None
+
+    def global_constant(self, value: ast.Expression) -> Optional[int]:
+        """
+        顶层 let 语句的值在编译期已知时，返回它在常量池中的下标。
+        顶层的函数字面量没有自由变量，其闭包可以在编译期创建。
+        """
+        # 字面量已经加入常量池，add_constant 去重后返回原来的下标
+        if isinstance(value, ast.IntegerLiteral):
+            return self.add_constant(object.new_integer(value.value))
+        if isinstance(value, ast.StringLiteral):
+            return self.add_constant(object.String(value.value))
+        if isinstance(value, ast.FunctionLiteral) and self.last_instruction_is(code.OpClosure):
+            ins = self.current_instructions()
+            pos = self.scopes[self.scope_index].last_instruction.pos
+            fn_index = code.read_uint16(ins[pos + 1:])
+            num_free = code.read_uint8(ins[pos + 3:])
+            if num_free == 0:
+                return self.add_constant(object.Closure(fn=self.constants[fn_index], free=[]))
+        return None
+
+    def compile_assign_expression(self, node: ast.AssignExpression):
+        """写入变量后再读出，赋值表达式的值就是赋给变量的值"""
+        name = node.name.value
+        symbol, ok = self.symbol_table.resolve(name)
+        if not ok:
+            return f"undefined variable: {name}"
+        if symbol.scope == BuiltinScope or symbol.scope == FunctionScope:
+            return f"cannot assign to {name}"
+        err = self.compile(node.value)
+        if err is not None:
+            return err
+        symbol.assignments += 1
         if symbol.scope == GlobalScope:
+            self.emit(code.OpSetGlobal, symbol.index)
+        elif symbol.scope == FreeScope:
+            self.emit(code.OpSetFree, symbol.index)
+        elif symbol.cell:
+            self.emit(code.OpSetCell, symbol.index)
+        else:
+            self.emit(code.OpSetLocal, symbol.index)
+        self.load_symbol(symbol)
+        return None
+
+    def define(self, name: str) -> Symbol:
+        symbol = self.symbol_table.define(name)
+        symbol.cell = symbol.scope == LocalScope and name in self.scopes[self.scope_index].cells
+        return symbol
+
+    def store_symbol(self, symbol):
+        """初始化变量：let 语句和 for 循环变量"""
+        if symbol.scope == GlobalScope:
+            self.emit(code.OpSetGlobal, symbol.index)
+        elif symbol.cell:
+            self.emit(code.OpMakeCell, symbol.index)
+        else:
+            self.emit(code.OpSetLocal, symbol.index)
+
+    def load_symbol(self, symbol):
+        if symbol.is_constant():
+            # 只赋值一次的全局变量直接引用常量，不再读取全局变量表
+            self.emit(code.OpConstant, symbol.constant_index)
+        elif symbol.scope == GlobalScope:
             self.emit(code.OpGetGlobal, symbol.index)
         elif symbol.scope == LocalScope:
-            self.emit(code.OpGetLocal, symbol.index)
+            self.emit(code.OpGetCell if symbol.cell else code.OpGetLocal, symbol.index)
         elif symbol.scope == BuiltinScope:
             self.emit(code.OpGetBuiltin, symbol.index)
         elif symbol.scope == FreeScope:
-            self.emit(code.OpGetFree, symbol.index)
+            self.emit(code.OpGetFreeCell if symbol.cell else code.OpGetFree, symbol.index)
         elif symbol.scope == FunctionScope:
             self.emit(code.OpCurrentClosure)
 
@@ -276,8 +553,16 @@ class Compiler:
         self.scopes[self.scope_index].last_instruction = previous
 
     def add_constant(self, obj: object.Object):
+        key = constant_key(obj)
+        if key is not None:
+            pos = self.constant_indexes.get(key, None)
+            if pos is not None:
+                return pos
         self.constants.append(obj)
-        return len(self.constants) - 1
+        pos = len(self.constants) - 1
+        if key is not None:
+            self.constant_indexes[key] = pos
+        return pos
 
     def emit(self, op: int, *operands) -> int:
         if operands is None:
@@ -309,7 +594,10 @@ class Compiler:
         self.replace_instructions(op_pos, new_instruction)
 
     def bytecode(self):
-        return Bytecode(self.current_instructions(), self.constants)
+        instructions = self.current_instructions()
+        if self.optimize:
+            instructions = fuse_superinstructions(instructions)
+        return Bytecode(instructions, self.constants)
 
     def current_instructions(self):
         return self.scopes[self.scope_index].instructions
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+from typing import Optional
+
+from monkey_ast import ast
+from monkey_ast.modify import modify
+from monkey_token import token
+
+# 可以在编译期计算的整数运算，除法的结果在虚拟机中不是整数，不做折叠
+integer_operators = {
+    '+': lambda l, r: l + r,
+    '-': lambda l, r: l - r,
+    '*': lambda l, r: l * r,
+}
+integer_comparisons = {
+    '<': lambda l, r: l < r,
+    '>': lambda l, r: l > r,
+    '==': lambda l, r: l == r,
+    '!=': lambda l, r: l != r,
+}
+
+
+def fold_constants(node: ast.Node) -> ast.Node:
+    """
+    编译前的常量折叠：计算操作数都是字面量的前缀/中缀表达式，
+    并删除条件为字面量的 if 表达式中不会执行的分支。
+    折叠结果与虚拟机的运算语义一致，虚拟机不支持的运算保持原样。
+    """
+    return modify(node, fold)
+
+
+def fold(node: ast.Node) -> ast.Node:
+    if isinstance(node, ast.CallExpression):
+        # modify 不会进入调用表达式，这里补上函数和参数
+        node.function = modify(node.function, fold)
+        if node.arguments:
+            for i, arg in enumerate(node.arguments):
+                node.arguments[i] = modify(arg, fold)
+        return node
+    if isinstance(node, ast.PrefixExpression):
+        return fold_prefix_expression(node)
+    if isinstance(node, ast.InfixExpression):
+        return fold_infix_expression(node)
+    if isinstance(node, ast.IFExpression):
+        return fold_if_expression(node)
+    return node
+
+
+def fold_prefix_expression(node: ast.PrefixExpression) -> ast.Node:
+    right = node.right
+    if node.operator == '-' and isinstance(right, ast.IntegerLiteral):
+        return integer_literal(-right.value)
+    if node.operator == '!' and isinstance(right, ast.Boolean):
+        return boolean_literal(not right.value)
+    return node
+
+
+def fold_infix_expression(node: ast.InfixExpression) -> ast.Node:
+    left, right, op = node.left, node.right, node.operator
+    if isinstance(left, ast.IntegerLiteral) and isinstance(right, ast.IntegerLiteral):
+        if op in integer_operators:
+            return integer_literal(integer_operators[op](left.value, right.value))
+        if op in integer_comparisons:
+            return boolean_literal(integer_comparisons[op](left.value, right.value))
+    elif isinstance(left, ast.Boolean) and isinstance(right, ast.Boolean):
+        if op == '==':
+            return boolean_literal(left.value == right.value)
+        if op == '!=':
+            return boolean_literal(left.value != right.value)
+    elif isinstance(left, ast.StringLiteral) and isinstance(right, ast.StringLiteral):
+        if op == '+':
+            return string_literal(left.value + right.value)
+        if op == '==':
+            return boolean_literal(left.value == right.value)
+        if op == '!=':
+            return boolean_literal(left.value != right.value)
+    return node
+
+
+def fold_if_expression(node: ast.IFExpression) -> ast.Node:
+    truthy = literal_truthiness(node.condition)
+    if truthy is None:
+        return node
+    if truthy:
+        expression = single_expression(node.consequence)
+        if expression is not None:
+            return expression
+        node.alternative = None
+        return node
+    expression = single_expression(node.alternative)
+    if expression is not None:
+        return expression
+    # 条件恒为假时 consequence 不会执行，只保留 alternative（没有 alternative 时结果为 null）
+    node.consequence = ast.BlockStatement(token=node.consequence.token, statements=[])
+    return node
+
+
+def literal_truthiness(node: ast.Node) -> Optional[bool]:
+    """字面量条件的真假，与虚拟机的 is_truthy 一致；非字面量返回 None"""
+    if isinstance(node, ast.Boolean):
+        return node.value
+    if isinstance(node, (ast.IntegerLiteral, ast.StringLiteral)):
+        return True
+    return None
+
+
+def single_expression(block: Optional[ast.BlockStatement]) -> Optional[ast.Expression]:
+    """只包含一条表达式语句的代码块可以直接替换为该表达式"""
+    if block is None or block.statements is None or len(block.statements) != 1:
+        return None
+    stmt = block.statements[0]
+    if not isinstance(stmt, ast.ExpressionStatement) or stmt.expression is None:
+        return None
+    return stmt.expression
+
+
+def integer_literal(value: int) -> ast.IntegerLiteral:
+    return ast.IntegerLiteral(token.Token(token.INT, str(value)), value)
+
+
+def boolean_literal(value: bool) -> ast.Boolean:
+    if value:
+        return ast.Boolean(token.Token(token.TRUE, 'true'), True)
+    return ast.Boolean(token.Token(token.FALSE, 'false'), False)
+
+
+def string_literal(value: str) -> ast.StringLiteral:
+    return ast.StringLiteral(token.Token(token.STRING, value), value)
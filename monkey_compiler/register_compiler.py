@@ -0,0 +1,503 @@
+# -*- coding: utf-8 -*-
+"""
+寄存器字节码的编译器，是与 compiler.Compiler 并列的另一个后端。
+
+每个函数的寄存器依次为：参数、局部变量和临时值、常量。
+常量（以及嵌套函数的原型）放在寄存器模板的末尾，调用时随模板一起复制到栈帧，
+因此指令可以像读取局部变量一样直接读取常量，不需要单独的加载指令。
+"""
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from monkey_ast import ast
+from monkey_code import register_code
+from monkey_compiler.cells import assigned_names, cell_names
+from monkey_compiler.compiler import constant_key
+from monkey_compiler.symbol_table import *
+from monkey_object import builtins
+from monkey_object import object
+
+# 编译期间常量寄存器编号为 CONSTANT_BASE + 常量下标，作用域结束时改写为模板末尾的寄存器
+CONSTANT_BASE = 1 << 24
+
+infix_opcodes = {
+    '+': register_code.OpAdd,
+    '-': register_code.OpSub,
+    '*': register_code.OpMul,
+    '/': register_code.OpDiv,
+    '>': register_code.OpGreaterThan,
+    '==': register_code.OpEqual,
+    '!=': register_code.OpNotEqual,
+}
+
+
+@dataclass()
+class RegisterScope:
+    instructions: List[List[int]]
+    constants: List[object.Object]
+    constant_registers: Dict[Tuple[str, Any], int]
+    # 符号下标 -> 寄存器
+    local_registers: Dict[int, int]
+    # 下一个空闲寄存器
+    next_register: int
+    # 局部变量占用的寄存器都在 floor 之下，回收临时寄存器时不会低于它
+    floor: int
+    max_registers: int
+    # 函数中需要放进 Cell 的局部变量名，见 cells.cell_names
+    cells: Set[str]
+
+    def __init__(self):
+        self.instructions = []
+        self.constants = []
+        self.constant_registers = {}
+        self.local_registers = {}
+        self.next_register = 0
+        self.floor = 0
+        self.max_registers = 0
+        self.cells = set()
+
+
+@dataclass()
+class RegisterCompiler:
+    symbol_table: SymbolTable = None
+    scopes: List[RegisterScope] = None
+    # 主程序中表达式语句的值写入该寄存器，执行结束时作为结果返回
+    result_register: int = 0
+
+    def __init__(self):
+        self.symbol_table = SymbolTable()
+        for i, fn in enumerate(builtins.builtins):
+            self.symbol_table.define_builtin(i, fn[0])
+        self.scopes = [RegisterScope()]
+        self.result_register = self.local()
+
+    def compile(self, node: ast.Program) -> Optional[str]:
+        for s in node.statements:
+            err = self.statement(s, self.result_register)
+            if err is not None:
+                return err
+        return None
+
+    def bytecode(self) -> object.RegisterFunction:
+        """主程序的函数原型，返回值为最后一条表达式语句的值"""
+        self.emit(register_code.OpReturn, self.result_register)
+        return self.finish(self.scopes[-1], 0, 0)
+
+    @property
+    def scope(self) -> RegisterScope:
+        return self.scopes[-1]
+
+    def statement(self, node: ast.Statement, dst: Optional[int]) -> Optional[str]:
+        """编译一条语句，表达式语句的值写入 dst（为 None 时丢弃），语句结束后回收临时寄存器"""
+        mark = self.scope.next_register
+        err = None
+        if isinstance(node, ast.ExpressionStatement):
+            _, err = self.expression(node.expression, dst)
+        elif isinstance(node, ast.LetStatement):
+            err = self.let_statement(node)
+        elif isinstance(node, ast.ReturnStatement):
+            reg, err = self.expression(node.return_value, None)
+            if err is None:
+                self.emit(register_code.OpReturn, reg)
+        elif isinstance(node, ast.BlockStatement):
+            _, err = self.block(node, dst)
+        else:
+            err = f"unsupported statement: {type(node).__name__}"
+        self.release(mark)
+        return err
+
+    def let_statement(self, node: ast.LetStatement) -> Optional[str]:
+        symbol = self.define(node.name.value)
+        if symbol.scope == GlobalScope:
+            reg, err = self.expression(node.value, None)
+            if err is not None:
+                return err
+            self.emit(register_code.OpSetGlobal, symbol.index, reg)
+            return None
+        reg = self.local()
+        self.scope.local_registers[symbol.index] = reg
+        _, err = self.expression(node.value, reg)
+        if err is None and symbol.cell:
+            self.emit(register_code.OpMakeCell, reg, reg)
+        return err
+
+    def block(self, node: ast.BlockStatement, dst: Optional[int]) -> Tuple[int, Optional[str]]:
+        """代码块的值是最后一条表达式语句的值，没有时为 null"""
+        statements = node.statements or []
+        for s in statements[:-1]:
+            err = self.statement(s, None)
+            if err is not None:
+                return 0, err
+        if statements and isinstance(statements[-1], ast.ExpressionStatement):
+            return self.expression(statements[-1].expression, dst)
+        if statements:
+            err = self.statement(statements[-1], None)
+            if err is not None:
+                return 0, err
+        return self.move(self.constant(object.NULL, (object.NULL_OBJ, None)), dst), None
+
+    def expression(self, node: ast.Expression, dst: Optional[int]) -> Tuple[int, Optional[str]]:
+        """
+        编译表达式，返回保存结果的寄存器。
+        dst 不为 None 时结果一定写入 dst；否则常量和局部变量直接返回所在的寄存器，其他结果写入新的临时寄存器。
+        """
+        if isinstance(node, ast.IntegerLiteral):
+            integer = object.new_integer(node.value)
+            return self.move(self.constant(integer, constant_key(integer)), dst), None
+        elif isinstance(node, ast.StringLiteral):
+            s = object.String(node.value)
+            return self.move(self.constant(s, constant_key(s)), dst), None
+        elif isinstance(node, ast.Boolean):
+            boolean = object.TRUE if node.value else object.FALSE
+            return self.move(self.constant(boolean, (object.BOOLEAN_OBJ, node.value)), dst), None
+        elif isinstance(node, ast.Identifier):
+            symbol, ok = self.symbol_table.resolve(node.value)
+            if not ok:
+                return 0, f"undefined variable: {node.value}"
+            return self.load_symbol(symbol, dst), None
+        elif isinstance(node, ast.PrefixExpression):
+            right, err = self.expression(node.right, None)
+            if err is not None:
+                return 0, err
+            target = self.target(dst)
+            if node.operator == '!':
+                self.emit(register_code.OpBang, target, right)
+            elif node.operator == '-':
+                self.emit(register_code.OpMinus, target, right)
+            else:
+                return 0, f"unknown operator {node.operator}"
+            return target, None
+        elif isinstance(node, ast.InfixExpression):
+            left_node, right_node, operator = node.left, node.right, node.operator
+            if operator == '<':
+                left_node, right_node, operator = right_node, left_node, '>'
+            op = infix_opcodes.get(operator, None)
+            if op is None:
+                return 0, f"unknown operator {node.operator}"
+            left, err = self.operand(left_node, right_node)
+            if err is not None:
+                return 0, err
+            right, err = self.expression(right_node, None)
+            if err is not None:
+                return 0, err
+            target = self.target(dst)
+            self.emit(op, target, left, right)
+            return target, None
+        elif isinstance(node, ast.IFExpression):
+            return self.if_expression(node, dst)
+        elif isinstance(node, ast.AssignExpression):
+            return self.assign_expression(node, dst)
+        elif isinstance(node, ast.WhileExpression):
+            return self.while_expression(node, dst)
+        elif isinstance(node, ast.ForExpression):
+            return self.for_expression(node, dst)
+        elif isinstance(node, ast.ArrayLiteral):
+            base, err = self.sequence(node.elements)
+            if err is not None:
+                return 0, err
+            target = self.target(dst)
+            self.emit(register_code.OpArray, target, base, len(node.elements))
+            return target, None
+        elif isinstance(node, ast.HashLiteral):
+            keys = list(node.pairs.keys())
+            keys.sort(key=lambda x: str(x))
+            items = []
+            for key in keys:
+                items.append(key)
+                items.append(node.pairs[key])
+            base, err = self.sequence(items)
+            if err is not None:
+                return 0, err
+            target = self.target(dst)
+            self.emit(register_code.OpHash, target, base, len(items))
+            return target, None
+        elif isinstance(node, ast.IndexExpression):
+            left, err = self.operand(node.left, node.index)
+            if err is not None:
+                return 0, err
+            index, err = self.expression(node.index, None)
+            if err is not None:
+                return 0, err
+            target = self.target(dst)
+            self.emit(register_code.OpIndex, target, left, index)
+            return target, None
+        elif isinstance(node, ast.FunctionLiteral):
+            return self.function_literal(node, dst)
+        elif isinstance(node, ast.CallExpression):
+            # 被调函数和参数放在连续的寄存器中，没有指定 dst 时结果覆盖被调函数所在的寄存器
+            base, err = self.sequence([node.function] + list(node.arguments))
+            if err is not None:
+                return 0, err
+            target = dst if dst is not None else base
+            self.emit(register_code.OpCall, target, base, len(node.arguments))
+            return target, None
+        return 0, f"unsupported expression: {type(node).__name__}"
+
+    def if_expression(self, node: ast.IFExpression, dst: Optional[int]) -> Tuple[int, Optional[str]]:
+        condition, err = self.expression(node.condition, None)
+        if err is not None:
+            return 0, err
+        jump_not_truthy_pos = self.emit(register_code.OpJumpNotTruthy, condition, 9999)
+        target = self.target(dst)
+        mark = self.scope.next_register
+        _, err = self.block(node.consequence, target)
+        if err is not None:
+            return 0, err
+        self.release(mark)
+        jump_pos = self.emit(register_code.OpJump, 9999)
+        self.change_operand(jump_not_truthy_pos, 1, len(self.scope.instructions))
+        if node.alternative is None:
+            self.move(self.constant(object.NULL, (object.NULL_OBJ, None)), target)
+        else:
+            _, err = self.block(node.alternative, target)
+            if err is not None:
+                return 0, err
+            self.release(mark)
+        self.change_operand(jump_pos, 0, len(self.scope.instructions))
+        return target, None
+
+    def assign_expression(self, node: ast.AssignExpression, dst: Optional[int]) -> Tuple[int, Optional[str]]:
+        name = node.name.value
+        symbol, ok = self.symbol_table.resolve(name)
+        if not ok:
+            return 0, f"undefined variable: {name}"
+        if symbol.scope == GlobalScope:
+            reg, err = self.expression(node.value, None)
+            if err is not None:
+                return 0, err
+            self.emit(register_code.OpSetGlobal, symbol.index, reg)
+            return self.move(reg, dst), None
+        if symbol.scope == FreeScope or symbol.cell:
+            reg, err = self.expression(node.value, None)
+            if err is not None:
+                return 0, err
+            if symbol.scope == FreeScope:
+                self.emit(register_code.OpSetFree, symbol.index, reg)
+            else:
+                self.emit(register_code.OpSetCell, self.scope.local_registers[symbol.index], reg)
+            return self.move(reg, dst), None
+        if symbol.scope != LocalScope:
+            return 0, f"cannot assign to {name}"
+        reg = self.scope.local_registers[symbol.index]
+        _, err = self.expression(node.value, reg)
+        if err is not None:
+            return 0, err
+        return self.move(reg, dst), None
+
+    def while_expression(self, node: ast.WhileExpression, dst: Optional[int]) -> Tuple[int, Optional[str]]:
+        loop_start = len(self.scope.instructions)
+        mark = self.scope.next_register
+        condition, err = self.expression(node.condition, None)
+        if err is not None:
+            return 0, err
+        jump_not_truthy_pos = self.emit(register_code.OpJumpNotTruthy, condition, 9999)
+        _, err = self.block(node.body, None)
+        if err is not None:
+            return 0, err
+        self.release(mark)
+        self.emit(register_code.OpJump, loop_start)
+        self.change_operand(jump_not_truthy_pos, 1, len(self.scope.instructions))
+        return self.move(self.constant(object.NULL, (object.NULL_OBJ, None)), dst), None
+
+    def for_expression(self, node: ast.ForExpression, dst: Optional[int]) -> Tuple[int, Optional[str]]:
+        """数组、长度和下标保存在循环独占的寄存器中，全局的循环变量每次迭代经临时寄存器写入"""
+        array = self.local()
+        _, err = self.expression(node.iterable, array)
+        if err is not None:
+            return 0, err
+        length = self.local()
+        index = self.local()
+        symbol = self.define(node.variable.value)
+        variable = None
+        if symbol.scope != GlobalScope:
+            variable = self.local()
+            self.scope.local_registers[symbol.index] = variable
+        self.emit(register_code.OpForLength, length, array)
+        self.move(self.constant(object.new_integer(0), constant_key(object.new_integer(0))), index)
+
+        loop_start = len(self.scope.instructions)
+        mark = self.scope.next_register
+        condition = self.temp()
+        self.emit(register_code.OpGreaterThan, condition, length, index)
+        jump_not_truthy_pos = self.emit(register_code.OpJumpNotTruthy, condition, 9999)
+        if variable is None:
+            self.emit(register_code.OpIndex, condition, array, index)
+            self.emit(register_code.OpSetGlobal, symbol.index, condition)
+        else:
+            self.emit(register_code.OpIndex, variable, array, index)
+            if symbol.cell:
+                # 每次迭代都装进新的 Cell，闭包捕获的是本次迭代的变量
+                self.emit(register_code.OpMakeCell, variable, variable)
+        _, err = self.block(node.body, None)
+        if err is not None:
+            return 0, err
+        self.release(mark)
+        one = object.new_integer(1)
+        self.emit(register_code.OpAdd, index, index, self.constant(one, constant_key(one)))
+        self.emit(register_code.OpJump, loop_start)
+        self.change_operand(jump_not_truthy_pos, 1, len(self.scope.instructions))
+        return self.move(self.constant(object.NULL, (object.NULL_OBJ, None)), dst), None
+
+    def function_literal(self, node: ast.FunctionLiteral, dst: Optional[int]) -> Tuple[int, Optional[str]]:
+        self.enter_scope()
+        self.scope.cells = cell_names(node.body)
+        if node.name != "":
+            self.symbol_table.define_function_name(node.name)
+        for p in node.parameters:
+            symbol = self.define(p.value)
+            reg = self.local()
+            self.scope.local_registers[symbol.index] = reg
+            if symbol.cell:
+                # 参数由调用者放在寄存器中，进入函数时再装进 Cell
+                self.emit(register_code.OpMakeCell, reg, reg)
+        reg, err = self.block(node.body, None)
+        if err is not None:
+            return 0, err
+        self.emit(register_code.OpReturn, reg)
+        free_symbols = self.symbol_table.free_symbols
+        fn = self.leave_scope(len(node.parameters), len(free_symbols))
+        base = self.temps(len(free_symbols))
+        for i, s in enumerate(free_symbols):
+            if not s.cell:
+                self.load_symbol(s, base + i)
+            elif s.scope == LocalScope:
+                # 传给闭包的是 Cell 本身
+                self.move(self.scope.local_registers[s.index], base + i)
+            else:
+                self.emit(register_code.OpGetFree, base + i, s.index)
+        target = self.target(dst)
+        self.emit(register_code.OpClosure, target, self.constant(fn, None), base)
+        return target, None
+
+    def operand(self, node: ast.Expression, after: ast.Expression) -> Tuple[int, Optional[str]]:
+        """
+        二元运算的左操作数。局部变量直接使用所在的寄存器，
+        如果右操作数会给变量赋值，先把左操作数复制到临时寄存器，以免读到赋值后的新值。
+        """
+        if isinstance(node, ast.Identifier) and node.value in assigned_names(after):
+            return self.expression(node, self.temp())
+        return self.expression(node, None)
+
+    def sequence(self, nodes: List[ast.Expression]) -> Tuple[int, Optional[str]]:
+        """把表达式依次求值到连续的寄存器中，返回第一个寄存器"""
+        base = self.temps(len(nodes))
+        for i, n in enumerate(nodes):
+            _, err = self.expression(n, base + i)
+            if err is not None:
+                return 0, err
+        return base, None
+
+    def define(self, name: str) -> Symbol:
+        symbol = self.symbol_table.define(name)
+        symbol.cell = symbol.scope == LocalScope and name in self.scope.cells
+        return symbol
+
+    def load_symbol(self, symbol: Symbol, dst: Optional[int]) -> int:
+        if symbol.scope == LocalScope and not symbol.cell:
+            return self.move(self.scope.local_registers[symbol.index], dst)
+        target = self.target(dst)
+        if symbol.scope == LocalScope:
+            self.emit(register_code.OpGetCell, target, self.scope.local_registers[symbol.index])
+        elif symbol.scope == GlobalScope:
+            self.emit(register_code.OpGetGlobal, target, symbol.index)
+        elif symbol.scope == BuiltinScope:
+            self.emit(register_code.OpGetBuiltin, target, symbol.index)
+        elif symbol.scope == FreeScope:
+            self.emit(register_code.OpGetFreeCell if symbol.cell else register_code.OpGetFree, target, symbol.index)
+        elif symbol.scope == FunctionScope:
+            self.emit(register_code.OpCurrentClosure, target)
+        return target
+
+    def move(self, src: int, dst: Optional[int]) -> int:
+        if dst is None or dst == src:
+            return src
+        self.emit(register_code.OpMove, dst, src)
+        return dst
+
+    def target(self, dst: Optional[int]) -> int:
+        return dst if dst is not None else self.temp()
+
+    def constant(self, obj: object.Object, key: Optional[Tuple[str, Any]]) -> int:
+        scope = self.scope
+        if key is not None and key in scope.constant_registers:
+            return scope.constant_registers[key]
+        scope.constants.append(obj)
+        reg = CONSTANT_BASE + len(scope.constants) - 1
+        if key is not None:
+            scope.constant_registers[key] = reg
+        return reg
+
+    def temps(self, n: int) -> int:
+        scope = self.scope
+        base = scope.next_register
+        scope.next_register += n
+        scope.max_registers = max(scope.max_registers, scope.next_register)
+        return base
+
+    def temp(self) -> int:
+        return self.temps(1)
+
+    def local(self) -> int:
+        reg = self.temp()
+        self.scope.floor = self.scope.next_register
+        return reg
+
+    def release(self, mark: int):
+        self.scope.next_register = max(mark, self.scope.floor)
+
+    def emit(self, op: register_code.Opcode, *operands) -> int:
+        self.scope.instructions.append(list(register_code.make(op, *operands)))
+        return len(self.scope.instructions) - 1
+
+    def change_operand(self, pos: int, index: int, operand: int):
+        self.scope.instructions[pos][index + 1] = operand
+
+    def enter_scope(self):
+        self.symbol_table = SymbolTable.new_enclosed(self.symbol_table)
+        self.scopes.append(RegisterScope())
+
+    def leave_scope(self, num_parameters: int, num_free: int) -> object.RegisterFunction:
+        self.symbol_table = self.symbol_table.outer
+        scope = self.scopes.pop()
+        mark_tail_calls(scope.instructions)
+        return self.finish(scope, num_parameters, num_free)
+
+    @staticmethod
+    def finish(scope: RegisterScope, num_parameters: int, num_free: int) -> object.RegisterFunction:
+        """把常量寄存器改写为模板末尾的下标，生成函数原型"""
+        base = scope.max_registers
+        instructions = []
+        for ins in scope.instructions:
+            define = register_code.definitions[ins[0]]
+            operands = list(ins[1:])
+            for i, kind in enumerate(define.operands):
+                if kind == register_code.REGISTER and operands[i] >= CONSTANT_BASE:
+                    operands[i] = base + operands[i] - CONSTANT_BASE
+            instructions.append(register_code.make(ins[0], *operands))
+        return object.RegisterFunction(instructions=instructions,
+                                       num_parameters=num_parameters,
+                                       num_free=num_free,
+                                       registers=[None] * base + scope.constants)
+
+
+def mark_tail_calls(instructions: List[List[int]]):
+    """
+    把函数体中处于尾部位置的 OpCall 原地改写为 OpTailCall。
+    调用之后执行的下一条指令（紧跟其后，或经过 OpJump 到达）是返回调用结果的 OpReturn 时，调用处于尾部位置。
+    OpReturn 保留在原处，供调用内置函数时返回。
+    """
+    for pos, ins in enumerate(instructions):
+        if ins[0] != register_code.OpCall:
+            continue
+        following = next_executed(instructions, pos + 1)
+        if following is not None and following[0] == register_code.OpReturn and following[1] == ins[1]:
+            ins[0] = register_code.OpTailCall
+
+
+def next_executed(instructions: List[List[int]], pos: int) -> Optional[List[int]]:
+    """从 pos 开始跟随无条件跳转，返回实际执行的下一条指令"""
+    seen = set()
+    while pos < len(instructions) and instructions[pos][0] == register_code.OpJump and pos not in seen:
+        seen.add(pos)
+        pos = instructions[pos][1]
+    return instructions[pos] if pos < len(instructions) else None
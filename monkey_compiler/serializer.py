@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+字节码的二进制序列化格式，以及以源码内容哈希为键的编译缓存。
+
+文件格式（整数均为大端序）：
+    magic       4 字节  b'MNKY'
+    version     u16     FORMAT_VERSION
+    instructions        u32 长度 + 字节码
+    constants   u32     常量个数，随后是每个常量：
+        tag u8
+        TAG_INTEGER:  u16 长度 + 有符号整数字节
+        TAG_STRING:   u32 长度 + UTF-8 字节
+        TAG_FUNCTION: u16 num_locals + u16 num_parameters + u32 长度 + 字节码
+        TAG_CLOSURE:  u32 函数常量的下标（没有自由变量的闭包）
+"""
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+from typing import List, Optional, Tuple
+
+from monkey_code import code
+from monkey_compiler.compiler import Bytecode, Compiler
+from monkey_lexer import lexer
+from monkey_object import object
+from monkey_parser.parser import Parser
+
+MAGIC = b'MNKY'
+# 操作码或编码方式变化时需要递增，旧版本的文件和缓存会被拒绝
+FORMAT_VERSION = 4
+
+TAG_INTEGER = 1
+TAG_STRING = 2
+TAG_FUNCTION = 3
+TAG_CLOSURE = 4
+
+CACHE_SUFFIX = ".mkc"
+
+
+def dump(bytecode: Bytecode) -> Tuple[Optional[bytes], Optional[str]]:
+    out = bytearray(MAGIC)
+    out += struct.pack('>H', FORMAT_VERSION)
+    write_bytes(out, bytecode.instructions)
+    out += struct.pack('>I', len(bytecode.constants))
+    for constant in bytecode.constants:
+        if isinstance(constant, object.Integer) and type(constant.value) is int:
+            value = constant.value
+            raw = value.to_bytes((value.bit_length() + 8) // 8, 'big', signed=True)
+            out += struct.pack('>BH', TAG_INTEGER, len(raw))
+            out += raw
+        elif isinstance(constant, object.String):
+            out += struct.pack('>B', TAG_STRING)
+            write_bytes(out, constant.value.encode('utf-8'))
+        elif isinstance(constant, object.CompiledFunction):
+            out += struct.pack('>BHH', TAG_FUNCTION, constant.num_locals, constant.num_parameters)
+            write_bytes(out, constant.instructions)
+        elif isinstance(constant, object.Closure) and not constant.free:
+            fn_index = next((i for i, c in enumerate(bytecode.constants) if c is constant.fn), None)
+            if fn_index is None:
+                return None, f"closure function not in constants: {constant.fn}"
+            out += struct.pack('>BI', TAG_CLOSURE, fn_index)
+        else:
+            return None, f"unsupported constant: {constant.type()}"
+    return bytes(out), None
+
+
+def load(data, copy: bool = True) -> Tuple[Optional[Bytecode], Optional[str]]:
+    """
+    从 bytes 或任意 buffer 解析字节码，返回 (bytecode, err)。
+    copy 为 False 时，主程序和函数的指令直接引用 data 的 memoryview 切片而不复制。
+    """
+    reader = Reader(data)
+    instructions_of = code.Instructions if copy else (lambda chunk: chunk)
+    try:
+        if reader.read(4) != MAGIC:
+            return None, "not a monkey bytecode file"
+        version = reader.unpack('>H')
+        if version != FORMAT_VERSION:
+            return None, f"unsupported bytecode version: {version}, want={FORMAT_VERSION}"
+        instructions = instructions_of(reader.read_bytes())
+        constants: List[object.Object] = []
+        for _ in range(reader.unpack('>I')):
+            tag = reader.unpack('>B')
+            if tag == TAG_INTEGER:
+                raw = reader.read(reader.unpack('>H'))
+                constants.append(object.new_integer(int.from_bytes(raw, 'big', signed=True)))
+            elif tag == TAG_STRING:
+                constants.append(object.String(bytes(reader.read_bytes()).decode('utf-8')))
+            elif tag == TAG_FUNCTION:
+                num_locals = reader.unpack('>H')
+                num_parameters = reader.unpack('>H')
+                constants.append(object.CompiledFunction(instructions=instructions_of(reader.read_bytes()),
+                                                         num_locals=num_locals,
+                                                         num_parameters=num_parameters))
+            elif tag == TAG_CLOSURE:
+                fn_index = reader.unpack('>I')
+                if fn_index >= len(constants) or not isinstance(constants[fn_index], object.CompiledFunction):
+                    return None, f"invalid closure function index: {fn_index}"
+                constants.append(object.Closure(fn=constants[fn_index], free=[]))
+            else:
+                return None, f"unknown constant tag: {tag}"
+    except (struct.error, UnicodeDecodeError, EOFError) as e:
+        return None, f"corrupted bytecode: {e}"
+    return Bytecode(instructions, constants), None
+
+
+def load_file(path: str, use_mmap: bool = True) -> Tuple[Optional[Bytecode], Optional[str]]:
+    """
+    读取字节码文件。use_mmap 为 True 时以只读方式映射文件，指令引用映射区域的切片，
+    同一主机上加载同一文件的多个进程共享这些物理页。映射在最后一个切片被回收后释放。
+    """
+    try:
+        with open(path, 'rb') as f:
+            if not use_mmap:
+                return load(f.read())
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError) as e:
+        return None, f"could not read {path}: {e}"
+    return load(mapping, copy=False)
+
+
+def write_bytes(out: bytearray, data: bytes):
+    out += struct.pack('>I', len(data))
+    out += data
+
+
+class Reader:
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.pos = 0
+
+    def read(self, n: int):
+        if self.pos + n > len(self.data):
+            raise EOFError(f"unexpected end of data at {self.pos}")
+        chunk = self.data[self.pos: self.pos + n]
+        self.pos += n
+        return chunk
+
+    def read_bytes(self):
+        return self.read(self.unpack('>I'))
+
+    def unpack(self, fmt: str) -> int:
+        size = struct.calcsize(fmt)
+        return struct.unpack_from(fmt, self.read(size))[0]
+
+
+class CompileCache:
+    """以源码内容哈希命名的字节码缓存目录，多个进程可以共享同一个目录"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, source: str, optimize: bool = False) -> str:
+        digest = hashlib.sha256()
+        digest.update(f"{FORMAT_VERSION}:{int(optimize)}:".encode('utf-8'))
+        digest.update(source.encode('utf-8'))
+        return os.path.join(self.directory, digest.hexdigest() + CACHE_SUFFIX)
+
+    def get(self, source: str, optimize: bool = False) -> Optional[Bytecode]:
+        path = self.path(source, optimize)
+        if not os.path.exists(path):
+            return None
+        bytecode, err = load_file(path)
+        if err is not None:
+            return None
+        return bytecode
+
+    def put(self, source: str, bytecode: Bytecode, optimize: bool = False):
+        data, err = dump(bytecode)
+        if err is not None:
+            return err
+        os.makedirs(self.directory, exist_ok=True)
+        # 先写临时文件再改名，避免并发的解释器读到写了一半的缓存
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, self.path(source, optimize))
+        except OSError as e:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return f"could not write cache: {e}"
+        return None
+
+
+def compile_source(source: str, cache: Optional[CompileCache] = None,
+                   optimize: bool = False) -> Tuple[Optional[Bytecode], Optional[str]]:
+    """编译源码，命中缓存时跳过词法分析、语法分析和编译"""
+    if cache is not None:
+        bytecode = cache.get(source, optimize)
+        if bytecode is not None:
+            return bytecode, None
+    p = Parser.get_parser(lexer.get_lexer(source))
+    program = p.parse_program()
+    if p.errors:
+        return None, "\n".join(p.errors)
+    comp = Compiler(optimize)
+    err = comp.compile(program)
+    if err is not None:
+        return None, err
+    bytecode = comp.bytecode()
+    if cache is not None:
+        cache.put(source, bytecode, optimize)
+    return bytecode, None
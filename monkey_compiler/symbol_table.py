@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Dict, Optional, List
 
 GlobalScope = "GLOBAL"
@@ -12,6 +12,15 @@ class Symbol:
     name: str=None
     scope: str=None
     index: int=0
+    # 编译期间记录的赋值次数
+    assignments: int = field(default=0, compare=False)
+    # 只赋值一次且值在编译期已知的全局变量，其值在常量池中的下标
+    constant_index: Optional[int] = field(default=None, compare=False)
+    # 保存在 object.Cell 中的局部变量，闭包捕获的是 Cell 本身
+    cell: bool = field(default=False, compare=False)
+
+    def is_constant(self):
+        return self.scope == GlobalScope and self.assignments == 1 and self.constant_index is not None
 
 @dataclass
 class SymbolTable:
@@ -56,7 +65,7 @@ class SymbolTable:
 
     def define_free(self, original: Symbol):
         self.free_symbols.append(original)
-        symbol = Symbol(name=original.name, index=len(self.free_symbols) - 1)
+        symbol = Symbol(name=original.name, index=len(self.free_symbols) - 1, cell=original.cell)
         symbol.scope = FreeScope
         self.store[original.name] = symbol
         return symbol
@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+"""
+闭包编译的求值器，语义与 evaluator.evaluate 相同。
+
+evaluator.evaluate 每次访问节点都要按节点类型重新分派。
+这里先把每个节点转换一次，得到一个 Python 闭包，子节点的闭包和字面量的值都预先绑定在其中；
+执行时只是逐层调用闭包，不再检查节点类型。函数字面量的函数体在转换时一并编译，
+保存在 Function.code 中，每次调用直接执行。
+环境、对象以及运算、内置函数的实现都与 evaluator 共用。
+"""
+from typing import Callable, List
+
+from monkey_ast import ast
+from monkey_evaluate import evaluator
+from monkey_evaluate.evaluator import RETURN, builtin_obj, eval_index_expression, \
+    eval_infix_expression, evaluate_prefix_expression, is_truthy
+from monkey_evaluate.quote_unquote import quote
+from monkey_evaluate.resolver import GLOBAL, resolve
+from monkey_object.object import *
+
+# 编译结果：参数为执行时的环境，返回求值结果
+Code = Callable[[Environment], Object]
+
+
+def evaluate(node: ast.Node, env: Environment) -> Object:
+    if isinstance(node, ast.Program):
+        resolve(node)
+    return compile_node(node)(env)
+
+
+def compile_node(node: ast.Node) -> Code:
+    if isinstance(node, ast.Program):
+        return compile_program(node)
+    elif isinstance(node, ast.ExpressionStatement):
+        return compile_node(node.expression)
+    elif isinstance(node, ast.IntegerLiteral):
+        return compile_constant(new_integer(node.value))
+    elif isinstance(node, ast.Boolean):
+        return compile_constant(TRUE if node.value else FALSE)
+    elif isinstance(node, ast.StringLiteral):
+        return compile_constant(String(node.value))
+    elif isinstance(node, ast.Identifier):
+        return compile_identifier(node)
+    elif isinstance(node, ast.PrefixExpression):
+        return compile_prefix_expression(node)
+    elif isinstance(node, ast.InfixExpression):
+        return compile_infix_expression(node)
+    elif isinstance(node, ast.BlockStatement):
+        return compile_block_statement(node)
+    elif isinstance(node, ast.IFExpression):
+        return compile_if_expression(node)
+    elif isinstance(node, ast.WhileExpression):
+        return compile_while_expression(node)
+    elif isinstance(node, ast.ForExpression):
+        return compile_for_expression(node)
+    elif isinstance(node, ast.ReturnStatement):
+        return compile_return_statement(node)
+    elif isinstance(node, ast.LetStatement):
+        return compile_let_statement(node)
+    elif isinstance(node, ast.AssignExpression):
+        return compile_assign_expression(node)
+    elif isinstance(node, ast.FunctionLiteral):
+        return compile_function_literal(node)
+    elif isinstance(node, ast.CallExpression):
+        return compile_call_expression(node)
+    elif isinstance(node, ast.ArrayLiteral):
+        return compile_array_literal(node)
+    elif isinstance(node, ast.IndexExpression):
+        return compile_index_expression(node)
+    elif isinstance(node, ast.HashLiteral):
+        return compile_hash_literal(node)
+    return compile_constant(NULL)
+
+
+def compile_constant(value: Object) -> Code:
+    return lambda env: value
+
+
+def compile_program(node: ast.Program) -> Code:
+    statements = [compile_node(s) for s in node.statements]
+
+    def run(env):
+        result = NULL
+        for statement in statements:
+            result = statement(env)
+            if result is RETURN:
+                return result.value
+            if isinstance(result, Error):
+                return result
+        return result
+
+    return run
+
+
+def compile_block_statement(node: ast.BlockStatement) -> Code:
+    statements = [compile_node(s) for s in node.statements]
+
+    def run(env):
+        result = NULL
+        for statement in statements:
+            result = statement(env)
+            if result is RETURN or isinstance(result, Error):
+                return result
+        return result
+
+    return run
+
+
+def compile_identifier(node: ast.Identifier) -> Code:
+    name = node.value
+    depth = node.depth
+    slot = node.slot
+    if depth is None:
+        return lambda env: evaluator.eval_identifier(node, env)
+
+    def not_found(env):
+        builtin = builtin_obj.get(name)
+        if builtin:
+            return builtin
+        return Error(f"identifier not found: {name}")
+
+    if depth == GLOBAL:
+        def get_global(env):
+            val = env.root.find(name)
+            return not_found(env) if val is None else val
+
+        return get_global
+
+    if depth == 0:
+        def get_local(env):
+            val = env.values[slot]
+            if val is None:
+                # 变量在这一层还没有定义，与按名字查找时一样继续到外层
+                val = env.outer.find(name)
+                if val is None:
+                    return not_found(env)
+            return val
+
+        return get_local
+
+    def get_free(env):
+        scope = env
+        for _ in range(depth):
+            scope = scope.outer
+        val = scope.values[slot]
+        if val is None:
+            val = scope.outer.find(name)
+            if val is None:
+                return not_found(env)
+        return val
+
+    return get_free
+
+
+def compile_prefix_expression(node: ast.PrefixExpression) -> Code:
+    operator = node.operator
+    right = compile_node(node.right)
+
+    def run(env):
+        value = right(env)
+        if value is RETURN or isinstance(value, Error):
+            return value
+        return evaluate_prefix_expression(operator, value)
+
+    return run
+
+
+def compile_infix_expression(node: ast.InfixExpression) -> Code:
+    operator = node.operator
+    left = compile_node(node.left)
+    right = compile_node(node.right)
+
+    def run(env):
+        left_value = left(env)
+        if left_value is RETURN or isinstance(left_value, Error):
+            return left_value
+        right_value = right(env)
+        if right_value is RETURN or isinstance(right_value, Error):
+            return right_value
+        return eval_infix_expression(operator, left_value, right_value)
+
+    return run
+
+
+def compile_if_expression(node: ast.IFExpression) -> Code:
+    condition = compile_node(node.condition)
+    consequence = compile_node(node.consequence)
+    alternative = compile_node(node.alternative)
+
+    def run(env):
+        value = condition(env)
+        if value is RETURN:
+            return value
+        if is_truthy(value):
+            return consequence(env)
+        return alternative(env)
+
+    return run
+
+
+def compile_while_expression(node: ast.WhileExpression) -> Code:
+    condition = compile_node(node.condition)
+    body = compile_node(node.body)
+
+    def run(env):
+        while True:
+            value = condition(env)
+            if value is RETURN or isinstance(value, Error):
+                return value
+            if not is_truthy(value):
+                return NULL
+            ret = body(env)
+            if ret is RETURN or isinstance(ret, Error):
+                return ret
+
+    return run
+
+
+def compile_for_expression(node: ast.ForExpression) -> Code:
+    iterable = compile_node(node.iterable)
+    body = compile_node(node.body)
+
+    def run(env):
+        array = iterable(env)
+        if array is RETURN or isinstance(array, Error):
+            return array
+        if not isinstance(array, Array):
+            return Error(f"for-in not supported: {array.type()}")
+        for element in array:
+            scope = evaluator.iteration_environment(node, element, env)
+            ret = body(scope)
+            evaluator.end_iteration(node, scope, env)
+            if ret is RETURN or isinstance(ret, Error):
+                return ret
+        return NULL
+
+    return run
+
+
+def compile_return_statement(node: ast.ReturnStatement) -> Code:
+    value = compile_node(node.return_value)
+
+    def run(env):
+        val = value(env)
+        if val is RETURN or isinstance(val, Error):
+            return val
+        RETURN.value = val
+        return RETURN
+
+    return run
+
+
+def compile_let_statement(node: ast.LetStatement) -> Code:
+    name = node.name
+    value = compile_node(node.value)
+
+    def run(env):
+        val = value(env)
+        if val is RETURN:
+            return val
+        evaluator.define(name, val, env)
+        if isinstance(val, Error):
+            return val
+        return NULL
+
+    return run
+
+
+def compile_assign_expression(node: ast.AssignExpression) -> Code:
+    name = node.name
+    value = compile_node(node.value)
+
+    def run(env):
+        val = value(env)
+        if val is RETURN or isinstance(val, Error):
+            return val
+        if not evaluator.assign(name, val, env):
+            return Error(f"identifier not found: {name.value}")
+        return val
+
+    return run
+
+
+def compile_function_literal(node: ast.FunctionLiteral) -> Code:
+    parameters = node.parameters
+    body = node.body
+    layout = node.layout
+    code = compile_node(body)
+    return lambda env: Function(parameters=parameters, body=body, env=env, layout=layout, code=code)
+
+
+def compile_expressions(nodes: List[ast.Expression]) -> Callable[[Environment], List[Object]]:
+    """与 evaluator.eval_expressions 相同，遇到错误或 RETURN 时停止，结果只含这一项"""
+    codes = [compile_node(n) for n in nodes or []]
+
+    def run(env):
+        values = []
+        for code in codes:
+            value = code(env)
+            if value is RETURN or isinstance(value, Error):
+                return [value]
+            values.append(value)
+        return values
+
+    return run
+
+
+def compile_call_expression(node: ast.CallExpression) -> Code:
+    if isinstance(node.function, ast.Identifier) and node.function.value == 'quote':
+        argument = node.arguments[0]
+        return lambda env: quote(argument, env)
+    function = compile_node(node.function)
+    arguments = compile_expressions(node.arguments)
+
+    def run(env):
+        func = function(env)
+        if func is RETURN or isinstance(func, Error):
+            return func
+        args = arguments(env)
+        if len(args) == 1 and (args[0] is RETURN or isinstance(args[0], Error)):
+            return args[0]
+        if isinstance(func, Function) and func.code is not None:
+            call_env = SlotEnvironment(func.layout, func.env)
+            for i, param in enumerate(func.parameters):
+                call_env.values[param.slot] = args[i]
+            ret = func.code(call_env)
+            if ret is RETURN:
+                return ret.value
+            return ret
+        return evaluator.apply_function(func, args)
+
+    return run
+
+
+def compile_array_literal(node: ast.ArrayLiteral) -> Code:
+    elements = compile_expressions(node.elements)
+
+    def run(env):
+        values = elements(env)
+        if len(values) == 1 and (values[0] is RETURN or isinstance(values[0], Error)):
+            return values[0]
+        return new_array(values)
+
+    return run
+
+
+def compile_index_expression(node: ast.IndexExpression) -> Code:
+    left = compile_node(node.left)
+    index = compile_node(node.index)
+
+    def run(env):
+        left_value = left(env)
+        if left_value is RETURN or isinstance(left_value, Error):
+            return left_value
+        index_value = index(env)
+        if index_value is RETURN or isinstance(index_value, Error):
+            return index_value
+        return eval_index_expression(left_value, index_value)
+
+    return run
+
+
+def compile_hash_literal(node: ast.HashLiteral) -> Code:
+    pairs = [(compile_node(k), compile_node(v)) for k, v in node.pairs.items()]
+
+    def run(env):
+        hashed_pairs = {}
+        for key_code, value_code in pairs:
+            key = key_code(env)
+            if key is RETURN or isinstance(key, Error):
+                return key
+            value = value_code(env)
+            if value is RETURN:
+                return value
+            hashed_pairs[key.hash_key()] = HashPair(key, value)
+        return Hash(hashed_pairs)
+
+    return run
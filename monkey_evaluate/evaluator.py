@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
-from typing import List
+from typing import Callable, Dict, List
 from monkey_object.object import *
+from monkey_object import builtins
 from monkey_evaluate.quote_unquote import quote
+from monkey_evaluate.resolver import GLOBAL, resolve
 
 
 def length(*args):
@@ -9,9 +11,9 @@ def length(*args):
     if len(args) != 1:
         return Error(f"wrong number of arguments. got {len(args)}, want 1")
     elif isinstance(arg, String):
-        return Integer(len(arg.value))
+        return new_integer(len(arg.value))
     elif isinstance(arg, Array):
-        return Integer(len(arg.elements))
+        return new_integer(arg.length())
     return Error(f"argument to 'len' not supported, got {arg.type()}")
 
 
@@ -21,8 +23,8 @@ def first(*args):
         return Error(f"wrong number of arguments. got {len(args)}, want 1")
     if arg.type() != ARRAY_OBJ:
         return Error(f"argument to 'first' must be ARRAY, go {arg.type()}")
-    if len(arg.elements) > 0:
-        return arg.elements[0]
+    if arg.length() > 0:
+        return arg.get(0)
     return NULL
 
 
@@ -32,8 +34,8 @@ def last(*args):
         return Error(f"wrong number of arguments. got {len(args)}, want 1")
     if arg.type() != ARRAY_OBJ:
         return Error(f"argument to 'last' must be ARRAY, go {arg.type()}")
-    if len(arg.elements) > 0:
-        return arg.elements[-1]
+    if arg.length() > 0:
+        return arg.get(arg.length() - 1)
     return NULL
 
 
@@ -43,8 +45,8 @@ def rest(*args):
         return Error(f"wrong number of arguments. got {len(args)}, want 1")
     if arg.type() != ARRAY_OBJ:
         return Error(f"argument to 'last' must be ARRAY, go {arg.type()}")
-    if len(arg.elements) > 0:
-        return Array(arg.elements[1:])
+    if arg.length() > 0:
+        return arg.rest()
     return NULL
 
 
@@ -55,9 +57,38 @@ def push(*args):
         return Error(f"wrong number of arguments. got {len(args)}, want 2")
     if arg.type() != ARRAY_OBJ:
         return Error(f"argument to 'last' must be ARRAY, go {arg.type()}")
-    new_arr = arg.elements[:]
-    new_arr.append(obj)
-    return Array(new_arr)
+    return arg.push(obj)
+
+
+def set_pair(*args):
+    if len(args) != 3:
+        return Error(f"wrong number of arguments. got {len(args)}, want 3")
+    h, key, value = args
+    if h.type() != HASH_OBJ:
+        return Error(f"argument to 'set' must be HASH, got {h.type()}")
+    if not isinstance(key, Hashable):
+        return Error(f"unusable as hash key: {key.type()}")
+    return h.set(key, value)
+
+
+def delete(*args):
+    if len(args) != 2:
+        return Error(f"wrong number of arguments. got {len(args)}, want 2")
+    h, key = args
+    if h.type() != HASH_OBJ:
+        return Error(f"argument to 'delete' must be HASH, got {h.type()}")
+    if not isinstance(key, Hashable):
+        return Error(f"unusable as hash key: {key.type()}")
+    return h.delete(key)
+
+
+def merge(*args):
+    if len(args) != 2:
+        return Error(f"wrong number of arguments. got {len(args)}, want 2")
+    for arg in args:
+        if arg.type() != HASH_OBJ:
+            return Error(f"arguments to 'merge' must be HASH, got {arg.type()}")
+    return args[0].merge(args[1])
 
 
 def puts(*args):
@@ -73,14 +104,27 @@ builtin_obj = {
     "rest": Builtin(fn=rest),
     "push": Builtin(fn=push),
     "puts": Builtin(fn=puts),
+    "set": Builtin(fn=set_pair),
+    "delete": Builtin(fn=delete),
+    "merge": Builtin(fn=merge),
 }
+# 批量操作的内置函数与虚拟机共用同一份实现
+builtin_obj.update((name, fn) for name, fn in builtins.builtins
+                   if name in ("range", "sum", "map", "filter", "reduce", "sort"))
+
+
+# return 语句的结果。返回值写入 RETURN.value 后向外传递这个唯一的对象，return 因此不需要分配。
+# 与错误一样，任何节点求值子节点得到 RETURN 时都立即把它原样返回（let 不绑定、数组和参数不收集），
+# 直到函数调用或程序取出返回值，与虚拟机中 return 直接结束函数一致。
+# 从 return 到取出返回值之间不会再求值其他节点，所以嵌套调用共用一个对象也不会覆盖尚未取出的返回值
+RETURN = ReturnValue(None)
 
 
 def evaluate_statements(statements: list[ast.Statement], env: Environment):
     result = NULL
     for stmt in statements:
         result = evaluate(stmt, env)
-        if isinstance(result, ReturnValue):
+        if result is RETURN:
             return result.value
         if isinstance(result, Error):
             return result
@@ -94,7 +138,7 @@ def evaluate_prefix_expression(op: str, right: Object):
         ret = eval_minus_expression(right)
         if ret == NULL:
             return Error(f"unknown operator: {op}{right.type()}")
-        return Integer(-ret.value)
+        return new_integer(-ret.value)
     return Error(f"unknown operator: {op}{right}")
 
 
@@ -115,7 +159,7 @@ def eval_bang_expression(right: Object):
 
 def eval_minus_expression(right: Object):
     if isinstance(right, Integer):
-        return Integer(right.value)
+        return right
     return NULL
 
 
@@ -139,17 +183,17 @@ def eval_integer_infix_expression(op: str, left: Object, right: Object):
     left_val = left.value
     right_val = right.value
     if op == '+':
-        return Integer(left_val + right_val)
+        return new_integer(left_val + right_val)
     elif op == '-':
-        return Integer(left_val - right_val)
+        return new_integer(left_val - right_val)
     elif op == '*':
-        return Integer(left_val * right_val)
+        return new_integer(left_val * right_val)
     elif op == '/':
-        return Integer(left_val / right_val)
+        return new_integer(left_val / right_val)
     elif op == '&':
-        return Integer(left_val & right_val)
+        return new_integer(left_val & right_val)
     elif op == '|':
-        return Integer(left_val | right_val)
+        return new_integer(left_val | right_val)
     elif op == '<':
         return native_bool_to_boolean_object(left_val < right_val)
     elif op == '>':
@@ -182,90 +226,151 @@ def native_bool_to_boolean_object(obj: bool):
 
 
 def is_error(obj: Object):
-    if obj is not None:
-        return obj.type() == ERROR_OBJ
-    return False
+    return isinstance(obj, Error)
+
+
+# 按节点的类型查找求值函数，由 register 注册
+evaluators: Dict[type, Callable[[ast.Node, Environment], Object]] = {}
+
+
+def register(node_type: type):
+    """把被修饰的函数注册为 node_type 节点的求值函数，其他模块可以借此支持新的节点类型"""
+    def decorator(fn):
+        evaluators[node_type] = fn
+        return fn
+
+    return decorator
 
 
 def evaluate(node: ast.Node, env: Environment):
-    if isinstance(node, ast.IntegerLiteral):
-        return Integer(node.value)
-    if isinstance(node, ast.Boolean):
-        return native_bool_to_boolean_object(node.value)
-    elif isinstance(node, ast.Program):
-        return evaluate_statements(node.statements, env)
-    elif isinstance(node, ast.ExpressionStatement):
-        return evaluate(node.expression, env)
-    elif isinstance(node, ast.PrefixExpression):
-        right = evaluate(node.right, env)
-        if is_error(right):
-            return right
-        return evaluate_prefix_expression(node.operator, right)
-    elif isinstance(node, ast.InfixExpression):
-        left = evaluate(node.left, env)
-        if is_error(left):
-            return left
-        right = evaluate(node.right, env)
-        if is_error(right):
-            return right
-        return eval_infix_expression(node.operator, left, right)
-    elif isinstance(node, ast.IFExpression):
-        return eval_if_expression(node, env)
-    elif isinstance(node, ast.BlockStatement):
-        return evaluate_block_statement(node, env)
-    elif isinstance(node, ast.ReturnStatement):
-        val = evaluate(node.return_value, env)
-        if is_error(val):
-            return val
-        return ReturnValue(val)
-    elif isinstance(node, ast.LetStatement):
-        val = evaluate(node.value, env)
-        env.put(node.name.value, val)
-        if is_error(val):
-            return val
-    elif isinstance(node, ast.Identifier):
-        return eval_identifier(node, env)
-    elif isinstance(node, ast.FunctionLiteral):
-        params = node.parameters
-        body = node.body
-        return Function(parameters=params, body=body, env=env)
-    elif isinstance(node, ast.CallExpression):
-        if node.function.literal() == 'quote':
-            return quote(node.arguments[0], env)
-        func = evaluate(node.function, env)
-        if is_error(func):
-            return func
-        arguments = eval_expressions(node.arguments, env)
-        if len(arguments) == 1 and is_error(arguments[0]):
-            return arguments[0]
-        return apply_function(func, arguments)
-    elif isinstance(node, ast.StringLiteral):
-        return String(node.value)
-    elif isinstance(node, ast.ArrayLiteral):
-        elements = eval_expressions(node.elements, env)
-        if len(elements) == 1 and is_error(elements[0]):
-            return elements[0]
-        return Array(elements=elements)
-    elif isinstance(node, ast.IndexExpression):
-        left = evaluate(node.left, env)
-        if is_error(left):
-            return left
-        index = evaluate(node.index, env)
-        if is_error(index):
-            return index
-        return eval_index_expression(left, index)
-    elif isinstance(node, ast.HashLiteral):
-        return eval_hash_literal(node, env)
+    fn = evaluators.get(type(node), None)
+    if fn is None:
+        return NULL
+    return fn(node, env)
+
+
+@register(ast.IntegerLiteral)
+def eval_integer_literal(node: ast.IntegerLiteral, env: Environment):
+    return new_integer(node.value)
+
+
+@register(ast.Boolean)
+def eval_boolean(node: ast.Boolean, env: Environment):
+    return native_bool_to_boolean_object(node.value)
+
+
+@register(ast.Program)
+def eval_program(node: ast.Program, env: Environment):
+    resolve(node)
+    return evaluate_statements(node.statements, env)
+
+
+@register(ast.ExpressionStatement)
+def eval_expression_statement(node: ast.ExpressionStatement, env: Environment):
+    return evaluate(node.expression, env)
+
+
+@register(ast.PrefixExpression)
+def eval_prefix_expression(node: ast.PrefixExpression, env: Environment):
+    right = evaluate(node.right, env)
+    if right is RETURN or isinstance(right, Error):
+        return right
+    return evaluate_prefix_expression(node.operator, right)
+
+
+@register(ast.InfixExpression)
+def eval_infix(node: ast.InfixExpression, env: Environment):
+    left = evaluate(node.left, env)
+    if left is RETURN or isinstance(left, Error):
+        return left
+    right = evaluate(node.right, env)
+    if right is RETURN or isinstance(right, Error):
+        return right
+    return eval_infix_expression(node.operator, left, right)
+
+
+@register(ast.ReturnStatement)
+def eval_return_statement(node: ast.ReturnStatement, env: Environment):
+    val = evaluate(node.return_value, env)
+    if val is RETURN or isinstance(val, Error):
+        return val
+    RETURN.value = val
+    return RETURN
+
+
+@register(ast.LetStatement)
+def eval_let_statement(node: ast.LetStatement, env: Environment):
+    val = evaluate(node.value, env)
+    if val is RETURN:
+        return val
+    define(node.name, val, env)
+    if isinstance(val, Error):
+        return val
     return NULL
 
 
+@register(ast.AssignExpression)
+def eval_assign_expression(node: ast.AssignExpression, env: Environment):
+    val = evaluate(node.value, env)
+    if val is RETURN or isinstance(val, Error):
+        return val
+    if not assign(node.name, val, env):
+        return Error(f"identifier not found: {node.name.value}")
+    return val
+
+
+@register(ast.FunctionLiteral)
+def eval_function_literal(node: ast.FunctionLiteral, env: Environment):
+    return Function(parameters=node.parameters, body=node.body, env=env, layout=node.layout)
+
+
+@register(ast.CallExpression)
+def eval_call_expression(node: ast.CallExpression, env: Environment):
+    if node.function.literal() == 'quote':
+        return quote(node.arguments[0], env)
+    func = evaluate(node.function, env)
+    if func is RETURN or isinstance(func, Error):
+        return func
+    arguments = eval_expressions(node.arguments, env)
+    if len(arguments) == 1 and (arguments[0] is RETURN or isinstance(arguments[0], Error)):
+        return arguments[0]
+    return apply_function(func, arguments)
+
+
+@register(ast.StringLiteral)
+def eval_string_literal(node: ast.StringLiteral, env: Environment):
+    return String(node.value)
+
+
+@register(ast.ArrayLiteral)
+def eval_array_literal(node: ast.ArrayLiteral, env: Environment):
+    elements = eval_expressions(node.elements, env)
+    if len(elements) == 1 and (elements[0] is RETURN or isinstance(elements[0], Error)):
+        return elements[0]
+    return new_array(elements)
+
+
+@register(ast.IndexExpression)
+def eval_index(node: ast.IndexExpression, env: Environment):
+    left = evaluate(node.left, env)
+    if left is RETURN or isinstance(left, Error):
+        return left
+    index = evaluate(node.index, env)
+    if index is RETURN or isinstance(index, Error):
+        return index
+    return eval_index_expression(left, index)
+
+
+@register(ast.HashLiteral)
 def eval_hash_literal(node: ast.HashLiteral, env: Environment):
     pairs = {}
     for key_node, val_node in node.pairs.items():
         key = evaluate(key_node, env)
-        if is_error(key):
+        if key is RETURN or isinstance(key, Error):
             return key
         value = evaluate(val_node, env)
+        if value is RETURN:
+            return value
         hashed = key.hash_key()
         pairs[hashed] = HashPair(key, value)
     return Hash(pairs)
@@ -288,42 +393,73 @@ def eval_hash_index_expression(left: Hash, index: String):
 
 
 def eval_array_index_expression(left: Array, index: Object):
-    idx = index.value
-    max_len = len(left.elements)
-    if idx < 0 or idx >= max_len:
+    element = left.get(index.value)
+    if element is None:
         return NULL
-    return left.elements[idx]
+    return element
 
 
 def eval_expressions(args: List[ast.Expression], env: Environment) -> []:
+    """依次求值，遇到错误或 RETURN 时停止，结果只含这一项"""
     result = []
     if args is None:
         return result
     for arg in args:
         ret = evaluate(arg, env)
+        if ret is RETURN or isinstance(ret, Error):
+            return [ret]
         result.append(ret)
-        if is_error(ret):
-            return result
     return result
 
 
 def apply_function(func: Function, args: List[Object]):
     if isinstance(func, Builtin):
+        if func.higher_order:
+            result, err = func.fn(call_function, *args)
+            return Error(err) if err is not None else result
         return func.fn(*args)
     if isinstance(func, Function):
-        env = Environment.new_enclosed_environment(func.env)
-        for i, param in enumerate(func.parameters):
-            env.put(param.value, args[i])
-        ret = evaluate(func.body, env)
-        if isinstance(ret, ReturnValue):
+        if func.layout is None:
+            env = Environment.new_enclosed_environment(func.env)
+            for i, param in enumerate(func.parameters):
+                env.put(param.value, args[i])
+        else:
+            env = SlotEnvironment(func.layout, func.env)
+            for i, param in enumerate(func.parameters):
+                env.values[param.slot] = args[i]
+        # 由 closure_evaluator 创建的函数直接执行编译好的函数体
+        ret = evaluate(func.body, env) if func.code is None else func.code(env)
+        if ret is RETURN:
             return ret.value
         return ret
     return Error(f"not a function: {func.type()}")
 
 
+def call_function(func: Object, args: List[Object]):
+    """高阶内置函数回调 Monkey 函数的入口，返回 (结果, 错误信息)"""
+    if isinstance(func, Function) and len(args) != len(func.parameters):
+        return None, f"wrong number of arguments: want={len(func.parameters)}, got={len(args)}"
+    result = apply_function(func, args)
+    if isinstance(result, Error):
+        return None, result.message
+    return (result if result is not None else NULL), None
+
+
+@register(ast.Identifier)
 def eval_identifier(node: ast.Identifier, env: Environment):
-    val = env.get(node.value)
-    if val != NULL:
+    depth = node.depth
+    if depth is None or depth == GLOBAL or not isinstance(env, SlotEnvironment):
+        # 全局变量、内置函数以及未经解析的节点（例如宏展开时求值的宏体）按名字查找
+        val = env.root.find(node.value) if depth == GLOBAL else env.find(node.value)
+    else:
+        scope = env
+        for _ in range(depth):
+            scope = scope.outer
+        val = scope.values[node.slot]
+        if val is None:
+            # 变量在这一层还没有定义，与按名字查找时一样继续到外层
+            val = scope.outer.find(node.value)
+    if val is not None:
         return val
     builtin = builtin_obj.get(node.value)
     if builtin:
@@ -331,14 +467,91 @@ def eval_identifier(node: ast.Identifier, env: Environment):
     return Error(f"identifier not found: {node.value}")
 
 
+def define(name: ast.Identifier, val: Object, env: Environment):
+    """let 和 for 循环变量定义在解析时确定的作用域中：当前函数，或者函数中 for 循环的本次迭代"""
+    depth = name.depth
+    if depth is None or depth == GLOBAL or not isinstance(env, SlotEnvironment):
+        env.put(name.value, val)
+        return
+    scope = env
+    for _ in range(depth):
+        scope = scope.outer
+    scope.values[name.slot] = val
+
+
+def assign(name: ast.Identifier, val: Object, env: Environment) -> bool:
+    depth = name.depth
+    if depth is None or depth == GLOBAL or not isinstance(env, SlotEnvironment):
+        return (env.root if depth == GLOBAL else env).assign(name.value, val)
+    scope = env
+    for _ in range(depth):
+        scope = scope.outer
+    if scope.values[name.slot] is None:
+        return scope.outer.assign(name.value, val)
+    scope.values[name.slot] = val
+    return True
+
+
+@register(ast.IFExpression)
 def eval_if_expression(node: ast.IFExpression, env: Environment):
     condition = evaluate(node.condition, env)
+    if condition is RETURN:
+        return condition
     if is_truthy(condition):
         return evaluate(node.consequence, env)
     else:
         return evaluate(node.alternative, env)
 
 
+@register(ast.WhileExpression)
+def eval_while_expression(node: ast.WhileExpression, env: Environment):
+    while True:
+        condition = evaluate(node.condition, env)
+        if condition is RETURN or isinstance(condition, Error):
+            return condition
+        if not is_truthy(condition):
+            return NULL
+        ret = evaluate(node.body, env)
+        if ret is RETURN or isinstance(ret, Error):
+            return ret
+
+
+@register(ast.ForExpression)
+def eval_for_expression(node: ast.ForExpression, env: Environment):
+    iterable = evaluate(node.iterable, env)
+    if iterable is RETURN or isinstance(iterable, Error):
+        return iterable
+    if not isinstance(iterable, Array):
+        return Error(f"for-in not supported: {iterable.type()}")
+    for element in iterable:
+        scope = iteration_environment(node, element, env)
+        ret = evaluate(node.body, scope)
+        end_iteration(node, scope, env)
+        if ret is RETURN or isinstance(ret, Error):
+            return ret
+    return NULL
+
+
+def iteration_environment(node: ast.ForExpression, element: Object, env: Environment) -> Environment:
+    """绑定循环变量，返回本次迭代求值循环体的环境。函数中的循环每次迭代都创建新的环境"""
+    if node.layout is None or not isinstance(env, SlotEnvironment):
+        define(node.variable, element, env)
+        return env
+    scope = SlotEnvironment(node.layout, env)
+    scope.values[0] = element
+    return scope
+
+
+def end_iteration(node: ast.ForExpression, scope: Environment, env: Environment):
+    """把本次迭代中循环变量的值写回外层作用域"""
+    if scope is env:
+        return
+    outer = env
+    for _ in range(node.depth):
+        outer = outer.outer
+    outer.values[node.slot] = scope.values[0]
+
+
 def is_truthy(obj: Object):
     if obj == NULL or obj == FALSE:
         return False
@@ -346,13 +559,12 @@ def is_truthy(obj: Object):
         return True
 
 
+@register(ast.BlockStatement)
 def evaluate_block_statement(block: ast.BlockStatement, env: Environment):
     statements = block.statements
     ret = NULL
     for stmt in statements:
         ret = evaluate(stmt, env)
-        if isinstance(ret, Error):
-            return ret
-        if ret != NULL and isinstance(ret, ReturnValue):
+        if ret is RETURN or isinstance(ret, Error):
             return ret
     return ret
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+求值前的变量解析：给每个标识符标注词法地址 (depth, slot)。
+
+函数会创建新的作用域，代码块不会。函数的参数、函数体中的 let 和 for 循环变量
+（不含内层函数的）在进入函数时就分配好槽位，记在 FunctionLiteral.layout 中；
+求值时函数调用的环境是按 layout 大小分配的列表，见 object.SlotEnvironment。
+函数中的 for 循环另有一层只含循环变量的作用域（ForExpression.layout），每次迭代都重新创建，
+循环体中的闭包捕获的是本次迭代的变量，与虚拟机一致。
+在所有外层函数中都找不到的名字是全局变量或内置函数，depth 为 GLOBAL，仍按名字查找，
+因此 REPL 中后输入的全局变量同样可以被之前定义的函数引用。
+"""
+from typing import Dict, Iterator, List
+
+from monkey_ast import ast
+from monkey_ast.ast import children
+
+GLOBAL = -1
+
+
+def resolve(node: ast.Node, scopes: List[Dict[str, int]] = None):
+    """原地标注 node 中的所有标识符，scopes 为由外向内的各层函数的 layout"""
+    if scopes is None:
+        scopes = []
+    if isinstance(node, ast.Identifier):
+        node.depth, node.slot = lookup(scopes, node.value)
+        return
+    if isinstance(node, ast.ForExpression) and scopes:
+        # 循环变量同时在函数的 layout 中，每次迭代结束时写回，循环结束后仍然可以读取
+        node.depth, node.slot = lookup(scopes, node.variable.value)
+        node.layout = {node.variable.value: 0}
+        resolve(node.iterable, scopes)
+        resolve(node.variable, scopes + [node.layout])
+        resolve(node.body, scopes + [node.layout])
+        return
+    if isinstance(node, ast.FunctionLiteral):
+        layout = {}
+        for p in node.parameters:
+            layout.setdefault(p.value, len(layout))
+        for name in declared_names(node.body):
+            layout.setdefault(name, len(layout))
+        node.layout = layout
+        scopes = scopes + [layout]
+    for child in children(node):
+        resolve(child, scopes)
+
+
+def lookup(scopes: List[Dict[str, int]], name: str):
+    for depth, layout in enumerate(reversed(scopes)):
+        slot = layout.get(name, None)
+        if slot is not None:
+            return depth, slot
+    return GLOBAL, 0
+
+
+def declared_names(node: ast.Node) -> Iterator[str]:
+    """node 中由 let 和 for 定义的变量名，不进入内层函数"""
+    if isinstance(node, ast.LetStatement):
+        yield node.name.value
+    elif isinstance(node, ast.ForExpression):
+        yield node.variable.value
+    elif isinstance(node, ast.FunctionLiteral):
+        return
+    for child in children(node):
+        yield from declared_names(child)
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+显式栈求值器，语义与 evaluator.evaluate 相同，但 Python 的调用栈深度有界。
+
+evaluator.evaluate 对每个子表达式和每次 Monkey 函数调用都递归调用自身，
+递归稍深就会触发 Python 的 RecursionError。这里复合节点的求值函数是生成器：
+需要子节点的值时 yield (子节点, 环境)，由 run 中的循环求值后用 send 传回。
+未完成的生成器保存在一个列表中，Monkey 的递归深度只受内存限制。
+字面量、标识符等不需要求值子节点的节点直接复用 evaluator 中注册的求值函数。
+
+高阶内置函数（map、filter 等）回调 Monkey 函数时会嵌套一层 run，
+只有这种嵌套会占用 Python 栈。
+"""
+from typing import Callable, Dict, Generator, List, Tuple
+
+from monkey_ast import ast
+from monkey_evaluate import evaluator
+from monkey_evaluate.evaluator import RETURN, eval_index_expression, eval_infix_expression, \
+    evaluate_prefix_expression, is_error, is_truthy
+from monkey_evaluate.quote_unquote import quote
+from monkey_evaluate.resolver import resolve
+from monkey_object.object import *
+
+# 生成器 yield 需要求值的 (节点, 环境)，收到节点的值，最后 return 自身节点的值
+Steps = Generator[Tuple[ast.Node, Environment], Object, Object]
+
+# 复合节点的求值函数，由 register 注册
+steppers: Dict[type, Callable[[ast.Node, Environment], Steps]] = {}
+
+# 不需要求值子节点的节点直接调用 evaluator 的求值函数
+leaves = {node_type: evaluator.evaluators[node_type] for node_type in [
+    ast.IntegerLiteral, ast.Boolean, ast.StringLiteral, ast.Identifier, ast.FunctionLiteral,
+]}
+
+
+def register(node_type: type):
+    def decorator(fn):
+        steppers[node_type] = fn
+        return fn
+
+    return decorator
+
+
+def evaluate(node: ast.Node, env: Environment):
+    return run(node_steps(node, env))
+
+
+def node_steps(node: ast.Node, env: Environment) -> Steps:
+    return (yield node, env)
+
+
+def run(steps: Steps):
+    """执行 steps 直到返回，所有未完成的复合节点的求值状态都保存在 stack 中"""
+    stack = [steps]
+    value = None
+    while True:
+        try:
+            node, env = stack[-1].send(value)
+        except StopIteration as stop:
+            stack.pop()
+            if not stack:
+                return stop.value
+            value = stop.value
+            continue
+        node_type = type(node)
+        stepper = steppers.get(node_type, None)
+        if stepper is not None:
+            stack.append(stepper(node, env))
+            value = None
+        else:
+            leaf = leaves.get(node_type, None)
+            # 其他模块注册到 evaluator 的节点类型仍由 evaluator 求值
+            value = leaf(node, env) if leaf is not None else evaluator.evaluate(node, env)
+
+
+def call_function(func: Object, args: List[Object]):
+    """高阶内置函数回调 Monkey 函数的入口，返回 (结果, 错误信息)"""
+    if isinstance(func, Function) and len(args) != len(func.parameters):
+        return None, f"wrong number of arguments: want={len(func.parameters)}, got={len(args)}"
+    result = apply_function(func, args)
+    if is_error(result):
+        return None, result.message
+    return (result if result is not None else NULL), None
+
+
+def apply_function(func: Object, args: List[Object]):
+    if isinstance(func, Function) and func.code is None:
+        return run(steps_of_function(func, args))
+    if isinstance(func, Builtin) and func.higher_order:
+        result, err = func.fn(call_function, *args)
+        return Error(err) if err is not None else result
+    return evaluator.apply_function(func, args)
+
+
+def steps_of_function(func: Function, args: List[Object]) -> Steps:
+    if func.layout is None:
+        env = Environment.new_enclosed_environment(func.env)
+        for i, param in enumerate(func.parameters):
+            env.put(param.value, args[i])
+    else:
+        env = SlotEnvironment(func.layout, func.env)
+        for i, param in enumerate(func.parameters):
+            env.values[param.slot] = args[i]
+    ret = yield func.body, env
+    if ret is RETURN:
+        return ret.value
+    return ret
+
+
+@register(ast.Program)
+def program_steps(node: ast.Program, env: Environment) -> Steps:
+    resolve(node)
+    result = NULL
+    for stmt in node.statements:
+        result = yield stmt, env
+        if result is RETURN:
+            return result.value
+        if isinstance(result, Error):
+            return result
+    return result
+
+
+@register(ast.ExpressionStatement)
+def expression_statement_steps(node: ast.ExpressionStatement, env: Environment) -> Steps:
+    return (yield node.expression, env)
+
+
+@register(ast.BlockStatement)
+def block_statement_steps(node: ast.BlockStatement, env: Environment) -> Steps:
+    ret = NULL
+    for stmt in node.statements:
+        ret = yield stmt, env
+        if ret is RETURN or isinstance(ret, Error):
+            return ret
+    return ret
+
+
+@register(ast.PrefixExpression)
+def prefix_expression_steps(node: ast.PrefixExpression, env: Environment) -> Steps:
+    right = yield node.right, env
+    if right is RETURN or is_error(right):
+        return right
+    return evaluate_prefix_expression(node.operator, right)
+
+
+@register(ast.InfixExpression)
+def infix_expression_steps(node: ast.InfixExpression, env: Environment) -> Steps:
+    left = yield node.left, env
+    if left is RETURN or is_error(left):
+        return left
+    right = yield node.right, env
+    if right is RETURN or is_error(right):
+        return right
+    return eval_infix_expression(node.operator, left, right)
+
+
+@register(ast.IFExpression)
+def if_expression_steps(node: ast.IFExpression, env: Environment) -> Steps:
+    condition = yield node.condition, env
+    if condition is RETURN:
+        return condition
+    if is_truthy(condition):
+        return (yield node.consequence, env)
+    return (yield node.alternative, env)
+
+
+@register(ast.WhileExpression)
+def while_expression_steps(node: ast.WhileExpression, env: Environment) -> Steps:
+    while True:
+        condition = yield node.condition, env
+        if condition is RETURN or is_error(condition):
+            return condition
+        if not is_truthy(condition):
+            return NULL
+        ret = yield node.body, env
+        if ret is RETURN or isinstance(ret, Error):
+            return ret
+
+
+@register(ast.ForExpression)
+def for_expression_steps(node: ast.ForExpression, env: Environment) -> Steps:
+    iterable = yield node.iterable, env
+    if iterable is RETURN or is_error(iterable):
+        return iterable
+    if not isinstance(iterable, Array):
+        return Error(f"for-in not supported: {iterable.type()}")
+    for element in iterable:
+        scope = evaluator.iteration_environment(node, element, env)
+        ret = yield node.body, scope
+        evaluator.end_iteration(node, scope, env)
+        if ret is RETURN or isinstance(ret, Error):
+            return ret
+    return NULL
+
+
+@register(ast.ReturnStatement)
+def return_statement_steps(node: ast.ReturnStatement, env: Environment) -> Steps:
+    val = yield node.return_value, env
+    if val is RETURN or is_error(val):
+        return val
+    RETURN.value = val
+    return RETURN
+
+
+@register(ast.LetStatement)
+def let_statement_steps(node: ast.LetStatement, env: Environment) -> Steps:
+    val = yield node.value, env
+    if val is RETURN:
+        return val
+    evaluator.define(node.name, val, env)
+    if is_error(val):
+        return val
+    return NULL
+
+
+@register(ast.AssignExpression)
+def assign_expression_steps(node: ast.AssignExpression, env: Environment) -> Steps:
+    val = yield node.value, env
+    if val is RETURN or is_error(val):
+        return val
+    if not evaluator.assign(node.name, val, env):
+        return Error(f"identifier not found: {node.name.value}")
+    return val
+
+
+def expressions_steps(args: List[ast.Expression], env: Environment) -> Steps:
+    """与 evaluator.eval_expressions 相同，遇到错误或 RETURN 时停止，结果只含这一项"""
+    result = []
+    for arg in args or []:
+        ret = yield arg, env
+        if ret is RETURN or is_error(ret):
+            return [ret]
+        result.append(ret)
+    return result
+
+
+@register(ast.CallExpression)
+def call_expression_steps(node: ast.CallExpression, env: Environment) -> Steps:
+    if node.function.literal() == 'quote':
+        return quote(node.arguments[0], env)
+    func = yield node.function, env
+    if func is RETURN or is_error(func):
+        return func
+    arguments = yield from expressions_steps(node.arguments, env)
+    if len(arguments) == 1 and (arguments[0] is RETURN or is_error(arguments[0])):
+        return arguments[0]
+    if isinstance(func, Function) and func.code is None:
+        # Monkey 函数调用不递归 run，函数体同样在 stack 上求值
+        return (yield from steps_of_function(func, arguments))
+    return apply_function(func, arguments)
+
+
+@register(ast.ArrayLiteral)
+def array_literal_steps(node: ast.ArrayLiteral, env: Environment) -> Steps:
+    elements = yield from expressions_steps(node.elements, env)
+    if len(elements) == 1 and (elements[0] is RETURN or is_error(elements[0])):
+        return elements[0]
+    return new_array(elements)
+
+
+@register(ast.IndexExpression)
+def index_expression_steps(node: ast.IndexExpression, env: Environment) -> Steps:
+    left = yield node.left, env
+    if left is RETURN or is_error(left):
+        return left
+    index = yield node.index, env
+    if index is RETURN or is_error(index):
+        return index
+    return eval_index_expression(left, index)
+
+
+@register(ast.HashLiteral)
+def hash_literal_steps(node: ast.HashLiteral, env: Environment) -> Steps:
+    pairs = {}
+    for key_node, val_node in node.pairs.items():
+        key = yield key_node, env
+        if key is RETURN or is_error(key):
+            return key
+        value = yield val_node, env
+        if value is RETURN:
+            return value
+        pairs[key.hash_key()] = HashPair(key, value)
+    return Hash(pairs)
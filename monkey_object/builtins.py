@@ -1,3 +1,5 @@
+from array import array
+
 from monkey_object import object
 
 def length(*args):
@@ -5,9 +7,9 @@ def length(*args):
     if len(args) != 1:
         return object.Error(f"wrong number of arguments. got={len(args)}, want=1")
     elif isinstance(arg, object.String):
-        return object.Integer(len(arg.value))
+        return object.new_integer(len(arg.value))
     elif isinstance(arg, object.Array):
-        return object.Integer(len(arg.elements))
+        return object.new_integer(arg.length())
     return object.Error(f"argument to 'len' not supported, got {arg.type()}")
 
 
@@ -17,8 +19,8 @@ def first(*args):
         return object.Error(f"wrong number of arguments. got {len(args)}, want 1")
     if arg.type() != object.ARRAY_OBJ:
         return object.Error(f"argument to 'first' must be ARRAY, got {arg.type()}")
-    if len(arg.elements) > 0:
-        return arg.elements[0]
+    if arg.length() > 0:
+        return arg.get(0)
     return object.NULL
 
 
@@ -28,8 +30,8 @@ def last(*args):
         return object.Error(f"wrong number of arguments. got {len(args)}, want 1")
     if arg.type() != object.ARRAY_OBJ:
         return object.Error(f"argument to 'last' must be ARRAY, got {arg.type()}")
-    if len(arg.elements) > 0:
-        return arg.elements[-1]
+    if arg.length() > 0:
+        return arg.get(arg.length() - 1)
     return object.NULL
 
 
@@ -39,8 +41,8 @@ def rest(*args):
         return object.Error(f"wrong number of arguments. got {len(args)}, want 1")
     if arg.type() != object.ARRAY_OBJ:
         return object.Error(f"argument to 'last' must be object.Array, got {arg.type()}")
-    if len(arg.elements) > 0:
-        return object.Array(arg.elements[1:])
+    if arg.length() > 0:
+        return arg.rest()
     return object.NULL
 
 
@@ -51,9 +53,153 @@ def push(*args):
         return object.Error(f"wrong number of arguments. got {len(args)}, want 2")
     if arg.type() != object.ARRAY_OBJ:
         return object.Error(f"argument to 'push' must be ARRAY, got {arg.type()}")
-    new_arr = arg.elements[:]
-    new_arr.append(obj)
-    return object.Array(new_arr)
+    return arg.push(obj)
+
+
+def set_pair(*args):
+    if len(args) != 3:
+        return object.Error(f"wrong number of arguments. got {len(args)}, want 3")
+    h, key, value = args
+    if h.type() != object.HASH_OBJ:
+        return object.Error(f"argument to 'set' must be HASH, got {h.type()}")
+    if not isinstance(key, object.Hashable):
+        return object.Error(f"unusable as hash key: {key.type()}")
+    return h.set(key, value)
+
+
+def delete(*args):
+    if len(args) != 2:
+        return object.Error(f"wrong number of arguments. got {len(args)}, want 2")
+    h, key = args
+    if h.type() != object.HASH_OBJ:
+        return object.Error(f"argument to 'delete' must be HASH, got {h.type()}")
+    if not isinstance(key, object.Hashable):
+        return object.Error(f"unusable as hash key: {key.type()}")
+    return h.delete(key)
+
+
+def merge(*args):
+    if len(args) != 2:
+        return object.Error(f"wrong number of arguments. got {len(args)}, want 2")
+    for arg in args:
+        if arg.type() != object.HASH_OBJ:
+            return object.Error(f"arguments to 'merge' must be HASH, got {arg.type()}")
+    return args[0].merge(args[1])
+
+
+def range_array(*args):
+    """range(stop)、range(start, stop) 或 range(start, stop, step)，结果直接存放在 IntegerArray 中"""
+    if len(args) < 1 or len(args) > 3:
+        return object.Error(f"wrong number of arguments. got {len(args)}, want 1 to 3")
+    for arg in args:
+        if not object.is_int64(arg):
+            return object.Error(f"arguments to 'range' must be INTEGER, got {arg.type()}")
+    values = [arg.value for arg in args]
+    if len(values) == 3 and values[2] == 0:
+        return object.Error("'range' step must not be zero")
+    return object.IntegerArray(array("q", range(*values)))
+
+
+def sum_array(*args):
+    if len(args) != 1:
+        return object.Error(f"wrong number of arguments. got {len(args)}, want 1")
+    arr = args[0]
+    if arr.type() != object.ARRAY_OBJ:
+        return object.Error(f"argument to 'sum' must be ARRAY, got {arr.type()}")
+    if isinstance(arr, object.IntegerArray):
+        return object.new_integer(sum(arr.values()))
+    total = 0
+    for e in arr:
+        if e.type() != object.INTEGER_OBJ:
+            return object.Error(f"elements of 'sum' must be INTEGER, got {e.type()}")
+        total += e.value
+    return object.new_integer(total)
+
+
+def sort_array(*args):
+    """整数或字符串数组按值升序排列"""
+    if len(args) != 1:
+        return object.Error(f"wrong number of arguments. got {len(args)}, want 1")
+    arr = args[0]
+    if arr.type() != object.ARRAY_OBJ:
+        return object.Error(f"argument to 'sort' must be ARRAY, got {arr.type()}")
+    if isinstance(arr, object.IntegerArray):
+        return object.IntegerArray(array("q", sorted(arr.values())))
+    elements = arr.elements
+    if elements:
+        kind = elements[0].type()
+        if kind not in (object.INTEGER_OBJ, object.STRING_OBJ):
+            return object.Error(f"elements of 'sort' must be INTEGER or STRING, got {kind}")
+        for e in elements:
+            if e.type() != kind:
+                return object.Error(f"elements of 'sort' must have the same type, got {kind} and {e.type()}")
+    return object.Array(sorted(elements, key=lambda e: e.value))
+
+
+def is_callable(obj: object.Object) -> bool:
+    return obj.type() in (object.CLOSURE_OBJ, object.BUILTIN_OBJ, object.FUNCTION_OBJ)
+
+
+def is_truthy(obj: object.Object) -> bool:
+    if isinstance(obj, object.Boolean):
+        return obj.value
+    return not isinstance(obj, object.Null)
+
+
+def check_array_and_function(name: str, arr: object.Object, fn: object.Object):
+    if arr.type() != object.ARRAY_OBJ:
+        return object.Error(f"argument to '{name}' must be ARRAY, got {arr.type()}")
+    if not is_callable(fn):
+        return object.Error(f"argument to '{name}' must be a function, got {fn.type()}")
+    return None
+
+
+def map_array(call, *args):
+    if len(args) != 2:
+        return object.Error(f"wrong number of arguments. got {len(args)}, want 2"), None
+    arr, fn = args
+    err = check_array_and_function("map", arr, fn)
+    if err is not None:
+        return err, None
+    results = []
+    for e in arr:
+        value, err = call(fn, [e])
+        if err is not None:
+            return None, err
+        results.append(value)
+    return object.new_array(results), None
+
+
+def filter_array(call, *args):
+    if len(args) != 2:
+        return object.Error(f"wrong number of arguments. got {len(args)}, want 2"), None
+    arr, fn = args
+    err = check_array_and_function("filter", arr, fn)
+    if err is not None:
+        return err, None
+    kept = []
+    for e in arr:
+        value, err = call(fn, [e])
+        if err is not None:
+            return None, err
+        if is_truthy(value):
+            kept.append(e)
+    return object.new_array(kept), None
+
+
+def reduce_array(call, *args):
+    """reduce(arr, initial, fn)，fn(累计值, 元素)"""
+    if len(args) != 3:
+        return object.Error(f"wrong number of arguments. got {len(args)}, want 3"), None
+    arr, acc, fn = args
+    err = check_array_and_function("reduce", arr, fn)
+    if err is not None:
+        return err, None
+    for e in arr:
+        acc, err = call(fn, [acc, e])
+        if err is not None:
+            return None, err
+    return acc, None
 
 
 def puts(*args):
@@ -68,4 +214,14 @@ builtins = [
     ("last", object.Builtin(fn=last)),
     ("rest", object.Builtin(fn=rest)),
     ("push", object.Builtin(fn=push)),
+    # 新的内置函数追加在末尾，已编译字节码中的下标保持不变
+    ("set", object.Builtin(fn=set_pair)),
+    ("delete", object.Builtin(fn=delete)),
+    ("merge", object.Builtin(fn=merge)),
+    ("range", object.Builtin(fn=range_array)),
+    ("sum", object.Builtin(fn=sum_array)),
+    ("map", object.Builtin(fn=map_array, higher_order=True)),
+    ("filter", object.Builtin(fn=filter_array, higher_order=True)),
+    ("reduce", object.Builtin(fn=reduce_array, higher_order=True)),
+    ("sort", object.Builtin(fn=sort_array)),
 ]
\ No newline at end of file
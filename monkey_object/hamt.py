@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+持久化哈希映射（Hash Array Mapped Trie）。
+
+键的哈希值每次取 5 位，在 32 叉的树中逐层定位。每个节点用位图记录哪些分支存在，
+分支按位图中的顺序紧凑地存放在元组里。更新时只复制从根到目标节点路径上的节点，
+其余子树在新旧映射之间共享，所以 set/delete 都是 O(log32 n)，旧映射保持不变。
+"""
+from collections.abc import Mapping
+from typing import Any, Iterator, Optional, Tuple
+
+BITS = 5
+MASK = (1 << BITS) - 1
+# Python 的哈希值是有符号 64 位整数，统一转换为非负数
+HASH_MASK = (1 << 64) - 1
+
+_MISSING = object()
+
+
+def hash_of(key) -> int:
+    return hash(key) & HASH_MASK
+
+
+class BitmapNode:
+    """
+    array 中每两个元素为一组：(键, 值) 或 (None, 子节点)。
+    Hash 的键是 HashKey，不会为 None。
+    """
+    __slots__ = ("bitmap", "array")
+
+    def __init__(self, bitmap: int, array: Tuple):
+        self.bitmap = bitmap
+        self.array = array
+
+    def find(self, shift: int, h: int, key, default):
+        bit = 1 << ((h >> shift) & MASK)
+        if not self.bitmap & bit:
+            return default
+        i = 2 * bin(self.bitmap & (bit - 1)).count("1")
+        k = self.array[i]
+        if k is None:
+            return self.array[i + 1].find(shift + BITS, h, key, default)
+        if k == key:
+            return self.array[i + 1]
+        return default
+
+    def assoc(self, shift: int, h: int, key, value) -> Tuple["BitmapNode", bool]:
+        """返回新节点和是否新增了键"""
+        bit = 1 << ((h >> shift) & MASK)
+        i = 2 * bin(self.bitmap & (bit - 1)).count("1")
+        array = self.array
+        if not self.bitmap & bit:
+            return BitmapNode(self.bitmap | bit, array[:i] + (key, value) + array[i:]), True
+        k, v = array[i], array[i + 1]
+        if k is None:
+            child, added = v.assoc(shift + BITS, h, key, value)
+            if child is v:
+                return self, False
+            return BitmapNode(self.bitmap, array[:i + 1] + (child,) + array[i + 2:]), added
+        if k == key:
+            if v is value:
+                return self, False
+            return BitmapNode(self.bitmap, array[:i + 1] + (value,) + array[i + 2:]), False
+        child = create_node(shift + BITS, k, v, h, key, value)
+        return BitmapNode(self.bitmap, array[:i] + (None, child) + array[i + 2:]), True
+
+    def without(self, shift: int, h: int, key) -> Optional["BitmapNode"]:
+        """返回删除键后的节点，节点变空时返回 None"""
+        bit = 1 << ((h >> shift) & MASK)
+        if not self.bitmap & bit:
+            return self
+        i = 2 * bin(self.bitmap & (bit - 1)).count("1")
+        array = self.array
+        k, v = array[i], array[i + 1]
+        if k is None:
+            child = v.without(shift + BITS, h, key)
+            if child is v:
+                return self
+            if child is not None:
+                return BitmapNode(self.bitmap, array[:i + 1] + (child,) + array[i + 2:])
+        elif k != key:
+            return self
+        if self.bitmap == bit:
+            return None
+        return BitmapNode(self.bitmap ^ bit, array[:i] + array[i + 2:])
+
+    def items(self) -> Iterator[Tuple[Any, Any]]:
+        array = self.array
+        for i in range(0, len(array), 2):
+            if array[i] is None:
+                yield from array[i + 1].items()
+            else:
+                yield array[i], array[i + 1]
+
+
+class CollisionNode:
+    """哈希值完全相同的键，线性查找"""
+    __slots__ = ("hash", "array")
+
+    def __init__(self, h: int, array: Tuple):
+        self.hash = h
+        self.array = array
+
+    def index_of(self, key) -> int:
+        for i in range(0, len(self.array), 2):
+            if self.array[i] == key:
+                return i
+        return -1
+
+    def find(self, shift: int, h: int, key, default):
+        if h != self.hash:
+            return default
+        i = self.index_of(key)
+        return default if i < 0 else self.array[i + 1]
+
+    def assoc(self, shift: int, h: int, key, value):
+        if h != self.hash:
+            # 哈希值不同，在冲突节点外包一层位图节点再插入
+            node = BitmapNode(1 << ((self.hash >> shift) & MASK), (None, self))
+            return node.assoc(shift, h, key, value)
+        i = self.index_of(key)
+        if i < 0:
+            return CollisionNode(h, self.array + (key, value)), True
+        if self.array[i + 1] is value:
+            return self, False
+        return CollisionNode(h, self.array[:i + 1] + (value,) + self.array[i + 2:]), False
+
+    def without(self, shift: int, h: int, key):
+        if h != self.hash:
+            return self
+        i = self.index_of(key)
+        if i < 0:
+            return self
+        if len(self.array) == 2:
+            return None
+        return CollisionNode(h, self.array[:i] + self.array[i + 2:])
+
+    def items(self):
+        for i in range(0, len(self.array), 2):
+            yield self.array[i], self.array[i + 1]
+
+
+def create_node(shift: int, k1, v1, h2: int, k2, v2):
+    h1 = hash_of(k1)
+    if h1 == h2:
+        return CollisionNode(h1, (k1, v1, k2, v2))
+    node, _ = EMPTY_NODE.assoc(shift, h1, k1, v1)
+    node, _ = node.assoc(shift, h2, k2, v2)
+    return node
+
+
+EMPTY_NODE = BitmapNode(0, ())
+
+
+class HamtMap(Mapping):
+    """
+    不可变映射，读操作与 dict 相同，set/delete/update 返回新映射并与原映射共享结构。
+    """
+    __slots__ = ("root", "count")
+
+    def __init__(self, items=None):
+        self.root = EMPTY_NODE
+        self.count = 0
+        if items is not None:
+            if isinstance(items, Mapping):
+                items = items.items()
+            for key, value in items:
+                self.root, added = self.root.assoc(0, hash_of(key), key, value)
+                self.count += added
+
+    @classmethod
+    def new(cls, root, count: int) -> "HamtMap":
+        m = cls.__new__(cls)
+        m.root = root
+        m.count = count
+        return m
+
+    def get(self, key, default=None):
+        return self.root.find(0, hash_of(key), key, default)
+
+    def __getitem__(self, key):
+        value = self.root.find(0, hash_of(key), key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key) -> bool:
+        return self.root.find(0, hash_of(key), key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self):
+        for key, _ in self.root.items():
+            yield key
+
+    def items(self):
+        return self.root.items()
+
+    def values(self):
+        for _, value in self.root.items():
+            yield value
+
+    def set(self, key, value) -> "HamtMap":
+        root, added = self.root.assoc(0, hash_of(key), key, value)
+        if root is self.root:
+            return self
+        return HamtMap.new(root, self.count + added)
+
+    def delete(self, key) -> "HamtMap":
+        root = self.root.without(0, hash_of(key), key)
+        if root is self.root:
+            return self
+        return HamtMap.new(EMPTY_NODE if root is None else root, self.count - 1)
+
+    def update(self, items) -> "HamtMap":
+        """依次写入 items 中的键值对，已有的键被覆盖"""
+        if isinstance(items, Mapping):
+            items = items.items()
+        root, count = self.root, self.count
+        for key, value in items:
+            root, added = root.assoc(0, hash_of(key), key, value)
+            count += added
+        return HamtMap.new(root, count)
+
+    def __repr__(self):
+        return f"HamtMap({dict(self.items())})"
@@ -2,7 +2,7 @@
 from monkey_ast import ast
 from monkey_object import object
 from util.test_util import check_type
-from monkey_evaluate.evaluator import evaluate
+from monkey_evaluate.evaluator import evaluate, register
 from monkey_ast.modify import modify
 
 
@@ -14,11 +14,15 @@ def is_macro_definition(stmt: ast.Statement):
     return ok
 
 
+@register(ast.MacroLiteral)
+def eval_macro_literal(node: ast.MacroLiteral, env: object.Environment):
+    return object.Macro(parameters=node.parameters, env=env, body=node.body)
+
+
 def add_macro(stmt: ast.Statement, env: object.Environment):
     let_stmt = check_type(ast.LetStatement, stmt)
     macro_literal, _ = check_type(ast.MacroLiteral, let_stmt.value)
-    macro = object.Macro(parameters=macro_literal.parameters, env=env, body=macro_literal.body)
-    env.put(let_stmt.name.value, macro)
+    env.put(let_stmt.name.value, eval_macro_literal(macro_literal, env))
 
 
 def define_macro(program: ast.Program, env: object.Environment):
@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 from abc import abstractmethod
-from dataclasses import dataclass
-from typing import Dict, Callable, List
-from monkey_code import code
+from array import array
+from dataclasses import dataclass, field
+from typing import Any, Dict, Callable, List, Mapping, NamedTuple, Optional, Union
+from monkey_code import code, register_code
 from monkey_ast import ast
+from monkey_object.hamt import HamtMap
 
 NULL_OBJ = "NULL"
 INTEGER_OBJ = "INTEGER"
@@ -21,25 +23,17 @@ COMPILED_FUNCTION_OBJ = "COMPILED_FUNCTION_OBJ"
 CLOSURE_OBJ = "CLOSURE"
 
 
-@dataclass
-class HashKey:
+class HashKey(NamedTuple):
+    """
+    Hash 的键：(类型, 值) 元组，直接使用 Python 内置的哈希和相等比较。
+    字符串的值就是字符串本身，其哈希值由解释器缓存在 str 对象上。
+    """
     key_type: str = None
-    value: int = 0
-
-    def __hash__(self):
-        return hash(self.key_type) + hash(self.value)
-
-
-def fnv1a_64(data):
-    h = 0xcbf29ce484222325
-    for b in data:
-        h ^= b
-        h *= 0x100000001b3
-        h &= 0xFFFFFFFFFFFFFFFF
-    return h
+    value: Any = 0
 
 
 class Object:
+    __slots__ = ()
     value = None
 
     @abstractmethod
@@ -52,15 +46,18 @@ class Object:
 
 
 class Hashable(Object):
+    __slots__ = ()
 
     @abstractmethod
     def hash_key(self) -> HashKey:
         pass
 
 
-@dataclass
+@dataclass(slots=True)
 class Integer(Hashable):
     value: int
+    # 首次调用 hash_key 时缓存，整数、布尔值和字符串对象的值不会改变
+    _hash_key: Optional[HashKey] = field(default=None, init=False, repr=False, compare=False)
 
     def type(self) -> str:
         return INTEGER_OBJ
@@ -72,16 +69,34 @@ class Integer(Hashable):
         return self.inspect()
 
     def hash_key(self) -> HashKey:
-        return HashKey(self.type(), value=self.value)
+        key = self._hash_key
+        if key is None:
+            key = self._hash_key = HashKey(INTEGER_OBJ, self.value)
+        return key
 
     @classmethod
     def copy(cls, obj: Object):
         return cls(obj.value)
 
 
-@dataclass
+# 小整数缓存：该范围内的整数对象全局共享，避免热点运算中的重复分配
+SMALL_INT_MIN = -5
+SMALL_INT_MAX = 1024
+small_integers = [Integer(v) for v in range(SMALL_INT_MIN, SMALL_INT_MAX + 1)]
+
+
+def new_integer(value: int) -> Integer:
+    """创建整数对象，小整数直接返回缓存中的共享对象"""
+    if type(value) is int and SMALL_INT_MIN <= value <= SMALL_INT_MAX:
+        return small_integers[value - SMALL_INT_MIN]
+    return Integer(value)
+
+
+@dataclass(slots=True)
 class Boolean(Hashable):
     value: bool
+    # 首次调用 hash_key 时缓存，整数、布尔值和字符串对象的值不会改变
+    _hash_key: Optional[HashKey] = field(default=None, init=False, repr=False, compare=False)
 
     def type(self) -> str:
         return BOOLEAN_OBJ
@@ -89,19 +104,18 @@ class Boolean(Hashable):
     def inspect(self) -> str:
         return str(self.value).lower()
 
-    def hash_key(self):
-        if self.value:
-            value = 1
-        else:
-            value = 0
-        return HashKey(self.type(), value)
+    def hash_key(self) -> HashKey:
+        key = self._hash_key
+        if key is None:
+            key = self._hash_key = HashKey(BOOLEAN_OBJ, 1 if self.value else 0)
+        return key
 
     @classmethod
     def copy(cls, obj: Object):
         return cls(obj.value)
 
 
-@dataclass
+@dataclass(slots=True)
 class Null(Object):
 
     def type(self) -> str:
@@ -111,7 +125,7 @@ class Null(Object):
         return 'null'
 
 
-@dataclass
+@dataclass(slots=True)
 class ReturnValue(Object):
     value: Object
 
@@ -122,7 +136,7 @@ class ReturnValue(Object):
         return self.value.inspect()
 
 
-@dataclass
+@dataclass(slots=True)
 class Error(Object):
     message: str
 
@@ -139,22 +153,43 @@ FALSE = Boolean(False)
 
 
 class Environment:
-    store: Dict[str, Object] = None
-    outer: 'Environment' = None
+    __slots__ = ("store", "outer")
+    store: Dict[str, Object]
+    outer: Optional['Environment']
 
     def __init__(self):
         self.store = {}
+        self.outer = None
 
     def get(self, name: str) -> Object:
-        val = self.store.get(name, NULL)
-        if val == NULL and self.outer:
-            val = self.outer.get(name)
+        val = self.find(name)
+        return NULL if val is None else val
+
+    def find(self, name: str) -> Optional[Object]:
+        """按名字逐层向外查找，找不到时返回 None"""
+        val = self.store.get(name, None)
+        if val is None and self.outer is not None:
+            return self.outer.find(name)
         return val
 
+    @property
+    def root(self) -> 'Environment':
+        """按名字查找全局变量的起点"""
+        return self
+
     def put(self, name: str, obj: Object) -> Object:
         self.store[name] = obj
         return obj
 
+    def assign(self, name: str, obj: Object) -> bool:
+        """修改已定义的变量：变量定义在哪一层环境就修改哪一层，未定义时返回 False"""
+        if name in self.store:
+            self.store[name] = obj
+            return True
+        if self.outer is not None:
+            return self.outer.assign(name, obj)
+        return False
+
     @classmethod
     def new_enclosed_environment(cls, outer: 'Environment'):
         env = cls()
@@ -162,11 +197,55 @@ class Environment:
         return env
 
 
-@dataclass
+class SlotEnvironment:
+    """
+    函数调用的环境，变量按解析器分配的槽位保存在定长列表中，见 monkey_evaluate/resolver.py。
+    layout 是函数字面量上的 变量名 -> 槽位 表，同一函数的所有调用共享，只在按名字查找时使用。
+    槽位为 None 表示变量还没有定义。
+    """
+    __slots__ = ("values", "layout", "outer", "root")
+    values: List[Optional[Object]]
+    layout: Dict[str, int]
+    outer: Union[Environment, 'SlotEnvironment']
+    root: Environment
+
+    def __init__(self, layout: Dict[str, int], outer: Union[Environment, 'SlotEnvironment']):
+        self.values = [None] * len(layout)
+        self.layout = layout
+        self.outer = outer
+        self.root = outer.root
+
+    def get(self, name: str) -> Object:
+        val = self.find(name)
+        return NULL if val is None else val
+
+    def find(self, name: str) -> Optional[Object]:
+        slot = self.layout.get(name, None)
+        if slot is not None and self.values[slot] is not None:
+            return self.values[slot]
+        return self.outer.find(name)
+
+    def put(self, name: str, obj: Object) -> Object:
+        self.values[self.layout[name]] = obj
+        return obj
+
+    def assign(self, name: str, obj: Object) -> bool:
+        slot = self.layout.get(name, None)
+        if slot is not None and self.values[slot] is not None:
+            self.values[slot] = obj
+            return True
+        return self.outer.assign(name, obj)
+
+
+@dataclass(slots=True)
 class Function(Object):
     parameters: list[ast.Identifier] = None
     body: ast.BlockStatement = None
-    env: Environment = None
+    env: Union[Environment, SlotEnvironment] = None
+    # 经过解析的函数字面量的 layout，调用时使用 SlotEnvironment
+    layout: Optional[Dict[str, int]] = None
+    # 由 monkey_evaluate/closure_evaluator.py 创建的函数：编译成闭包的函数体，参数为调用环境
+    code: Optional[Callable[['SlotEnvironment'], Object]] = None
 
     def type(self) -> str:
         return FUNCTION_OBJ
@@ -182,12 +261,14 @@ class Function(Object):
 
     @classmethod
     def copy(cls, func: Object):
-        return cls(func.parameters, func.body, func.env)
+        return cls(func.parameters, func.body, func.env, func.layout, func.code)
 
 
-@dataclass
+@dataclass(slots=True)
 class String(Hashable):
     value: str = None
+    # 首次调用 hash_key 时缓存，整数、布尔值和字符串对象的值不会改变
+    _hash_key: Optional[HashKey] = field(default=None, init=False, repr=False, compare=False)
 
     def type(self) -> str:
         return STRING_OBJ
@@ -203,13 +284,18 @@ class String(Hashable):
         return cls(obj.value)
 
     def hash_key(self) -> HashKey:
-        hash_value = fnv1a_64(self.value.encode('utf-8'))
-        return HashKey(self.type(), hash_value)
+        key = self._hash_key
+        if key is None:
+            key = self._hash_key = HashKey(STRING_OBJ, self.value)
+        return key
 
 
-@dataclass
+@dataclass(slots=True)
 class Builtin(Object):
     fn: Callable = None
+    # 高阶内置函数以 fn(call, *args) 调用，call(function, args) 由解释器或虚拟机提供，
+    # 用来回调 Monkey 函数；两者都返回 (结果, 错误信息)
+    higher_order: bool = False
 
     def type(self) -> str:
         return BUILTIN_OBJ
@@ -218,9 +304,52 @@ class Builtin(Object):
         return "builtin function"
 
 
-@dataclass
+@dataclass(eq=False, slots=True)
 class Array(Object):
-    elements: list[Object] = None
+    """
+    不可变数组，元素是共享列表 items 的 [start, end) 区间。
+    rest 只移动起点；push 在数组位于共享列表末尾时原地追加，否则复制。
+    任何数组可见的区间都不会再被修改，因此多个数组可以安全地共享同一个列表。
+    """
+    items: List[Object] = None
+    start: int = 0
+    end: int = 0
+
+    def __init__(self, elements: List[Object] = None, start: int = 0, end: int = None):
+        self.items = elements if elements is not None else []
+        self.start = start
+        self.end = len(self.items) if end is None else end
+
+    @property
+    def elements(self) -> List[Object]:
+        """元素列表，数组覆盖整个共享列表时不复制，调用者不能修改返回的列表"""
+        if self.start == 0 and self.end == len(self.items):
+            return self.items
+        return self.items[self.start: self.end]
+
+    def length(self) -> int:
+        return self.end - self.start
+
+    def __iter__(self):
+        return iter(self.items[self.start: self.end])
+
+    def get(self, index: int) -> Optional[Object]:
+        """下标越界时返回 None"""
+        if index < 0 or index >= self.end - self.start:
+            return None
+        return self.items[self.start + index]
+
+    def rest(self) -> "Array":
+        return Array(self.items, self.start + 1, self.end)
+
+    def push(self, obj: Object) -> "Array":
+        """均摊 O(1)：只有当前数组延伸到共享列表末尾时才能原地追加"""
+        if self.end == len(self.items):
+            self.items.append(obj)
+            return Array(self.items, self.start, self.end + 1)
+        items = self.items[self.start: self.end]
+        items.append(obj)
+        return Array(items)
 
     def type(self) -> str:
         return ARRAY_OBJ
@@ -231,23 +360,112 @@ class Array(Object):
             elems.append(e.inspect())
         return f"[{', '.join(elems)}]"
 
+    def __eq__(self, other):
+        if not isinstance(other, Array):
+            return NotImplemented
+        return self.elements == other.elements
+
     def __repr__(self):
         return self.inspect()
 
 
-@dataclass
+class IntegerArray(Array):
+    """
+    元素全部是整数的数组，items 是 array('q')，每个元素只占 8 字节。
+    取元素时才装箱为 Integer；push 非整数（或超出 64 位范围的整数）时转换为普通数组。
+    """
+    __slots__ = ()
+
+    @property
+    def elements(self) -> List[Object]:
+        return list(self)
+
+    def get(self, index: int) -> Optional[Object]:
+        if index < 0 or index >= self.end - self.start:
+            return None
+        return new_integer(self.items[self.start + index])
+
+    def __iter__(self):
+        return map(new_integer, self.items[self.start: self.end])
+
+    def values(self) -> array:
+        """未装箱的整数值"""
+        return self.items[self.start: self.end]
+
+    def rest(self) -> "Array":
+        return IntegerArray(self.items, self.start + 1, self.end)
+
+    def push(self, obj: Object) -> "Array":
+        if not is_int64(obj):
+            items = self.elements
+            items.append(obj)
+            return Array(items)
+        if self.end == len(self.items):
+            self.items.append(obj.value)
+            return IntegerArray(self.items, self.start, self.end + 1)
+        items = self.items[self.start: self.end]
+        items.append(obj.value)
+        return IntegerArray(items)
+
+    def __eq__(self, other):
+        if isinstance(other, IntegerArray):
+            return self.values() == other.values()
+        return Array.__eq__(self, other)
+
+
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+
+
+def is_int64(obj: Object) -> bool:
+    # 除法的结果是 float，同样不能放入 array('q')
+    return type(obj) is Integer and type(obj.value) is int and INT64_MIN <= obj.value <= INT64_MAX
+
+
+def new_array(elements: List[Object]) -> Array:
+    """创建数组字面量，元素全部是整数时使用紧凑的 IntegerArray"""
+    for e in elements:
+        if not is_int64(e):
+            return Array(elements)
+    return IntegerArray(array("q", [e.value for e in elements]))
+
+
+@dataclass(slots=True)
 class HashPair:
     key: Object = None
     value: Object = None
 
 
-@dataclass
+@dataclass(slots=True)
 class Hash(Object):
-    pairs: Dict[HashKey, HashPair] = None
+    """
+    字面量创建的 Hash 使用 dict 保存键值对；第一次 set/delete/merge 时转换为 HamtMap，
+    此后的非破坏性更新都与原 Hash 共享结构。两种表示的读接口相同。
+    """
+    pairs: Mapping[HashKey, HashPair] = None
 
     def type(self) -> str:
         return HASH_OBJ
 
+    def persistent(self) -> HamtMap:
+        pairs = self.pairs
+        if not isinstance(pairs, HamtMap):
+            # 只改变内部表示，Hash 的内容不变
+            pairs = self.pairs = HamtMap(pairs)
+        return pairs
+
+    def set(self, key: Hashable, value: Object) -> "Hash":
+        return Hash(self.persistent().set(key.hash_key(), HashPair(key, value)))
+
+    def delete(self, key: Hashable) -> "Hash":
+        pairs = self.persistent()
+        updated = pairs.delete(key.hash_key())
+        return self if updated is pairs else Hash(updated)
+
+    def merge(self, other: "Hash") -> "Hash":
+        """other 中的键覆盖本 Hash 中的同名键"""
+        return Hash(self.persistent().update(other.pairs))
+
     def inspect(self) -> str:
         pairs = []
         for (_, pair) in self.pairs.items():
@@ -258,7 +476,7 @@ class Hash(Object):
         return self.inspect()
 
 
-@dataclass
+@dataclass(slots=True)
 class Quote(Object):
     node: ast.Node = None
 
@@ -269,7 +487,7 @@ class Quote(Object):
         return f"QUOTE({self.node.string()})"
 
 
-@dataclass
+@dataclass(slots=True)
 class Macro(Object):
     parameters: list[ast.Identifier] = None
     body: ast.BlockStatement = None
@@ -293,11 +511,13 @@ class Macro(Object):
         return self.inspect()
 
 
-@dataclass
+@dataclass(slots=True)
 class CompiledFunction(Object):
     instructions: code.Instructions = None
     num_locals: int = 0
     num_parameters: int = 0
+    # 虚拟机第一次调用函数时生成的预解码指令，见 code.decode 和 vm.decode_function
+    decoded: List[code.DecodedInstruction] = field(default=None, repr=False, compare=False)
 
     def type(self) -> str:
         return COMPILED_FUNCTION_OBJ
@@ -306,7 +526,22 @@ class CompiledFunction(Object):
         return f"CompiledFunction {self}"
 
 
-@dataclass
+@dataclass(slots=True)
+class RegisterFunction(Object):
+    """寄存器虚拟机的函数原型，常量预先放在寄存器模板的末尾，调用时复制模板作为栈帧的寄存器"""
+    instructions: List[register_code.Instruction] = None
+    num_parameters: int = 0
+    num_free: int = 0
+    registers: List[Object] = field(default=None, repr=False)
+
+    def type(self) -> str:
+        return COMPILED_FUNCTION_OBJ
+
+    def inspect(self) -> str:
+        return f"RegisterFunction[{self.num_parameters}]"
+
+
+@dataclass(slots=True)
 class Closure(Object):
     fn: CompiledFunction = None
     free: List[Object] = None
@@ -316,3 +551,12 @@ class Closure(Object):
 
     def inspect(self) -> str:
         return f"Closure {self}"
+
+
+@dataclass(slots=True)
+class Cell:
+    """
+    被闭包捕获且会被赋值的局部变量。外层函数的栈槽和闭包的 free 中保存的是同一个 Cell，
+    任何一方的赋值对另一方都可见。Cell 只在虚拟机内部使用，不是 Monkey 的值。
+    """
+    value: Optional[Object] = None
@@ -10,18 +10,20 @@ from monkey_token.token import *
 class Precedence(Enum):
     BLANK = 0
     LOWEST = 1
-    LOGIC = 2
-    BITWISE = 3
-    EQUALS = 4  # ==
-    LESS_GREATER = 5  # > or <
-    SUM = 6  # +
-    PRODUCT = 7  # *
-    PREFIX = 8  # -X or !X
-    CALL = 9  # func(X)
-    INDEX = 10
+    ASSIGN = 2  # x = y
+    LOGIC = 3
+    BITWISE = 4
+    EQUALS = 5  # ==
+    LESS_GREATER = 6  # > or <
+    SUM = 7  # +
+    PRODUCT = 8  # *
+    PREFIX = 9  # -X or !X
+    CALL = 10  # func(X)
+    INDEX = 11
 
 
 precedences = {
+    ASSIGN: Precedence.ASSIGN,
     LOGIC_AND: Precedence.LOGIC,
     LOGIC_OR: Precedence.LOGIC,
     BITWISE_AND: Precedence.BITWISE,
@@ -191,6 +193,16 @@ class Parser:
         exp.right = self.parse_expression(precedence)
         return exp
 
+    def parse_assign_expression(self, left: Expression):
+        """赋值是右结合的：a = b = 1 等价于 a = (b = 1)"""
+        if not isinstance(left, Identifier):
+            self.append_error(f"line:{self.lexer.lino}: cannot assign to {left.string()}")
+            return None
+        exp = AssignExpression(token=self.curr, name=left)
+        self.next_token()
+        exp.value = self.parse_expression(Precedence.LOWEST)
+        return exp
+
     def parse_bool_literal(self) -> Expression:
         return Boolean(self.curr, self.curr_token_is(TRUE))
 
@@ -222,6 +234,39 @@ class Parser:
             exp.alternative = self.parse_block_statement()
         return exp
 
+    def parse_while_expression(self):
+        exp = WhileExpression(token=self.curr)
+        if not self.expect_peek(LPAREN):
+            return None
+        self.next_token()
+        exp.condition = self.parse_expression(Precedence.LOWEST)
+        if not self.expect_peek(RPAREN):
+            return None
+        if not self.expect_peek(LBRACE):
+            return None
+        exp.body = self.parse_block_statement()
+        return exp
+
+    def parse_for_expression(self):
+        """for (x in arr) { ... }，括号可以省略：for x in arr { ... }"""
+        exp = ForExpression(token=self.curr)
+        parenthesized = self.peek_token_is(LPAREN)
+        if parenthesized:
+            self.next_token()
+        if not self.expect_peek(IDENT):
+            return None
+        exp.variable = Identifier(self.curr, self.curr.literal)
+        if not self.expect_peek(IN):
+            return None
+        self.next_token()
+        exp.iterable = self.parse_expression(Precedence.LOWEST)
+        if parenthesized and not self.expect_peek(RPAREN):
+            return None
+        if not self.expect_peek(LBRACE):
+            return None
+        exp.body = self.parse_block_statement()
+        return exp
+
     def parse_block_statement(self):
         block = BlockStatement(token=self.curr)
         block.statements = []
@@ -370,10 +415,15 @@ class Parser:
         p.register_infix(NOT_EQ, p.parse_infix_expression)
         p.register_infix(LT, p.parse_infix_expression)
         p.register_infix(GT, p.parse_infix_expression)
+        # 赋值
+        p.register_infix(ASSIGN, p.parse_assign_expression)
         # []
         p.register_infix(LBRACKET, p.parse_index_expression)
         # if
         p.register_prefix(IF, p.parse_if_expression)
+        # 循环
+        p.register_prefix(WHILE, p.parse_while_expression)
+        p.register_prefix(FOR, p.parse_for_expression)
         # function
         p.register_prefix(FUNCTION, p.parse_function_literal)
         # 调用表达式
@@ -7,7 +7,7 @@ from monkey_compiler.symbol_table import SymbolTable
 from monkey_object import object, builtins
 from monkey_parser.parser import parse
 from monkey_vm import vm
-from monkey_vm.vm import GLOBAL_SIZE
+from monkey_vm.vm import INITIAL_GLOBALS
 
 PROMPT = ">>"
 
@@ -21,7 +21,8 @@ def match_eof(code: str):
 
 def run():
     constants = []
-    global_variables = cast(List[object.Object], [None] * GLOBAL_SIZE)
+    # 全局变量列表由虚拟机按需原地扩展，多行输入共享同一个列表
+    global_variables = cast(List[object.Object], [None] * INITIAL_GLOBALS)
     symbol_table = SymbolTable()
     for i, v in enumerate(builtins.builtins):
         symbol_table.define_builtin(i, v[0])
@@ -31,7 +32,7 @@ def run():
             break
         if code:
             program = parse(code)
-            comp = compiler.Compiler.new_with_state(symbol_table, constants)
+            comp = compiler.Compiler.new_with_state(symbol_table, constants, optimize=True)
             err = comp.compile(program)
             if err is not None:
                 print(f"Woops! Compilation failed: \n {err} \n")
@@ -1,4 +1,6 @@
 class Token:
+    __slots__ = ("_token_type", "_literal")
+
     def __init__(self, token_type: str = '', val: str = ''):
         self._token_type = token_type
         self._literal = val
@@ -55,6 +57,9 @@ ASTERISK = "*"
 LT = "<"
 GT = ">"
 IF = "if"
+WHILE = "while"
+FOR = "for"
+IN = "in"
 RETURN = "return"
 TRUE = "true"
 ELSE = "else"
@@ -82,6 +87,9 @@ keywords = {
     'fn': FUNCTION,
     'let': LET,
     'if': IF,
+    'while': WHILE,
+    'for': FOR,
+    'in': IN,
     'return': RETURN,
     'true': TRUE,
     'false': FALSE,
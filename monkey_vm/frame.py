@@ -1,18 +1,21 @@
 from dataclasses import dataclass
+from typing import List
 
 from monkey_code import code
 from monkey_object import object
 
-@dataclass
+@dataclass(slots=True)
 class Frame:
     cl: object.Closure
     ip: int
     base_pointer: int
+    decoded: List[code.DecodedInstruction]
 
     def __init__(self, cl: object.Closure, base_pointer: int):
         self.cl = cl
         self.ip = -1
         self.base_pointer = base_pointer
+        self.decoded = cl.fn.decoded
 
     def instructions(self) -> code.Instructions:
         return self.cl.fn.instructions
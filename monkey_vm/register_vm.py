@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+执行寄存器字节码的虚拟机，见 monkey_code/register_code.py。
+
+每个栈帧持有自己的寄存器列表（函数原型寄存器模板的副本），
+指令直接读写寄存器，不经过操作数栈，也没有 push/pop 的边界检查。
+"""
+import sys
+from dataclasses import dataclass
+from typing import List, Optional, cast
+
+from monkey_code import register_code as rc
+from monkey_object import object, builtins
+from monkey_vm.vm import GLOBAL_SIZE, MAX_FRAMES, MAX_NESTED_CALLS, TRUE, FALSE, NULL, INITIAL_GLOBALS, grow, \
+    is_truthy, native_bool_to_boolean_object, reserve_python_frames
+
+
+@dataclass(slots=True)
+class RegisterFrame:
+    cl: object.Closure
+    registers: List[object.Object]
+    ip: int
+    # 返回值写入调用者栈帧的该寄存器
+    return_register: int
+
+    def __init__(self, cl: object.Closure, registers: List[object.Object], return_register: int):
+        self.cl = cl
+        self.registers = registers
+        self.ip = 0
+        self.return_register = return_register
+
+
+@dataclass
+class RegisterVM:
+    global_variables: List[object.Object]
+    frames: List[RegisterFrame]
+    max_frames: int
+    max_globals: int
+    max_nested_calls: int
+    nested_calls: int
+    recursion_limit: int
+    result: Optional[object.Object]
+
+    def __init__(self, main_fn: object.RegisterFunction, global_variables: List[object.Object] = None,
+                 max_frames: int = MAX_FRAMES, max_globals: int = GLOBAL_SIZE,
+                 max_nested_calls: int = MAX_NESTED_CALLS):
+        self.max_frames = max_frames
+        self.max_globals = max_globals
+        self.max_nested_calls = max_nested_calls
+        self.nested_calls = 0
+        self.recursion_limit = sys.getrecursionlimit()
+        if global_variables is None:
+            global_variables = cast(List[object.Object], [None] * INITIAL_GLOBALS)
+        self.global_variables = global_variables
+        main_closure = object.Closure(fn=main_fn, free=[])
+        self.frames = [RegisterFrame(cl=main_closure, registers=main_fn.registers[:], return_register=0)]
+        self.result = None
+
+    def last_result(self) -> Optional[object.Object]:
+        """主程序最后一条表达式语句的值"""
+        return self.result
+
+    def run(self) -> Optional[str]:
+        frames = self.frames
+        frm = frames[-1]
+        regs = frm.registers
+        instructions = frm.cl.fn.instructions
+        ip = frm.ip
+        while True:
+            op, a, b, c = instructions[ip]
+            ip += 1
+            # 按执行频率排列分支
+            if op == rc.OpMove:
+                regs[a] = regs[b]
+            elif op == rc.OpAdd or op == rc.OpSub or op == rc.OpMul or op == rc.OpDiv:
+                result, err = self.binary_operation(op, regs[b], regs[c])
+                if err is not None:
+                    return err
+                regs[a] = result
+            elif op == rc.OpJumpNotTruthy:
+                if not is_truthy(regs[a]):
+                    ip = b
+            elif op == rc.OpEqual or op == rc.OpNotEqual or op == rc.OpGreaterThan:
+                result, err = self.comparison(op, regs[b], regs[c])
+                if err is not None:
+                    return err
+                regs[a] = result
+            elif op == rc.OpJump:
+                ip = a
+            elif op == rc.OpGetGlobal:
+                if b >= len(self.global_variables):
+                    err = self.ensure_globals(b + 1)
+                    if err is not None:
+                        return err
+                regs[a] = self.global_variables[b]
+            elif op == rc.OpCall or op == rc.OpTailCall:
+                fn = regs[b]
+                if isinstance(fn, object.Closure):
+                    proto = fn.fn
+                    if c != proto.num_parameters:
+                        return f"wrong number of arguments: want={proto.num_parameters}, got={c}"
+                    callee_regs = proto.registers[:]
+                    callee_regs[0:c] = regs[b + 1: b + 1 + c]
+                    if op == rc.OpTailCall:
+                        # 原地改写当前栈帧，返回值仍写入调用者的 return_register，递归深度不再受 max_frames 限制
+                        frm.cl = fn
+                        frm.registers = callee_regs
+                    else:
+                        if len(frames) >= self.max_frames:
+                            return f"Frame Overflow: max_frames={self.max_frames}"
+                        frm.ip = ip
+                        frm = RegisterFrame(cl=fn, registers=callee_regs, return_register=a)
+                        frames.append(frm)
+                    regs = callee_regs
+                    instructions = proto.instructions
+                    ip = 0
+                elif isinstance(fn, object.Builtin):
+                    if fn.higher_order:
+                        result, err = fn.fn(self.call, *regs[b + 1: b + 1 + c])
+                        if err is not None:
+                            return err
+                    else:
+                        result = fn.fn(*regs[b + 1: b + 1 + c])
+                    regs[a] = result if result is not None else NULL
+                else:
+                    return f"calling non-function and non-built-in"
+            elif op == rc.OpReturn:
+                value = regs[a]
+                frames.pop()
+                if not frames:
+                    self.result = value
+                    return None
+                return_register = frm.return_register
+                frm = frames[-1]
+                regs = frm.registers
+                instructions = frm.cl.fn.instructions
+                ip = frm.ip
+                regs[return_register] = value
+            elif op == rc.OpGetFree:
+                regs[a] = frm.cl.free[b]
+            elif op == rc.OpGetCell:
+                regs[a] = regs[b].value
+            elif op == rc.OpGetFreeCell:
+                regs[a] = frm.cl.free[b].value
+            elif op == rc.OpCurrentClosure:
+                regs[a] = frm.cl
+            elif op == rc.OpGetBuiltin:
+                regs[a] = builtins.builtins[b][1]
+            elif op == rc.OpSetGlobal:
+                err = self.set_global(a, regs[b])
+                if err is not None:
+                    return err
+            elif op == rc.OpIndex:
+                result, err = self.index_expression(regs[b], regs[c])
+                if err is not None:
+                    return err
+                regs[a] = result
+            elif op == rc.OpMinus:
+                operand = regs[b]
+                if operand.type() != object.INTEGER_OBJ:
+                    return f"unsupported type for negation: {operand.type()}"
+                regs[a] = object.new_integer(-operand.value)
+            elif op == rc.OpBang:
+                operand = regs[b]
+                regs[a] = TRUE if operand == FALSE or operand == NULL else FALSE
+            elif op == rc.OpSetCell:
+                regs[a].value = regs[b]
+            elif op == rc.OpSetFree:
+                frm.cl.free[a].value = regs[b]
+            elif op == rc.OpMakeCell:
+                regs[a] = object.Cell(regs[b])
+            elif op == rc.OpForLength:
+                iterable = regs[b]
+                if not isinstance(iterable, object.Array):
+                    return f"for-in not supported: {iterable.type()}"
+                regs[a] = object.new_integer(iterable.length())
+            elif op == rc.OpClosure:
+                proto = regs[b]
+                regs[a] = object.Closure(fn=proto, free=regs[c: c + proto.num_free])
+            elif op == rc.OpArray:
+                regs[a] = object.new_array(regs[b: b + c])
+            elif op == rc.OpHash:
+                result, err = self.build_hash(regs[b: b + c])
+                if err is not None:
+                    return err
+                regs[a] = result
+            else:
+                return f"unknown operator: {op}"
+
+    def call(self, fn: object.Object, args: List[object.Object]):
+        """
+        执行 fn(*args) 直到返回，返回 (结果, 错误信息)，与 VM.call 相同，可以重入。
+        被调闭包在新的栈帧列表中运行，外层 run 的栈帧不受影响。
+        """
+        if isinstance(fn, object.Builtin):
+            if fn.higher_order:
+                return fn.fn(self.call, *args)
+            result = fn.fn(*args)
+            return (result if result is not None else NULL), None
+        if not isinstance(fn, object.Closure):
+            return None, "calling non-function and non-built-in"
+        proto = fn.fn
+        if len(args) != proto.num_parameters:
+            return None, f"wrong number of arguments: want={proto.num_parameters}, got={len(args)}"
+        if self.nested_calls >= self.max_nested_calls:
+            return None, f"too many nested calls: max_nested_calls={self.max_nested_calls}"
+        registers = proto.registers[:]
+        registers[0:len(args)] = args
+        frames, result = self.frames, self.result
+        self.frames = [RegisterFrame(cl=fn, registers=registers, return_register=0)]
+        limit = reserve_python_frames(self.recursion_limit, self.nested_calls + 1)
+        self.nested_calls += 1
+        try:
+            err = self.run()
+        finally:
+            self.nested_calls -= 1
+            sys.setrecursionlimit(limit)
+        value = self.result
+        self.frames, self.result = frames, result
+        if err is not None:
+            return None, err
+        return value, None
+
+    def ensure_globals(self, size: int):
+        """与 VM.ensure_globals 相同，读写全局变量前保证列表至少有 size 个槽位"""
+        if size <= len(self.global_variables):
+            return None
+        if size > self.max_globals:
+            return f"too many globals: max_globals={self.max_globals}"
+        grow(self.global_variables, size, self.max_globals)
+        return None
+
+    def set_global(self, index: int, obj: object.Object):
+        if index >= len(self.global_variables):
+            err = self.ensure_globals(index + 1)
+            if err is not None:
+                return err
+        self.global_variables[index] = obj
+        return None
+
+    @staticmethod
+    def binary_operation(op: rc.Opcode, left: object.Object, right: object.Object):
+        left_type = left.type()
+        right_type = right.type()
+        if left_type == object.INTEGER_OBJ and right_type == object.INTEGER_OBJ:
+            if op == rc.OpAdd:
+                result = left.value + right.value
+            elif op == rc.OpSub:
+                result = left.value - right.value
+            elif op == rc.OpMul:
+                result = left.value * right.value
+            else:
+                result = left.value / right.value
+            return object.new_integer(result), None
+        elif left_type == object.STRING_OBJ and right_type == object.STRING_OBJ:
+            if op != rc.OpAdd:
+                return None, f"unknown string operator: {op}"
+            return object.String(left.value + right.value), None
+        return None, f"unsupported types for binary operation: {left_type} {right_type}"
+
+    @staticmethod
+    def comparison(op: rc.Opcode, left: object.Object, right: object.Object):
+        if left.type() == object.INTEGER_OBJ and right.type() == object.INTEGER_OBJ:
+            if op == rc.OpEqual:
+                return native_bool_to_boolean_object(left.value == right.value), None
+            elif op == rc.OpNotEqual:
+                return native_bool_to_boolean_object(left.value != right.value), None
+            return native_bool_to_boolean_object(left.value > right.value), None
+        if op == rc.OpEqual:
+            return native_bool_to_boolean_object(right == left), None
+        elif op == rc.OpNotEqual:
+            return native_bool_to_boolean_object(right != left), None
+        return None, f"unknown error: {op} {left.type()} {right.type()}"
+
+    @staticmethod
+    def index_expression(left: object.Object, index: object.Object):
+        if left.type() == object.ARRAY_OBJ and index.type() == object.INTEGER_OBJ:
+            element = left.get(index.value)
+            if element is None:
+                return NULL, None
+            return element, None
+        elif left.type() == object.HASH_OBJ:
+            if not isinstance(index, object.Hashable):
+                return None, f"unhashable key {index.type()}"
+            pair = left.pairs.get(index.hash_key(), None)
+            if pair is None:
+                return NULL, None
+            return pair.value, None
+        return None, f"index operator not supported: {left.type()}"
+
+    @staticmethod
+    def build_hash(items: List[object.Object]):
+        hashed_pairs = {}
+        for i in range(0, len(items), 2):
+            key = items[i]
+            if not isinstance(key, object.Hashable):
+                return None, f"unhashable key {key.type()}"
+            hashed_pairs[key.hash_key()] = object.HashPair(key=key, value=items[i + 1])
+        return object.Hash(pairs=hashed_pairs), None
@@ -1,3 +1,4 @@
+import sys
 from dataclasses import dataclass
 from typing import List, cast
 
@@ -6,12 +7,28 @@ from monkey_compiler import compiler
 from monkey_object import object, builtins
 from monkey_vm import frame
 
+# 栈、栈帧和全局变量的默认上限，可以通过 VM 的构造参数修改
 STACK_SIZE = 2048
 GLOBAL_SIZE = 65536
 TRUE = object.Boolean(True)
 FALSE = object.Boolean(False)
 NULL = object.Null()
 MAX_FRAMES = 1024
+# 高阶内置函数回调 Monkey 函数时 call 会递归进入 run，嵌套层数的默认上限
+MAX_NESTED_CALLS = 1000
+# 每层嵌套的 call 为 Python 调用栈预留的栈帧数，见 reserve_python_frames
+NESTED_CALL_FRAMES = 8
+# 初始容量，不够时按两倍增长直到上限
+INITIAL_STACK_SIZE = 64
+INITIAL_FRAMES = 16
+INITIAL_GLOBALS = 16
+# 指令分派方式：if/elif 分支链或按操作码下标查表
+DISPATCH_SWITCH = "switch"
+DISPATCH_TABLE = "table"
+
+
+# call 使用的屏障栈帧：没有指令，执行到这里 run 就会返回
+BARRIER = object.Closure(fn=object.CompiledFunction(instructions=b"", decoded=[]), free=[])
 
 
 @dataclass
@@ -22,22 +39,41 @@ class VM:
     global_variables: List[object.Object]
     frames: List[frame.Frame]
     frame_index: int
-
-
-    def __init__(self, bytecode: compiler.Bytecode):
+    dispatch: str
+    max_stack: int
+    max_frames: int
+    max_globals: int
+    max_nested_calls: int
+    nested_calls: int
+    # 创建虚拟机时 Python 的递归上限，嵌套的 call 在此之上预留栈帧
+    recursion_limit: int
+
+    def __init__(self, bytecode: compiler.Bytecode, dispatch: str = DISPATCH_TABLE,
+                 max_stack: int = STACK_SIZE, max_frames: int = MAX_FRAMES, max_globals: int = GLOBAL_SIZE,
+                 max_nested_calls: int = MAX_NESTED_CALLS):
+        self.dispatch = dispatch
+        self.max_stack = max_stack
+        self.max_frames = max_frames
+        self.max_globals = max_globals
+        self.max_nested_calls = max_nested_calls
+        self.nested_calls = 0
+        self.recursion_limit = sys.getrecursionlimit()
         self.constants = bytecode.constants
-        self.stack = cast(List[object.Object], [None] * STACK_SIZE)
+        self.stack = cast(List[object.Object], [None] * min(INITIAL_STACK_SIZE, max_stack))
         self.sp = 0
-        self.global_variables = cast(List[object.Object], [None] * GLOBAL_SIZE)
+        self.global_variables = cast(List[object.Object], [None] * min(INITIAL_GLOBALS, max_globals))
         self.frame_index = 1
-        self.frames = cast(List[frame.Frame], [None] * MAX_FRAMES)
+        self.frames = cast(List[frame.Frame], [None] * min(INITIAL_FRAMES, max_frames))
         main_fn = object.CompiledFunction(instructions=bytecode.instructions)
+        decode_function(main_fn)
         main_closure = object.Closure(fn=main_fn)
         self.frames[0] = frame.Frame(cl=main_closure, base_pointer=0)
 
     @staticmethod
-    def new_with_global_state(bytecode: compiler.Bytecode, s: List[object.Object]):
-        vm = VM(bytecode)
+    def new_with_global_state(bytecode: compiler.Bytecode, s: List[object.Object],
+                              dispatch: str = DISPATCH_TABLE, **limits):
+        """s 在执行过程中原地增长，可以在多个虚拟机之间共享"""
+        vm = VM(bytecode, dispatch, **limits)
         vm.global_variables = s
         return vm
 
@@ -50,24 +86,83 @@ class VM:
         return self.frames[self.frame_index - 1]
 
     def push_frame(self, f: frame.Frame):
+        if self.frame_index >= len(self.frames):
+            if self.frame_index >= self.max_frames:
+                return f"Frame Overflow: max_frames={self.max_frames}"
+            grow(self.frames, self.frame_index + 1, self.max_frames)
         self.frames[self.frame_index] = f
         self.frame_index += 1
+        return None
+
+    def ensure_stack(self, size: int):
+        """保证栈至少有 size 个槽位"""
+        if size <= len(self.stack):
+            return None
+        if size > self.max_stack:
+            return "Stack Overflow"
+        grow(self.stack, size, self.max_stack)
+        return None
+
+    def ensure_globals(self, size: int):
+        """保证全局变量列表至少有 size 个槽位"""
+        if size <= len(self.global_variables):
+            return None
+        if size > self.max_globals:
+            return f"too many globals: max_globals={self.max_globals}"
+        grow(self.global_variables, size, self.max_globals)
+        return None
+
+    def set_global(self, index: int, obj: object.Object):
+        if index >= len(self.global_variables):
+            err = self.ensure_globals(index + 1)
+            if err is not None:
+                return err
+        self.global_variables[index] = obj
+        return None
+
+    def push_global(self, index: int):
+        """
+        读取全局变量并压栈。共享的全局变量列表可能还没有增长到 index，
+        例如 REPL 中上一行定义了变量但在赋值之前就出错了，此时与同样未赋值的槽位一样读到 None
+        """
+        if index >= len(self.global_variables):
+            err = self.ensure_globals(index + 1)
+            if err is not None:
+                return err
+        return self.push(self.global_variables[index])
 
     def pop_frame(self):
         self.frame_index -= 1
         return self.frames[self.frame_index]
 
     def run(self):
-        while self.current_frame().ip < len(self.current_frame().instructions()) - 1:
-            self.current_frame().ip += 1
-            ip = self.current_frame().ip
-            ins = self.current_frame().instructions()
-            op = code.Opcode(ins[ip])
-            definition, ok = code.lookup(op)
+        if self.dispatch == DISPATCH_SWITCH:
+            return self.run_switch()
+        return self.run_table()
+
+    def run_table(self):
+        table = dispatch_table
+        frm = self.current_frame()
+        while frm.ip < len(frm.decoded) - 1:
+            frm.ip += 1
+            op, operand, extra = frm.decoded[frm.ip]
+            handler = table[op] if op < len(table) else None
+            if handler is None:
+                return f"unknown operator: {op}"
+            err = handler(self, frm, operand, extra)
+            if err is not None:
+                return err
+            # 调用和返回会切换栈帧
+            frm = self.frames[self.frame_index - 1]
+        return None
+
+    def run_switch(self):
+        frm = self.current_frame()
+        while frm.ip < len(frm.decoded) - 1:
+            frm.ip += 1
+            op, operand, extra = frm.decoded[frm.ip]
             if op == code.OpConstant:
-                const_index = code.read_uint16(ins[ip + 1:])
-                self.current_frame().ip += 2
-                err = self.push(self.constants[const_index])
+                err = self.push(self.constants[operand])
                 if err is not None:
                     return err
             elif op in [code.OpAdd, code.OpSub, code.OpMul, code.OpDiv]:
@@ -97,43 +192,35 @@ class VM:
                 if err is not None:
                     return err
             elif op == code.OpJump:
-                pos = code.read_uint16(ins[ip + 1:])
-                self.current_frame().ip = pos - 1
+                # 预解码后的跳转目标已经是指令下标
+                frm.ip = operand - 1
             elif op == code.OpJumpNotTruthy:
-                pos = code.read_uint16(ins[ip + 1:])
-                self.current_frame().ip += 2
                 condition = self.pop()
                 if not is_truthy(condition):
-                    self.current_frame().ip = pos - 1
+                    frm.ip = operand - 1
             elif op == code.OpNull:
                 err = self.push(NULL)
                 if err is not None:
                     return err
             elif op == code.OpSetGlobal:
-                global_index = code.read_uint16(ins[ip + 1:])
-                self.current_frame().ip += 2
-                self.global_variables[global_index] = self.pop()
+                err = self.set_global(operand, self.pop())
+                if err is not None:
+                    return err
             elif op == code.OpGetGlobal:
-                global_index = code.read_uint16(ins[ip + 1:])
-                self.current_frame().ip += 2
-                err = self.push(self.global_variables[global_index])
+                err = self.push_global(operand)
                 if err is not None:
                     return err
             elif op == code.OpArray:
-                num_elements = int(code.read_uint16(ins[ip + 1:]))
-                self.current_frame().ip += 2
-                array = self.build_array(self.sp - num_elements, self.sp)
-                self.sp = self.sp - num_elements
+                array = self.build_array(self.sp - operand, self.sp)
+                self.sp = self.sp - operand
                 err = self.push(array)
                 if err is not None:
                     return err
             elif op == code.OpHash:
-                num_elements = int(code.read_uint16(ins[ip + 1:]))
-                self.current_frame().ip += 2
-                hash_obj, err = self.build_hash(self.sp - num_elements, self.sp)
+                hash_obj, err = self.build_hash(self.sp - operand, self.sp)
                 if err is not None:
                     return err
-                self.sp = self.sp - num_elements
+                self.sp = self.sp - operand
                 err = self.push(hash_obj)
                 if err is not None:
                     return err
@@ -151,68 +238,283 @@ class VM:
                 空缺的上方是函数的工作区，
                 它会将函数执行时需要的值压栈和弹栈。
                 """
-                num_args = code.read_uint8(ins[ip+1:])
-                _ = code.read_uint8(ins[ip+3:])
-                self.current_frame().ip += 1
-                err = self.execute_call(num_args)
+                err = self.execute_call(operand)
                 if err is not None:
                     return err
-            elif op == code.OpSetLocal:
-                local_index = code.read_uint8(ins[ip+1:])
-                self.current_frame().ip += 1
                 frm = self.current_frame()
-                self.stack[frm.base_pointer + int(local_index)] = self.pop()
-            elif op == code.OpGetLocal:
-                local_index = code.read_uint8(ins[ip + 1:])
-                self.current_frame().ip += 1
+            elif op == code.OpTailCall:
+                err = self.execute_tail_call(frm, operand)
+                if err is not None:
+                    return err
                 frm = self.current_frame()
-                err = self.push(self.stack[frm.base_pointer + int(local_index)])
+            elif op == code.OpSetLocal:
+                self.stack[frm.base_pointer + operand] = self.pop()
+            elif op == code.OpGetLocal:
+                err = self.push(self.stack[frm.base_pointer + operand])
                 if err is not None:
                     return err
             elif op == code.OpReturnValue:
                 return_value = self.pop()
                 frm = self.pop_frame()
                 self.sp = frm.base_pointer - 1
+                frm = self.current_frame()
                 err = self.push(return_value)
                 if err is not None:
                     return err
             elif op == code.OpReturn:
                 frm = self.pop_frame()
                 self.sp = frm.base_pointer - 1
+                frm = self.current_frame()
                 err = self.push(object.NULL)
                 if err is not None:
                     return err
             elif op == code.OpGetBuiltin:
-                builtin_index = code.read_uint8(ins[ip+1: ])
-                self.current_frame().ip += 1
-                definition = builtins.builtins[builtin_index]
-                err = self.push(definition[1])
+                err = self.push(extra)
                 if err is not None:
                     return err
             elif op == code.OpClosure:
-                const_index = code.read_uint16(ins[ip+1: ])
-                num_frees = code.read_uint8(ins[ip+3:])
-                self.current_frame().ip += 3
-                err = self.push_closure(const_index, num_frees)
+                err = self.push_closure(operand, extra)
                 if err is not None:
                     return err
             elif op == code.OpGetFree:
-                free_index = code.read_uint8(ins[ip+1:])
-                self.current_frame().ip += 1
-                current_closure = self.current_frame().cl
-                err = self.push(current_closure.free[free_index])
+                err = self.push(frm.cl.free[operand])
                 if err is not None:
                     return err
             elif op == code.OpCurrentClosure:
-                current_closure = self.current_frame().cl
-                err = self.push(current_closure)
+                err = self.push(frm.cl)
+                if err is not None:
+                    return err
+            elif op == code.OpGetLocalConstantAdd:
+                err = self.op_get_local_constant_add(frm, operand, extra)
+                if err is not None:
+                    return err
+            elif op == code.OpConstantGreaterThanJumpNotTruthy:
+                err = self.op_constant_greater_than_jump_not_truthy(frm, operand, extra)
+                if err is not None:
+                    return err
+            elif op == code.OpGetGlobalCall:
+                err = self.op_get_global_call(frm, operand, extra)
+                if err is not None:
+                    return err
+                frm = self.current_frame()
+            elif op == code.OpConstantCall:
+                err = self.op_constant_call(frm, operand, extra)
+                if err is not None:
+                    return err
+                frm = self.current_frame()
+            elif op == code.OpGetLocalGetLocal:
+                err = self.op_get_local_get_local(frm, operand, extra)
+                if err is not None:
+                    return err
+            elif op == code.OpMakeCell:
+                self.stack[frm.base_pointer + operand] = object.Cell(self.pop())
+            elif op == code.OpGetCell:
+                err = self.push(self.stack[frm.base_pointer + operand].value)
+                if err is not None:
+                    return err
+            elif op == code.OpSetCell:
+                self.stack[frm.base_pointer + operand].value = self.pop()
+            elif op == code.OpGetFreeCell:
+                err = self.push(frm.cl.free[operand].value)
+                if err is not None:
+                    return err
+            elif op == code.OpSetFree:
+                frm.cl.free[operand].value = self.pop()
+            elif op == code.OpForLength:
+                err = self.op_for_length(frm, operand, extra)
                 if err is not None:
                     return err
             else:
-                return f"unknown operator: {definition.name}"
+                return f"unknown operator: {op}"
+
+        return None
+
+    # 以下为查表分派使用的指令处理函数，签名统一为 (frame, operand, extra)
+
+    def op_constant(self, frm: frame.Frame, operand: int, extra: int):
+        return self.push(self.constants[operand])
+
+    def op_add(self, frm: frame.Frame, operand: int, extra: int):
+        return self.execute_binary_operation(code.OpAdd)
+
+    def op_sub(self, frm: frame.Frame, operand: int, extra: int):
+        return self.execute_binary_operation(code.OpSub)
+
+    def op_mul(self, frm: frame.Frame, operand: int, extra: int):
+        return self.execute_binary_operation(code.OpMul)
+
+    def op_div(self, frm: frame.Frame, operand: int, extra: int):
+        return self.execute_binary_operation(code.OpDiv)
+
+    def op_pop(self, frm: frame.Frame, operand: int, extra: int):
+        self.pop()
+
+    def op_true(self, frm: frame.Frame, operand: int, extra: int):
+        return self.push(TRUE)
+
+    def op_false(self, frm: frame.Frame, operand: int, extra: int):
+        return self.push(FALSE)
+
+    def op_equal(self, frm: frame.Frame, operand: int, extra: int):
+        return self.execute_comparison(code.OpEqual)
+
+    def op_not_equal(self, frm: frame.Frame, operand: int, extra: int):
+        return self.execute_comparison(code.OpNotEqual)
+
+    def op_greater_than(self, frm: frame.Frame, operand: int, extra: int):
+        return self.execute_comparison(code.OpGreaterThan)
+
+    def op_minus(self, frm: frame.Frame, operand: int, extra: int):
+        return self.execute_minus_operator()
+
+    def op_bang(self, frm: frame.Frame, operand: int, extra: int):
+        return self.execute_bang_operator()
+
+    def op_jump(self, frm: frame.Frame, operand: int, extra: int):
+        frm.ip = operand - 1
+
+    def op_jump_not_truthy(self, frm: frame.Frame, operand: int, extra: int):
+        condition = self.pop()
+        if not is_truthy(condition):
+            frm.ip = operand - 1
+
+    def op_null(self, frm: frame.Frame, operand: int, extra: int):
+        return self.push(NULL)
+
+    def op_get_global(self, frm: frame.Frame, operand: int, extra: int):
+        return self.push_global(operand)
 
+    def op_set_global(self, frm: frame.Frame, operand: int, extra: int):
+        return self.set_global(operand, self.pop())
+
+    def op_array(self, frm: frame.Frame, operand: int, extra: int):
+        array = self.build_array(self.sp - operand, self.sp)
+        self.sp = self.sp - operand
+        return self.push(array)
+
+    def op_hash(self, frm: frame.Frame, operand: int, extra: int):
+        hash_obj, err = self.build_hash(self.sp - operand, self.sp)
+        if err is not None:
+            return err
+        self.sp = self.sp - operand
+        return self.push(hash_obj)
+
+    def op_index(self, frm: frame.Frame, operand: int, extra: int):
+        index = self.pop()
+        left = self.pop()
+        return self.execute_index_expression(left, index)
+
+    def op_call(self, frm: frame.Frame, operand: int, extra: int):
+        return self.execute_call(operand)
+
+    def op_tail_call(self, frm: frame.Frame, operand: int, extra: int):
+        return self.execute_tail_call(frm, operand)
+
+    def op_return_value(self, frm: frame.Frame, operand: int, extra: int):
+        return_value = self.pop()
+        frm = self.pop_frame()
+        self.sp = frm.base_pointer - 1
+        return self.push(return_value)
+
+    def op_return(self, frm: frame.Frame, operand: int, extra: int):
+        frm = self.pop_frame()
+        self.sp = frm.base_pointer - 1
+        return self.push(object.NULL)
+
+    def op_get_local(self, frm: frame.Frame, operand: int, extra: int):
+        return self.push(self.stack[frm.base_pointer + operand])
+
+    def op_set_local(self, frm: frame.Frame, operand: int, extra: int):
+        self.stack[frm.base_pointer + operand] = self.pop()
+
+    def op_get_builtin(self, frm: frame.Frame, operand: int, extra: int):
+        # extra 是加载时解析出的内置函数对象，见 resolve_builtins
+        return self.push(extra)
+
+    def op_closure(self, frm: frame.Frame, operand: int, extra: int):
+        return self.push_closure(operand, extra)
+
+    def op_get_free(self, frm: frame.Frame, operand: int, extra: int):
+        return self.push(frm.cl.free[operand])
+
+    def op_current_closure(self, frm: frame.Frame, operand: int, extra: int):
+        return self.push(frm.cl)
+
+    def op_get_local_constant_add(self, frm: frame.Frame, operand: int, extra: int):
+        """OpGetLocal; OpConstant; OpAdd"""
+        left = self.stack[frm.base_pointer + operand]
+        right = self.constants[extra]
+        if isinstance(left, object.Integer) and isinstance(right, object.Integer):
+            return self.push(object.new_integer(left.value + right.value))
+        err = self.push(left)
+        if err is not None:
+            return err
+        err = self.push(right)
+        if err is not None:
+            return err
+        return self.execute_binary_operation(code.OpAdd)
+
+    def op_constant_greater_than_jump_not_truthy(self, frm: frame.Frame, operand: int, extra: int):
+        """OpConstant; OpGreaterThan; OpJumpNotTruthy"""
+        left = self.stack[self.sp - 1]
+        right = self.constants[operand]
+        if isinstance(left, object.Integer) and isinstance(right, object.Integer):
+            self.sp -= 1
+            if not left.value > right.value:
+                frm.ip = extra - 1
+            return None
+        err = self.push(right)
+        if err is not None:
+            return err
+        err = self.execute_comparison(code.OpGreaterThan)
+        if err is not None:
+            return err
+        if not is_truthy(self.pop()):
+            frm.ip = extra - 1
         return None
 
+    def op_get_global_call(self, frm: frame.Frame, operand: int, extra: int):
+        """OpGetGlobal; OpCall"""
+        err = self.push_global(operand)
+        if err is not None:
+            return err
+        return self.execute_call(extra)
+
+    def op_constant_call(self, frm: frame.Frame, operand: int, extra: int):
+        """OpConstant; OpCall"""
+        err = self.push(self.constants[operand])
+        if err is not None:
+            return err
+        return self.execute_call(extra)
+
+    def op_get_local_get_local(self, frm: frame.Frame, operand: int, extra: int):
+        """OpGetLocal; OpGetLocal"""
+        err = self.push(self.stack[frm.base_pointer + operand])
+        if err is not None:
+            return err
+        return self.push(self.stack[frm.base_pointer + extra])
+
+    def op_make_cell(self, frm: frame.Frame, operand: int, extra: int):
+        self.stack[frm.base_pointer + operand] = object.Cell(self.pop())
+
+    def op_get_cell(self, frm: frame.Frame, operand: int, extra: int):
+        return self.push(self.stack[frm.base_pointer + operand].value)
+
+    def op_set_cell(self, frm: frame.Frame, operand: int, extra: int):
+        self.stack[frm.base_pointer + operand].value = self.pop()
+
+    def op_get_free_cell(self, frm: frame.Frame, operand: int, extra: int):
+        return self.push(frm.cl.free[operand].value)
+
+    def op_set_free(self, frm: frame.Frame, operand: int, extra: int):
+        frm.cl.free[operand].value = self.pop()
+
+    def op_for_length(self, frm: frame.Frame, operand: int, extra: int):
+        iterable = self.pop()
+        if not isinstance(iterable, object.Array):
+            return f"for-in not supported: {iterable.type()}"
+        return self.push(object.new_integer(iterable.length()))
+
     def push_closure(self, const_index: int, num_free: int):
         constant = self.constants[const_index]
         if not isinstance(constant, object.CompiledFunction):
@@ -236,16 +538,52 @@ class VM:
     def call_closure(self, cl: object.Closure, num_args: int):
         if num_args != cl.fn.num_parameters:
             return f"wrong number of arguments: want={cl.fn.num_parameters}, got={num_args}"
+        if cl.fn.decoded is None:
+            decode_function(cl.fn)
         frm = frame.Frame(cl=cl, base_pointer=self.sp - num_args)
-        self.push_frame(frm)
         # 栈中的空缺处就是要存储局部绑定的地方。
         # 执行函数之前栈指针的值，这是空缺的下边界
+        err = self.ensure_stack(frm.base_pointer + cl.fn.num_locals)
+        if err is not None:
+            return err
+        err = self.push_frame(frm)
+        if err is not None:
+            return err
         self.sp = frm.base_pointer + cl.fn.num_locals
         return None
 
+    def execute_tail_call(self, frm: frame.Frame, num_args: int):
+        """
+        尾调用闭包时不压入新栈帧：把被调函数和参数移到当前栈帧的位置，
+        原地改写当前栈帧，递归深度不再受 MAX_FRAMES 限制。
+        """
+        fn = self.stack[self.sp - 1 - num_args]
+        if not isinstance(fn, object.Closure):
+            return self.execute_call(num_args)
+        if num_args != fn.fn.num_parameters:
+            return f"wrong number of arguments: want={fn.fn.num_parameters}, got={num_args}"
+        base_pointer = frm.base_pointer
+        err = self.ensure_stack(base_pointer + fn.fn.num_locals)
+        if err is not None:
+            return err
+        self.stack[base_pointer - 1: base_pointer + num_args] = self.stack[self.sp - 1 - num_args: self.sp]
+        if fn.fn.decoded is None:
+            decode_function(fn.fn)
+        frm.cl = fn
+        frm.decoded = fn.fn.decoded
+        frm.ip = -1
+        self.sp = base_pointer + fn.fn.num_locals
+        return None
+
     def call_builtin(self, builtin: object.Builtin, num_args: int):
         args = self.stack[self.sp - num_args: self.sp]
-        result = builtin.fn(*args)
+        if builtin.higher_order:
+            # 回调在参数上方的栈空间中执行，返回后再弹出参数
+            result, err = builtin.fn(self.call, *args)
+            if err is not None:
+                return err
+        else:
+            result = builtin.fn(*args)
         self.sp = self.sp - num_args - 1
         if result is not None:
             self.push(result)
@@ -253,8 +591,50 @@ class VM:
             self.push(object.NULL)
         return None
 
+    def call(self, fn: object.Object, args: List[object.Object]):
+        """
+        在当前栈上执行 fn(*args) 直到返回，返回 (结果, 错误信息)。
+        可以重入：高阶内置函数在指令执行过程中用它回调 Monkey 函数，
+        宿主程序也可以在 run 之后用它调用全局变量中的闭包。
+        被调闭包的下面先压入一个没有指令的屏障栈帧，闭包返回到屏障栈帧时 run 随即结束；
+        出错时栈和栈帧恢复到调用前的状态。
+        """
+        if isinstance(fn, object.Builtin):
+            if fn.higher_order:
+                return fn.fn(self.call, *args)
+            result = fn.fn(*args)
+            return (result if result is not None else NULL), None
+        if not isinstance(fn, object.Closure):
+            return None, "calling non-function and non-built-in"
+        if self.nested_calls >= self.max_nested_calls:
+            return None, f"too many nested calls: max_nested_calls={self.max_nested_calls}"
+        sp, frame_index = self.sp, self.frame_index
+        err = self.push_frame(frame.Frame(cl=BARRIER, base_pointer=self.sp))
+        if err is None:
+            err = self.push(fn)
+        for arg in args:
+            if err is None:
+                err = self.push(arg)
+        if err is None:
+            err = self.call_closure(fn, len(args))
+        if err is None:
+            limit = reserve_python_frames(self.recursion_limit, self.nested_calls + 1)
+            self.nested_calls += 1
+            try:
+                err = self.run()
+            finally:
+                self.nested_calls -= 1
+                sys.setrecursionlimit(limit)
+        if err is not None:
+            # 恢复调用前的状态，虚拟机可以继续使用
+            self.sp, self.frame_index = sp, frame_index
+            return None, err
+        result = self.pop()
+        self.pop_frame()
+        return result, None
+
     def build_array(self, start_idx, end_idx):
-        return object.Array(self.stack[start_idx: end_idx])
+        return object.new_array(self.stack[start_idx: end_idx])
 
     def execute_index_expression(self, left: object.Object, index: object.Object):
         if left.type() == object.ARRAY_OBJ and index.type() == object.INTEGER_OBJ:
@@ -264,18 +644,17 @@ class VM:
         return f"index operator not supported: {left.type()}"
 
     def execute_array_index(self, array: object.Array, index: object.Integer):
-        pos = index.value
-        size = len(array.elements)
-        if pos < 0 or pos >= size:
+        element = array.get(index.value)
+        if element is None:
             return self.push(NULL)
-        return self.push(array.elements[pos])
+        return self.push(element)
 
     def execute_hash_index(self, hash_pairs: object.Hash, index: object.Hashable):
         if not isinstance(index, object.Hashable):
             return f"unhashable key {index.type()}"
-        if index.hash_key() not in hash_pairs.pairs:
+        pair = hash_pairs.pairs.get(index.hash_key(), None)
+        if pair is None:
             return self.push(NULL)
-        pair = hash_pairs.pairs[index.hash_key()]
         return self.push(pair.value)
 
     def build_hash(self, start_idx, end_idx):
@@ -318,7 +697,7 @@ class VM:
             result = left_value * right_val
         else:
             result = left_value / right_val
-        return self.push(object.Integer(result))
+        return self.push(object.new_integer(result))
 
     def execute_comparison(self, op: code.Opcode):
         right = self.pop()
@@ -360,11 +739,13 @@ class VM:
         if operand.type() != object.INTEGER_OBJ:
             return f"unsupported type for negation: {operand.type()}"
         value = operand.value
-        return self.push(object.Integer(-value))
+        return self.push(object.new_integer(-value))
 
     def push(self, obj: object.Object):
-        if self.sp >= STACK_SIZE:
-            return f"Stack Overflow"
+        if self.sp >= len(self.stack):
+            err = self.ensure_stack(self.sp + 1)
+            if err is not None:
+                return err
         self.stack[self.sp] = obj
         self.sp += 1
         return None
@@ -378,6 +759,92 @@ class VM:
         return self.stack[self.sp]
 
 
+def decode_function(fn: object.CompiledFunction):
+    """
+    预解码函数的指令，结果缓存在函数对象上。主函数在加载时解码，其余函数在第一次被调用时才解码，
+    加载后没有调用的函数不会解码，从 mmap 加载的指令也只有被执行的部分才会读入内存。
+    """
+    fn.decoded = resolve_builtins(code.decode(fn.instructions))
+
+
+def reserve_python_frames(base: int, nested_calls: int) -> int:
+    """
+    嵌套的 call 每层都会占用若干 Python 栈帧。在 base 之上为每层预留 NESTED_CALL_FRAMES 个栈帧，
+    Python 的递归上限不够时提高它，嵌套层数只受 max_nested_calls 限制。
+    返回原来的上限，调用方在嵌套的 run 结束后用 sys.setrecursionlimit 恢复，提高只在这次调用期间有效
+    """
+    limit = sys.getrecursionlimit()
+    needed = base + nested_calls * NESTED_CALL_FRAMES
+    if limit < needed:
+        sys.setrecursionlimit(needed)
+    return limit
+
+
+def resolve_builtins(decoded: List[code.DecodedInstruction]) -> List[code.DecodedInstruction]:
+    """加载时把 OpGetBuiltin 的内置函数对象放进指令的第二个操作数，执行时不再查表"""
+    for i, (op, operand, _) in enumerate(decoded):
+        if op == code.OpGetBuiltin and operand < len(builtins.builtins):
+            decoded[i] = (op, operand, builtins.builtins[operand][1])
+    return decoded
+
+
+def grow(items: List, size: int, limit: int):
+    """把 items 原地扩展到不小于 size 的容量：按两倍增长，不超过 limit"""
+    new_size = min(max(size, len(items) * 2), limit)
+    items.extend([None] * (new_size - len(items)))
+
+
+def build_dispatch_table():
+    """按操作码编号建立指令处理函数表，未定义的操作码对应 None"""
+    table = [None] * (max(code.definitions) + 1)
+    table[code.OpConstant] = VM.op_constant
+    table[code.OpAdd] = VM.op_add
+    table[code.OpPop] = VM.op_pop
+    table[code.OpSub] = VM.op_sub
+    table[code.OpMul] = VM.op_mul
+    table[code.OpDiv] = VM.op_div
+    table[code.OpTrue] = VM.op_true
+    table[code.OpFalse] = VM.op_false
+    table[code.OpEqual] = VM.op_equal
+    table[code.OpNotEqual] = VM.op_not_equal
+    table[code.OpGreaterThan] = VM.op_greater_than
+    table[code.OpMinus] = VM.op_minus
+    table[code.OpBang] = VM.op_bang
+    table[code.OpJump] = VM.op_jump
+    table[code.OpJumpNotTruthy] = VM.op_jump_not_truthy
+    table[code.OpNull] = VM.op_null
+    table[code.OpGetGlobal] = VM.op_get_global
+    table[code.OpSetGlobal] = VM.op_set_global
+    table[code.OpArray] = VM.op_array
+    table[code.OpHash] = VM.op_hash
+    table[code.OpIndex] = VM.op_index
+    table[code.OpCall] = VM.op_call
+    table[code.OpReturnValue] = VM.op_return_value
+    table[code.OpReturn] = VM.op_return
+    table[code.OpGetLocal] = VM.op_get_local
+    table[code.OpSetLocal] = VM.op_set_local
+    table[code.OpGetBuiltin] = VM.op_get_builtin
+    table[code.OpClosure] = VM.op_closure
+    table[code.OpGetFree] = VM.op_get_free
+    table[code.OpCurrentClosure] = VM.op_current_closure
+    table[code.OpGetLocalConstantAdd] = VM.op_get_local_constant_add
+    table[code.OpConstantGreaterThanJumpNotTruthy] = VM.op_constant_greater_than_jump_not_truthy
+    table[code.OpGetGlobalCall] = VM.op_get_global_call
+    table[code.OpGetLocalGetLocal] = VM.op_get_local_get_local
+    table[code.OpTailCall] = VM.op_tail_call
+    table[code.OpConstantCall] = VM.op_constant_call
+    table[code.OpMakeCell] = VM.op_make_cell
+    table[code.OpGetCell] = VM.op_get_cell
+    table[code.OpSetCell] = VM.op_set_cell
+    table[code.OpGetFreeCell] = VM.op_get_free_cell
+    table[code.OpSetFree] = VM.op_set_free
+    table[code.OpForLength] = VM.op_for_length
+    return table
+
+
+dispatch_table = build_dispatch_table()
+
+
 def native_bool_to_boolean_object(condition: bool):
     if condition:
         return TRUE
@@ -55,10 +55,36 @@ def test_read_operands():
     return True
 
 
+def test_decode():
+    ins = code.Instructions(b''.join([
+        code.make(code.OpTrue),
+        code.make(code.OpJumpNotTruthy, 10),
+        code.make(code.OpConstant, 0),
+        code.make(code.OpJump, 11),
+        code.make(code.OpNull),
+        code.make(code.OpClosure, 65535, 255),
+        code.make(code.OpGetLocal, 1),
+    ]))
+    expected = [
+        (code.OpTrue, 0, 0),
+        (code.OpJumpNotTruthy, 4, 0),
+        (code.OpConstant, 0, 0),
+        (code.OpJump, 5, 0),
+        (code.OpNull, 0, 0),
+        (code.OpClosure, 65535, 255),
+        (code.OpGetLocal, 1, 0),
+    ]
+    decoded = code.decode(ins)
+    assert len(decoded) == len(expected), f"decoded has wrong length. want={len(expected)}, got={len(decoded)}"
+    for i, exp in enumerate(expected):
+        assert decoded[i] == exp, f"wrong instruction at {i}. want={exp}, got={decoded[i]}"
+
+
 if __name__ == '__main__':
     tests = [
         test_make,
         test_read_operands,
         test_instructions_string,
+        test_decode,
     ]
     test_util.run_cases(tests)
\ No newline at end of file
@@ -49,6 +49,11 @@ def test_constants(expected: List, actual: List[object.Object]):
             err = test_instructions(constant, actual[i].instructions)
             if err is not None:
                 return f"constant {i}: test_instructions failed: {err}"
+        elif c_type == object.Closure:
+            if not isinstance(actual_obj, object.Closure) or actual_obj.free:
+                return f"constant {i} not a closure without free variables: {actual_obj}"
+            if not any(c is actual_obj.fn for c in actual):
+                return f"constant {i}: closure function not in constants"
         elif c_type == list:
             ins = concat_instructions(constant)
             err = test_instructions(ins, actual[i].instructions)
@@ -57,10 +62,10 @@ def test_constants(expected: List, actual: List[object.Object]):
     return None
 
 
-def run_compiler_tests(cases: List[Tuple]):
+def run_compiler_tests(cases: List[Tuple], optimize: bool = False):
     for text, expected_constants, expected_instructions in cases:
         program = parser.parse(text)
-        compiler = Compiler()
+        compiler = Compiler(optimize)
         err = compiler.compile(program)
         if err is not None:
             return False, f"compile error: {err}"
@@ -74,6 +79,12 @@ def run_compiler_tests(cases: List[Tuple]):
     return None
 
 
+def check_compiler_results(cases: List[Tuple], optimize: bool = False):
+    """与 run_compiler_tests 相同，但不符时抛出 AssertionError，在 pytest 中同样会失败"""
+    err = run_compiler_tests(cases, optimize)
+    assert err is None, err[1]
+
+
 def test_integer_arithmetic():
     cases = [
         ("1+2", (1, 2), [code.make(code.OpConstant, 0),
@@ -304,24 +315,24 @@ def test_hash_literals():
 
 def test_index_expressions():
     cases = [
-        ("[1,2,3][1 + 1]", (1, 2, 3, 1, 1),
+        ("[1,2,3][1 + 1]", (1, 2, 3),
          (
              code.make(code.OpConstant, 0),
              code.make(code.OpConstant, 1),
              code.make(code.OpConstant, 2),
              code.make(code.OpArray, 3),
-             code.make(code.OpConstant, 3),
-             code.make(code.OpConstant, 4),
+             code.make(code.OpConstant, 0),
+             code.make(code.OpConstant, 0),
              code.make(code.OpAdd),
              code.make(code.OpIndex),
              code.make(code.OpPop),
          )
          ),
-        ("{1:2}[2-1]", (1, 2, 2, 1), (code.make(code.OpConstant, 0),
-                                      code.make(code.OpConstant, 1),
-                                      code.make(code.OpHash, 2),
-                                      code.make(code.OpConstant, 2),
-                                      code.make(code.OpConstant, 3),
+        ("{1:2}[2-1]", (1, 2), (code.make(code.OpConstant, 0),
+                                code.make(code.OpConstant, 1),
+                                code.make(code.OpHash, 2),
+                                code.make(code.OpConstant, 1),
+                                code.make(code.OpConstant, 0),
                                       code.make(code.OpSub),
                                       code.make(code.OpIndex),
                                       code.make(code.OpPop),
@@ -536,7 +547,7 @@ def test_builtins():
          (code.Instructions(b''.join([
              code.make(code.OpGetBuiltin, 0),
              code.make(code.OpArray, 0),
-             code.make(code.OpCall, 1),
+             code.make(code.OpTailCall, 1),
              code.make(code.OpReturnValue),
          ])),
          ),
@@ -671,13 +682,13 @@ def test_recursive_functions():
                     code.make(code.OpGetLocal, 0),
                     code.make(code.OpConstant, 0),
                     code.make(code.OpSub),
-                    code.make(code.OpCall, 1),
+                    code.make(code.OpTailCall, 1),
                     code.make(code.OpReturnValue),]
-              ,1],
+              ],
          [code.make(code.OpClosure, 1, 0),
                 code.make(code.OpSetGlobal, 0),
                 code.make(code.OpGetGlobal, 0),
-                code.make(code.OpConstant, 2),
+                code.make(code.OpConstant, 0),
                 code.make(code.OpCall, 1),
                 code.make(code.OpPop),
           ]
@@ -693,17 +704,17 @@ def test_recursive_functions():
             code.make(code.OpGetLocal, 0),
             code.make(code.OpConstant, 0),
             code.make(code.OpSub),
-            code.make(code.OpCall, 1),
+            code.make(code.OpTailCall, 1),
             code.make(code.OpReturnValue),
         ]
-              ,1, [code.make(code.OpClosure, 1, 0),
+              , [code.make(code.OpClosure, 1, 0),
                     code.make(code.OpSetLocal, 0),
                     code.make(code.OpGetLocal, 0),
-                    code.make(code.OpConstant, 2),
-                    code.make(code.OpCall, 1),
+                    code.make(code.OpConstant, 0),
+                    code.make(code.OpTailCall, 1),
                     code.make(code.OpReturnValue),]],
          [
-             code.make(code.OpClosure, 3, 0),
+             code.make(code.OpClosure, 2, 0),
              code.make(code.OpSetGlobal, 0),
              code.make(code.OpGetGlobal, 0),
              code.make(code.OpCall, 0),
@@ -717,6 +728,244 @@ def test_recursive_functions():
     return True
 
 
+def test_tail_calls():
+    cases = [
+        ("fn(g) { return g(); }", ([code.make(code.OpGetLocal, 0),
+                                    code.make(code.OpTailCall, 0),
+                                    code.make(code.OpReturnValue)],),
+         (code.make(code.OpClosure, 0, 0),
+          code.make(code.OpPop))),
+        ("fn(x) { if (x) { x(1) } else { 1 } }", (1, [code.make(code.OpGetLocal, 0),
+                                                      code.make(code.OpJumpNotTruthy, 15),
+                                                      code.make(code.OpGetLocal, 0),
+                                                      code.make(code.OpConstant, 0),
+                                                      code.make(code.OpTailCall, 1),
+                                                      code.make(code.OpJump, 18),
+                                                      code.make(code.OpConstant, 0),
+                                                      code.make(code.OpReturnValue)]),
+         (code.make(code.OpClosure, 1, 0),
+          code.make(code.OpPop))),
+        ("fn(g) { g(1) + 1 }", (1, [code.make(code.OpGetLocal, 0),
+                                    code.make(code.OpConstant, 0),
+                                    code.make(code.OpCall, 1),
+                                    code.make(code.OpConstant, 0),
+                                    code.make(code.OpAdd),
+                                    code.make(code.OpReturnValue)]),
+         (code.make(code.OpClosure, 1, 0),
+          code.make(code.OpPop))),
+        ("fn(g) { g(); 1 }", (1, [code.make(code.OpGetLocal, 0),
+                                  code.make(code.OpCall, 0),
+                                  code.make(code.OpPop),
+                                  code.make(code.OpConstant, 0),
+                                  code.make(code.OpReturnValue)]),
+         (code.make(code.OpClosure, 1, 0),
+          code.make(code.OpPop))),
+    ]
+    check_compiler_results(cases)
+
+
+def test_superinstructions():
+    cases = [
+        ("fn(a) { a + 1 }", (1, [code.make(code.OpGetLocalConstantAdd, 0, 0),
+                                 code.make(code.OpReturnValue)]),
+         (code.make(code.OpClosure, 1, 0),
+          code.make(code.OpPop))),
+        ("let f = fn(a, b) { a + b }; f;", ([code.make(code.OpGetLocalGetLocal, 0, 1),
+                                              code.make(code.OpAdd),
+                                              code.make(code.OpReturnValue)], object.Closure()),
+         (code.make(code.OpClosure, 0, 0),
+          code.make(code.OpSetGlobal, 0),
+          code.make(code.OpConstant, 1),
+          code.make(code.OpPop))),
+        ("let f = fn() { 1 }; f();", (1, [code.make(code.OpConstant, 0),
+                                          code.make(code.OpReturnValue)], object.Closure()),
+         (code.make(code.OpClosure, 1, 0),
+          code.make(code.OpSetGlobal, 0),
+          code.make(code.OpConstantCall, 2, 0),
+          code.make(code.OpPop))),
+        ("let f = fn() { 1 }; let g = f; g();", (1, [code.make(code.OpConstant, 0),
+                                                     code.make(code.OpReturnValue)], object.Closure()),
+         (code.make(code.OpClosure, 1, 0),
+          code.make(code.OpSetGlobal, 0),
+          code.make(code.OpConstant, 2),
+          code.make(code.OpSetGlobal, 1),
+          code.make(code.OpGetGlobalCall, 1, 0),
+          code.make(code.OpPop))),
+        ("let a = 1; if (a > 2) { 10 }; 3333;", (1, 2, 10, 3333), (
+            code.make(code.OpConstant, 0),
+            code.make(code.OpSetGlobal, 0),
+            code.make(code.OpConstant, 0),
+            code.make(code.OpConstantGreaterThanJumpNotTruthy, 1, 20),
+            code.make(code.OpConstant, 2),
+            code.make(code.OpJump, 21),
+            code.make(code.OpNull),
+            code.make(code.OpPop),
+            code.make(code.OpConstant, 3),
+            code.make(code.OpPop))),
+    ]
+    check_compiler_results(cases, optimize=True)
+
+
+def test_global_constants():
+    cases = [
+        # 只赋值一次的顶层全局变量直接引用常量
+        ("let one = 1; one;", (1,), (code.make(code.OpConstant, 0),
+                                     code.make(code.OpSetGlobal, 0),
+                                     code.make(code.OpConstant, 0),
+                                     code.make(code.OpPop))),
+        ('let s = "a"; let t = s + s; t;', ("a",), (code.make(code.OpConstant, 0),
+                                                     code.make(code.OpSetGlobal, 0),
+                                                     code.make(code.OpConstant, 0),
+                                                     code.make(code.OpConstant, 0),
+                                                     code.make(code.OpAdd),
+                                                     code.make(code.OpSetGlobal, 1),
+                                                     code.make(code.OpGetGlobal, 1),
+                                                     code.make(code.OpPop))),
+        # 代码块中的 let 不一定执行，不做替换
+        ("if (true) { let a = 1; }; a;", (1,), (code.make(code.OpTrue),
+                                                code.make(code.OpJumpNotTruthy, 13),
+                                                code.make(code.OpConstant, 0),
+                                                code.make(code.OpSetGlobal, 0),
+                                                code.make(code.OpJump, 14),
+                                                code.make(code.OpNull),
+                                                code.make(code.OpPop),
+                                                code.make(code.OpGetGlobal, 0),
+                                                code.make(code.OpPop))),
+        ("let f = fn() { len }; f;", ([code.make(code.OpGetBuiltin, 0),
+                                       code.make(code.OpReturnValue)], object.Closure()),
+         (code.make(code.OpClosure, 0, 0),
+          code.make(code.OpSetGlobal, 0),
+          code.make(code.OpConstant, 1),
+          code.make(code.OpPop))),
+    ]
+    check_compiler_results(cases, optimize=True)
+
+    # 逐段编译时后面的输入可能给变量赋值，全局变量不当作常量引用
+    compiler = Compiler.new_with_state(Compiler().symbol_table, [], optimize=True)
+    err = compiler.compile(parser.parse("let one = 1; one;"))
+    assert err is None, f"compiler error: {err}"
+    err = test_instructions([code.make(code.OpConstant, 0),
+                             code.make(code.OpSetGlobal, 0),
+                             code.make(code.OpGetGlobal, 0),
+                             code.make(code.OpPop)], compiler.bytecode().instructions)
+    assert err is None, err
+
+
+def test_constant_deduplication():
+    cases = [
+        ('1; 1; 2; 1', (1, 2), (code.make(code.OpConstant, 0),
+                                code.make(code.OpPop),
+                                code.make(code.OpConstant, 0),
+                                code.make(code.OpPop),
+                                code.make(code.OpConstant, 1),
+                                code.make(code.OpPop),
+                                code.make(code.OpConstant, 0),
+                                code.make(code.OpPop))),
+        ('"a" + "a"', ("a",), (code.make(code.OpConstant, 0),
+                               code.make(code.OpConstant, 0),
+                               code.make(code.OpAdd),
+                               code.make(code.OpPop))),
+        ('fn() { 1 }; fn() { 1 }', (1, [code.make(code.OpConstant, 0),
+                                        code.make(code.OpReturnValue)],
+                                    [code.make(code.OpConstant, 0),
+                                     code.make(code.OpReturnValue)]),
+         (code.make(code.OpClosure, 1, 0),
+          code.make(code.OpPop),
+          code.make(code.OpClosure, 2, 0),
+          code.make(code.OpPop))),
+    ]
+    check_compiler_results(cases)
+    compiler = Compiler()
+    compiler.compile(parser.parse("1; 1"))
+    assert compiler.constants[0] is object.new_integer(1), "small integer constant is not interned"
+
+
+def test_constant_folding():
+    cases = [
+        ("1 + 2 * 3", (7,), (code.make(code.OpConstant, 0),
+                             code.make(code.OpPop))),
+        ("-(5 - 10)", (5,), (code.make(code.OpConstant, 0),
+                             code.make(code.OpPop))),
+        ("4 / 2", (4, 2), (code.make(code.OpConstant, 0),
+                           code.make(code.OpConstant, 1),
+                           code.make(code.OpDiv),
+                           code.make(code.OpPop))),
+        ("(1 < 2) == !false", (), (code.make(code.OpTrue),
+                                   code.make(code.OpPop))),
+        ('"mon" + "key"', ("monkey",), (code.make(code.OpConstant, 0),
+                                        code.make(code.OpPop))),
+        ("let f = fn(a) { a + (2 * 3) }; f(1 + 1);", (6, [code.make(code.OpGetLocalConstantAdd, 0, 0),
+                                                           code.make(code.OpReturnValue)],
+                                                          object.Closure(), 2),
+         (code.make(code.OpClosure, 1, 0),
+          code.make(code.OpSetGlobal, 0),
+          code.make(code.OpConstant, 2),
+          code.make(code.OpConstantCall, 3, 1),
+          code.make(code.OpPop))),
+        ("if (1 > 2) { 10 } else { 20 }", (20,), (code.make(code.OpConstant, 0),
+                                                 code.make(code.OpPop))),
+        ("if (true) { 10 }", (10,), (code.make(code.OpConstant, 0),
+                                     code.make(code.OpPop))),
+        ("if (false) { 10 }; 3333;", (3333,), (
+            code.make(code.OpFalse),
+            code.make(code.OpJumpNotTruthy, 7),
+            code.make(code.OpJump, 8),
+            code.make(code.OpNull),
+            code.make(code.OpPop),
+            code.make(code.OpConstant, 0),
+            code.make(code.OpPop))),
+    ]
+    check_compiler_results(cases, optimize=True)
+
+
+def test_assignments():
+    cases = [
+        ("let x = 1; x = 2; x;", (1, 2), (code.make(code.OpConstant, 0),
+                                          code.make(code.OpSetGlobal, 0),
+                                          code.make(code.OpConstant, 1),
+                                          code.make(code.OpSetGlobal, 0),
+                                          code.make(code.OpGetGlobal, 0),
+                                          code.make(code.OpPop),
+                                          code.make(code.OpGetGlobal, 0),
+                                          code.make(code.OpPop))),
+        ("fn(a) { a = a + 1 }", (1, [code.make(code.OpGetLocal, 0),
+                                     code.make(code.OpConstant, 0),
+                                     code.make(code.OpAdd),
+                                     code.make(code.OpSetLocal, 0),
+                                     code.make(code.OpGetLocal, 0),
+                                     code.make(code.OpReturnValue)]),
+         (code.make(code.OpClosure, 1, 0),
+          code.make(code.OpPop))),
+        # 被闭包捕获且被赋值的参数在进入函数时装进 Cell，闭包拿到的是 Cell 本身
+        ("fn(a) { fn() { a = 2 }; a }", (2, [code.make(code.OpConstant, 0),
+                                             code.make(code.OpSetFree, 0),
+                                             code.make(code.OpGetFreeCell, 0),
+                                             code.make(code.OpReturnValue)],
+                                         [code.make(code.OpGetLocal, 0),
+                                          code.make(code.OpMakeCell, 0),
+                                          code.make(code.OpGetLocal, 0),
+                                          code.make(code.OpClosure, 1, 1),
+                                          code.make(code.OpPop),
+                                          code.make(code.OpGetCell, 0),
+                                          code.make(code.OpReturnValue)]),
+         (code.make(code.OpClosure, 2, 0),
+          code.make(code.OpPop))),
+    ]
+    check_compiler_results(cases)
+    # 被赋值的全局变量不当作常量引用
+    cases = [
+        ("let x = 1; x = 2; x;", (1, 2), (code.make(code.OpConstant, 0),
+                                          code.make(code.OpSetGlobal, 0),
+                                          code.make(code.OpConstant, 1),
+                                          code.make(code.OpSetGlobal, 0),
+                                          code.make(code.OpGetGlobal, 0),
+                                          code.make(code.OpPop),
+                                          code.make(code.OpGetGlobal, 0),
+                                          code.make(code.OpPop))),
+    ]
+    check_compiler_results(cases, optimize=True)
+
+
 if __name__ == '__main__':
     test_compiler_scopes()
     tests = [
@@ -733,7 +982,13 @@ if __name__ == '__main__':
         test_let_statement_scopes,
         test_builtins,
         test_closure,
-        test_recursive_functions
+        test_recursive_functions,
+        test_tail_calls,
+        test_superinstructions,
+        test_global_constants,
+        test_constant_deduplication,
+        test_constant_folding,
+        test_assignments,
     ]
     test_util.run_cases(tests)
 
@@ -0,0 +1,230 @@
+import sys
+
+from monkey_code import register_code
+from monkey_compiler.compiler import Compiler
+from monkey_compiler.register_compiler import RegisterCompiler
+from monkey_object import object
+from monkey_parser import parser
+from monkey_vm.register_vm import RegisterVM
+from monkey_vm.vm import VM
+from util import test_util
+
+
+def run_register_program(source: str):
+    comp = RegisterCompiler()
+    err = comp.compile(parser.parse(source))
+    if err is not None:
+        return None, f"compiler error: {err}"
+    machine = RegisterVM(comp.bytecode())
+    err = machine.run()
+    if err is not None:
+        return None, err
+    return machine.last_result(), None
+
+
+def test_expressions():
+    cases = [
+        ("1 + 2 * 3", "7"),
+        ("(5 + 10 * 2 + 15 - 3) * 2 + -10", "64"),
+        ("1 < 2 == true", "true"),
+        ("!(if (false) { 5; })", "true"),
+        ("if (1 > 2) { 10 }", "null"),
+        ("if ((if (false) { 10 })) { 10 } else { 20 }", "20"),
+        ('"mon" + "key" + "banana"', "monkeybanana"),
+        ("[1, 2 * 2, 3][1]", "4"),
+        ("[1, 2][5]", "null"),
+        ('{"one": 1, 2: 2 * 2}[2]', "4"),
+        ("let one = 1; let two = one + one; one + two", "3"),
+    ]
+    for source, expected in cases:
+        result, err = run_register_program(source)
+        assert err is None, f"{source}: {err}"
+        assert result.inspect() == expected, f"{source}: want={expected} got={result.inspect()}"
+
+
+def test_functions():
+    cases = [
+        ("let f = fn(a, b) { let c = a + b; c * 2 }; f(1, 2)", "6"),
+        ("let f = fn() { }; f()", "null"),
+        ("let f = fn(a) { if (a) { let z = 3; z } else { 4 } }; f(true) + f(false)", "7"),
+        ("let newAdder = fn(a) { fn(b) { a + b } }; let add = newAdder(3); add(4)", "7"),
+        ("fn(a) { let b = a; fn() { let c = b; fn() { a + b + c } } }(1)()()", "3"),
+        ("let fib = fn(x) { if (x < 2) { return x; } fib(x - 1) + fib(x - 2) }; fib(15)", "610"),
+        ("let w = fn() { let c = fn(x) { if (x == 0) { 0 } else { c(x - 1) } }; c(5) }; w()", "0"),
+        ("len([1, 2, 3]) + len(\"ab\")", "5"),
+        ("first(rest(push([1, 2], 3)))", "2"),
+        ("let k = 2; sum(map(filter(range(10), fn(x) { x > 6 }), fn(x) { x * k }))", "48"),
+        ("reduce(range(4), 0, fn(a, b) { a + sum(map(range(b), fn(x) { x })) })", "4"),
+        ("let f = fn(arr) { for (x in arr) { if (x > 2) { return x; } } }; f([1, 3, 5])", "3"),
+        ("let f = fn(a) { for x in a { for y in a { if (x * y > 10) { return [x, y]; } } } }; f([1, 3, 5])", "[3, 5]"),
+        ("for (x in [4, 5]) { x * 2 }; x", "5"),
+        ("let f = fn() { while (true) { return 7; } }; f()", "7"),
+        ("while (false) { 1 }", "null"),
+        ("let s = 0; for (x in [1, 2, 3]) { s = s + x }; s", "6"),
+        ("let f = fn(n) { let s = 0; let i = 0; while (i < n) { i = i + 1; s = s + i; } s }; f(100)", "5050"),
+        ("let g = 1; let f = fn() { g = g + 1 }; f(); f(); g", "3"),
+        ("let f = fn(a, b) { a = b; b = a + 1; [a, b] }; f(1, 5)", "[5, 6]"),
+        ("let f = fn(a) { a + (a = 5) }; f(1)", "6"),
+        # 被闭包捕获又被赋值的变量保存在 Cell 中
+        ("let counter = fn() { let c = 0; fn() { c = c + 1 } }; let c = counter(); c(); c(); c()", "3"),
+        ("let f = fn() { let c = 0; let inc = fn() { c = c + 1 }; inc(); inc(); c }; f()", "2"),
+        ("let f = fn(c) { let g = fn() { fn() { c = c * 2 } }; g()(); g()(); c }; f(3)", "12"),
+        ("let f = fn() { let c = 1; let g = fn() { c }; c = 5; g() }; f()", "5"),
+        ("let f = fn() { let out = []; for (x in [1, 2]) { out = push(out, fn() { x = x * 10 }); }; "
+         "[out[0](), out[0](), out[1]()] }; f()", "[10, 100, 20]"),
+        # 尾调用复用栈帧，递归深度超过 max_frames
+        ("let f = fn(n, acc) { if (n == 0) { acc } else { f(n - 1, acc + n) } }; f(5000, 0)", "12502500"),
+        ("let f = fn(n) { if (n == 0) { return 0; } return f(n - 1); }; f(5000)", "0"),
+        ("let f = fn(n, g) { if (n == 0) { g(n) } else { f(n - 1, g) } }; f(5000, fn(x) { x + 1 })", "1"),
+        ("let f = fn(n) { if (n == 0) { len([1, 2]) } else { f(n - 1) } }; f(3000)", "2"),
+        # 高阶内置函数回调的嵌套层数超过 Python 默认的递归上限所能容纳的深度
+        ("let f = fn(n) { if (n == 0) { 0 } else { sum(map([n], fn(x) { f(x - 1) })) } }; f(300)", "0"),
+    ]
+    for source, expected in cases:
+        result, err = run_register_program(source)
+        assert err is None, f"{source}: {err}"
+        assert result.inspect() == expected, f"{source}: want={expected} got={result.inspect()}"
+
+
+def test_loop_variable_capture():
+    """函数中的循环变量每次迭代都是新的绑定，与其他后端相同"""
+    cases = [
+        ("let g = fn() { let out = []; for (x in [1, 2, 3]) { out = push(out, fn() { x }); } out }; "
+         "let hs = g(); [hs[0](), hs[1](), hs[2]()]", "[1, 2, 3]"),
+        ("let g = fn() { let out = []; for (x in [1, 2]) { out = push(out, fn() { x = x * 10 }); }; out }; "
+         "let hs = g(); [hs[0](), hs[0](), hs[1]()]", "[10, 100, 20]"),
+        ("let g = fn() { let out = []; for (x in [1, 2]) { for (y in [3, 4]) { out = push(out, fn() { x * y }); } }; "
+         "map(out, fn(h) { h() }) }; g()", "[3, 4, 6, 8]"),
+        ("let g = fn(a) { let t = 0; for (x in a) { let t = x; x = x * 3; }; [t, x] }; g([1, 2])", "[2, 6]"),
+        # 顶层的循环变量是全局变量
+        ("let out = []; for (x in [1, 2]) { out = push(out, fn() { x }); }; [out[0](), out[1]()]", "[2, 2]"),
+    ]
+    for source, expected in cases:
+        result, err = run_register_program(source)
+        assert err is None, f"{source}: {err}"
+        assert result.inspect() == expected, f"{source}: want={expected} got={result.inspect()}"
+
+
+def test_errors():
+    cases = [
+        ("fn() { 1; }(1);", "wrong number of arguments: want=0, got=1"),
+        ("1 + true", "unsupported types for binary operation: INTEGER BOOLEAN"),
+        ("-true", "unsupported type for negation: BOOLEAN"),
+        ("1(2)", "calling non-function and non-built-in"),
+        ("x", "compiler error: undefined variable: x"),
+        ("let f = fn(x) { f(x) + 1 }; f(1)", "Frame Overflow: max_frames=1024"),
+        ("map([1], fn(x) { -true })", "unsupported type for negation: BOOLEAN"),
+        ("for (x in 5) { x }", "for-in not supported: INTEGER"),
+        ('let f = fn() { for (c in "ab") { c } }; f()', "for-in not supported: STRING"),
+    ]
+    for source, expected in cases:
+        _, err = run_register_program(source)
+        assert err == expected, f"{source}: want={expected} got={err}"
+
+
+def test_instructions():
+    comp = RegisterCompiler()
+    err = comp.compile(parser.parse("fn(a, b) { let c = a + b; c * 2 }"))
+    assert err is None, f"compiler error: {err}"
+    main_fn = comp.bytecode()
+    fn = [c for c in main_fn.registers if isinstance(c, object.RegisterFunction)][0]
+    # 寄存器 0、1 为参数，2 为局部变量 c，3 为临时值，4 为常量 2
+    expected = [
+        register_code.make(register_code.OpAdd, 2, 0, 1),
+        register_code.make(register_code.OpMul, 3, 2, 4),
+        register_code.make(register_code.OpReturn, 3),
+    ]
+    assert fn.instructions == expected, f"wrong instructions.\nwant=\n{register_code.to_string(expected)}" \
+                                        f"got=\n{register_code.to_string(fn.instructions)}"
+    assert fn.registers[:4] == [None] * 4 and fn.registers[4].value == 2, f"wrong register template: {fn.registers}"
+
+    comp = RegisterCompiler()
+    err = comp.compile(parser.parse("let g = fn(n) { if (n) { g(n) } else { n + g(n) } }"))
+    assert err is None, f"compiler error: {err}"
+    fn = [c for c in comp.bytecode().registers if isinstance(c, object.RegisterFunction)][0]
+    calls = [ins[0] for ins in fn.instructions if ins[0] in (register_code.OpCall, register_code.OpTailCall)]
+    assert calls == [register_code.OpTailCall, register_code.OpCall], \
+        f"wrong tail calls.\n{register_code.to_string(fn.instructions)}"
+
+
+def test_same_results_as_stack_vm():
+    source = """
+    let map = fn(arr, f) {
+        let iter = fn(arr, acc) {
+            if (len(arr) == 0) { acc } else { iter(rest(arr), push(acc, f(first(arr)))) }
+        };
+        iter(arr, []);
+    };
+    let total = fn(arr) { if (len(arr) == 0) { 0 } else { first(arr) + total(rest(arr)) } };
+    let h = {"a": map([1, 2, 3], fn(x) { x * x }), "b": "c"};
+    [total(h["a"]), h["b"], h["a"], !h["z"]];
+    """
+    result, err = run_register_program(source)
+    assert err is None, err
+    comp = Compiler()
+    comp.compile(parser.parse(source))
+    machine = VM(comp.bytecode())
+    err = machine.run()
+    assert err is None, err
+    expected = machine.last_popped_stack_elem()
+    assert result.inspect() == expected.inspect(), f"want={expected.inspect()} got={result.inspect()}"
+
+
+def test_call():
+    comp = RegisterCompiler()
+    comp.compile(parser.parse("let add = fn(a, b) { a + b }; let twice = fn(f, x) { f(f(x)) }; 7"))
+    machine = RegisterVM(comp.bytecode())
+    err = machine.run()
+    assert err is None, err
+    add, twice = machine.global_variables[:2]
+    result, err = machine.call(add, [object.Integer(2), object.Integer(3)])
+    assert err is None and result.inspect() == "5", f"wrong result of call: {result} {err}"
+    add_one = object.Builtin(fn=lambda call, x: call(add, [x, object.Integer(1)]), higher_order=True)
+    result, err = machine.call(twice, [add_one, object.Integer(1)])
+    assert err is None and result.inspect() == "3", f"wrong result of a higher-order builtin: {result} {err}"
+    _, err = machine.call(add, [object.Integer(1)])
+    assert err == "wrong number of arguments: want=2, got=1", f"wrong error: {err}"
+    assert machine.last_result().inspect() == "7", "call changed the program result"
+
+    # 嵌套调用期间提高的递归上限在返回后恢复
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(1000)
+    try:
+        result, err = run_register_program(
+            "let f = fn(n) { if (n == 0) { 0 } else { sum(map([n], fn(x) { f(x - 1) })) } }; f(300)")
+        assert err is None and result.inspect() == "0", f"wrong result of nested calls: {result} {err}"
+        assert sys.getrecursionlimit() == 1000, f"recursion limit not restored: {sys.getrecursionlimit()}"
+    finally:
+        sys.setrecursionlimit(limit)
+
+
+def test_shared_globals():
+    # 上一段程序定义了全局变量但在赋值前出错，共享列表没有增长到它的下标，读取时不能越界
+    comp = RegisterCompiler()
+    err = comp.compile(parser.parse("let f = 1 + true;"))
+    assert err is None, f"compiler error: {err}"
+    global_variables = []
+    err = RegisterVM(comp.bytecode(), global_variables).run()
+    assert err == "unsupported types for binary operation: INTEGER BOOLEAN", f"wrong VM error: {err}"
+    symbol_table = comp.symbol_table
+    comp = RegisterCompiler()
+    comp.symbol_table = symbol_table
+    err = comp.compile(parser.parse("f"))
+    assert err is None, f"compiler error: {err}"
+    machine = RegisterVM(comp.bytecode(), global_variables)
+    err = machine.run()
+    assert err is None and machine.last_result() is None, f"wrong result: {machine.last_result()} {err}"
+
+
+if __name__ == '__main__':
+    tests = [
+        test_expressions,
+        test_functions,
+        test_loop_variable_capture,
+        test_errors,
+        test_instructions,
+        test_same_results_as_stack_vm,
+        test_call,
+        test_shared_globals,
+    ]
+    test_util.run_cases(tests)
@@ -0,0 +1,150 @@
+import os
+import tempfile
+
+from monkey_code import code
+from monkey_compiler import serializer
+from monkey_compiler.compiler import Compiler
+from monkey_object import object
+from monkey_parser import parser
+from monkey_vm.vm import VM
+from util import test_util
+
+PROGRAM = """
+let big = 12345678901234567890;
+let greeting = "héllo";
+let newAdder = fn(a) { fn(b) { a + b - 1 } };
+let adder = newAdder(-5);
+if (adder(big) > 0) { greeting } else { "no" };
+"""
+
+
+def compile_program(source: str, optimize: bool = False):
+    comp = Compiler(optimize)
+    err = comp.compile(parser.parse(source))
+    if err is not None:
+        return None, err
+    return comp.bytecode(), None
+
+
+def test_round_trip():
+    bytecode, err = compile_program(PROGRAM)
+    assert err is None, f"compiler error: {err}"
+    data, err = serializer.dump(bytecode)
+    assert err is None, f"dump error: {err}"
+    loaded, err = serializer.load(data)
+    assert err is None, f"load error: {err}"
+    assert bytes(loaded.instructions) == bytes(bytecode.instructions), \
+        f"instructions differ. want={bytecode.instructions} got={loaded.instructions}"
+    assert len(loaded.constants) == len(bytecode.constants), \
+        f"wrong number of constants. want={len(bytecode.constants)} got={len(loaded.constants)}"
+    for want, got in zip(bytecode.constants, loaded.constants):
+        assert type(want) == type(got), f"constant type differs. want={type(want)} got={type(got)}"
+        if isinstance(want, object.CompiledFunction):
+            assert bytes(want.instructions) == bytes(got.instructions) and \
+                want.num_locals == got.num_locals and want.num_parameters == got.num_parameters, \
+                f"function differs. want={want} got={got}"
+        else:
+            assert want.value == got.value, f"constant differs. want={want.value} got={got.value}"
+    vm = VM(loaded)
+    err = vm.run()
+    assert err is None, f"vm error: {err}"
+    result = vm.last_popped_stack_elem()
+    assert isinstance(result, object.String) and result.value == "héllo", f"wrong result. got={result}"
+
+
+def test_load_errors():
+    bytecode, _ = compile_program("1 + 2")
+    data, _ = serializer.dump(bytecode)
+    cases = [
+        (b'XXXX' + data[4:], "not a monkey bytecode file"),
+        (data[:4] + b'\xff\xff' + data[6:], f"unsupported bytecode version: 65535, want={serializer.FORMAT_VERSION}"),
+        (data[:-1], None),
+    ]
+    for payload, expected in cases:
+        loaded, err = serializer.load(payload)
+        assert loaded is None and err is not None, f"expected load error for {payload}"
+        assert expected is None or err == expected, f"wrong error. want={expected} got={err}"
+
+
+def test_compile_cache():
+    with tempfile.TemporaryDirectory() as directory:
+        cache = serializer.CompileCache(directory)
+        assert cache.get(PROGRAM) is None, "empty cache returned bytecode"
+        bytecode, err = serializer.compile_source(PROGRAM, cache)
+        assert err is None, f"compile error: {err}"
+        files = os.listdir(directory)
+        assert len(files) == 1 and files[0].endswith(serializer.CACHE_SUFFIX), f"expected one cache file, got {files}"
+        cached = cache.get(PROGRAM)
+        assert cached is not None, "cache miss after compile"
+        assert bytes(cached.instructions) == bytes(bytecode.instructions), "cached instructions differ"
+        assert cache.get(PROGRAM, optimize=True) is None, "optimized and unoptimized bytecode share a cache entry"
+        assert cache.get(PROGRAM + " ") is None, "changed source hit the cache"
+        _, err = serializer.compile_source("let = ;", cache)
+        assert err is not None, "expected parse error"
+
+
+def test_function_instructions():
+    bytecode, _ = compile_program("fn() { 1 }")
+    data, _ = serializer.dump(bytecode)
+    loaded, _ = serializer.load(data)
+    fn = loaded.constants[1]
+    assert str(code.Instructions(fn.instructions)) == "0000 OpConstant 0\n0003 OpReturnValue\n", \
+        f"wrong function instructions: {fn.instructions}"
+
+
+def test_load_file_mmap():
+    bytecode, _ = compile_program(PROGRAM)
+    data, _ = serializer.dump(bytecode)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "program" + serializer.CACHE_SUFFIX)
+        with open(path, 'wb') as f:
+            f.write(data)
+        for use_mmap in [True, False]:
+            loaded, err = serializer.load_file(path, use_mmap=use_mmap)
+            assert err is None, f"load_file error: {err}"
+            functions = [c for c in loaded.constants if isinstance(c, object.CompiledFunction)]
+            for ins in [loaded.instructions] + [fn.instructions for fn in functions]:
+                assert isinstance(ins, memoryview) == use_mmap, \
+                    f"use_mmap={use_mmap} but instructions are {type(ins)}"
+            vm = VM(loaded)
+            # 函数在第一次被调用时才解码
+            assert all(fn.decoded is None for fn in functions), "functions decoded before they are called"
+            err = vm.run()
+            assert err is None, f"vm error: {err}"
+            result = vm.last_popped_stack_elem()
+            assert isinstance(result, object.String) and result.value == "héllo", f"wrong result. got={result}"
+            assert any(fn.decoded is not None for fn in functions), "called functions are not decoded"
+        _, err = serializer.load_file(os.path.join(directory, "missing"))
+        assert err is not None, "expected error for missing file"
+
+
+def test_closure_constants():
+    bytecode, err = compile_program(PROGRAM, optimize=True)
+    assert err is None, f"compiler error: {err}"
+    closures = [c for c in bytecode.constants if isinstance(c, object.Closure)]
+    assert closures, "expected closure constants for top-level functions"
+    data, err = serializer.dump(bytecode)
+    assert err is None, f"dump error: {err}"
+    loaded, err = serializer.load(data)
+    assert err is None, f"load error: {err}"
+    for want, got in zip(bytecode.constants, loaded.constants):
+        if isinstance(want, object.Closure):
+            assert isinstance(got, object.Closure) and got.fn in loaded.constants, \
+                f"closure constant not restored: {got}"
+    vm = VM(loaded)
+    err = vm.run()
+    assert err is None, f"vm error: {err}"
+    result = vm.last_popped_stack_elem()
+    assert isinstance(result, object.String) and result.value == "héllo", f"wrong result. got={result}"
+
+
+if __name__ == '__main__':
+    tests = [
+        test_round_trip,
+        test_load_errors,
+        test_compile_cache,
+        test_function_instructions,
+        test_load_file_mmap,
+        test_closure_constants,
+    ]
+    test_util.run_cases(tests)
@@ -1,3 +1,5 @@
+import sys
+import time
 from typing import List, Tuple, Union, Dict
 
 from monkey_compiler.compiler import Compiler
@@ -26,14 +28,15 @@ def test_boolean_object(expected: bool, actual: object.Object):
     return None
 
 
-def run_vm_test(cases: List[Tuple[str, Union[int, str, List, Dict]]]):
+def run_vm_test(cases: List[Tuple[str, Union[int, str, List, Dict]]], dispatch: str = vm.DISPATCH_TABLE,
+                optimize: bool = False):
     for code, expected in cases:
         program = parser.parse(code)
-        comp = Compiler()
+        comp = Compiler(optimize)
         err = comp.compile(program)
         if err is not None:
             return f"compiler error: {err}"
-        vm = VM(comp.bytecode())
+        vm = VM(comp.bytecode(), dispatch=dispatch)
         err = vm.run()
         if err is not None:
             print(f"vm error: {err}")
@@ -50,6 +53,33 @@ def run_vm_test(cases: List[Tuple[str, Union[int, str, List, Dict]]]):
     return True
 
 
+def native(obj: object.Object):
+    """把虚拟机对象转换为 Python 值，便于与用例中的期望值直接比较"""
+    if isinstance(obj, (object.Integer, object.Boolean, object.String)):
+        return obj.value
+    if isinstance(obj, object.Array):
+        return [native(e) for e in obj.elements]
+    if isinstance(obj, object.Hash):
+        return {k: native(pair.value) for k, pair in obj.pairs.items()}
+    return obj
+
+
+def check_vm_results(cases: List[Tuple[str, Union[int, str, List, Dict]]], dispatch: str = vm.DISPATCH_TABLE,
+                     optimize: bool = False):
+    """与 run_vm_test 相同，但任何不符都抛出 AssertionError，在 pytest 中同样会失败"""
+    for code, expected in cases:
+        comp = Compiler(optimize)
+        err = comp.compile(parser.parse(code))
+        assert err is None, f"{code}: compiler error: {err}"
+        machine = VM(comp.bytecode(), dispatch=dispatch)
+        err = machine.run()
+        assert err is None, f"{code}: vm error: {err}"
+        got = native(machine.last_popped_stack_elem())
+        # 布尔值与整数分开比较，避免 True == 1 这样的误判
+        assert got == expected and isinstance(got, bool) == isinstance(expected, bool), \
+            f"{code} ({dispatch}, optimize={optimize}): want={expected} got={got}"
+
+
 def test_expected_object(expected, actual: object.Object):
     exp_type = type(expected)
     if exp_type == int:
@@ -460,6 +490,139 @@ def test_builtin_functions():
         print('test_builtin_functions failed')
 
 
+def test_persistent_hashes():
+    one = object.Integer(1).hash_key()
+    two = object.Integer(2).hash_key()
+    three = object.Integer(3).hash_key()
+    cases = [
+        ("set({1: 1}, 2, 4)", {one: 1, two: 4}),
+        ("let h = {1: 1, 2: 2}; let g = set(h, 2, 20); h", {one: 1, two: 2}),
+        ("let h = {1: 1, 2: 2}; let g = set(h, 2, 20); g[2] + len([g[3]])", 21),
+        ("let h = {1: 1, 2: 2}; let g = delete(h, 1); h[1] + g[2]", 3),
+        ("delete({1: 1, 2: 2}, 1)", {two: 2}),
+        ("delete({1: 1}, 5)", {one: 1}),
+        ("merge({1: 1, 2: 2}, {2: 20, 3: 30})", {one: 1, two: 20, three: 30}),
+        ("merge({1: 1}, {}) == {1: 1}", True),
+        ("set(1, 1, 1)", object.Error(message="argument to 'set' must be HASH, got INTEGER")),
+        ("delete({}, [])", object.Error(message="unusable as hash key: ARRAY")),
+        ("merge({}, 1)", object.Error(message="arguments to 'merge' must be HASH, got INTEGER")),
+        ("""
+        let build = fn(h, n) { if (n == 0) { h } else { build(set(h, n, n * n), n - 1) } };
+        let h = build({}, 5000);
+        h[1] + h[4999] + len([delete(h, 1)[1]])
+        """, 24990003),
+    ]
+    check_vm_results(cases)
+
+
+def test_bulk_builtins():
+    cases = [
+        ("range(4)", [0, 1, 2, 3]),
+        ("range(2, 11, 4)", [2, 6, 10]),
+        ("range(3, 0, -1)", [3, 2, 1]),
+        ("sum(range(101))", 5050),
+        ("sum(push([1, 2], 3))", 6),
+        ("sort([3, 1, 2])", [1, 2, 3]),
+        ('sort(["b", "c", "a"])[0]', "a"),
+        ("map([1, 2, 3], fn(x) { x * x })", [1, 4, 9]),
+        ("map([[1], [2, 3]], len)", [1, 2]),
+        ("filter(range(10), fn(x) { x > 6 })", [7, 8, 9]),
+        ("reduce([1, 2, 3, 4], 10, fn(acc, x) { acc + x })", 20),
+        ("let k = 3; map(range(3), fn(x) { x + k })", [3, 4, 5]),
+        ("map(range(4), fn(x) { reduce(range(x + 1), 0, fn(a, b) { a + b }) })", [0, 1, 3, 6]),
+        ("""
+        let countDown = fn(x) { if (x == 0) { 0 } else { countDown(x - 1) } };
+        sum(map([10, 3000], countDown))
+        """, 0),
+        ("let f = fn(arr) { let g = fn(x) { x * 2 }; sum(map(arr, g)) + 1 }; f(range(5)) + f([1])", 24),
+        ("range(0, 1, 0)", object.Error(message="'range' step must not be zero")),
+        ("sum([1, true])", object.Error(message="elements of 'sum' must be INTEGER, got BOOLEAN")),
+        ("map(1, len)", object.Error(message="argument to 'map' must be ARRAY, got INTEGER")),
+        ("filter([], 1)", object.Error(message="argument to 'filter' must be a function, got INTEGER")),
+        ('sort([1, "a"])', object.Error(message="elements of 'sort' must have the same type, got INTEGER and STRING")),
+    ]
+    for dispatch in [vm.DISPATCH_TABLE, vm.DISPATCH_SWITCH]:
+        check_vm_results(cases, dispatch=dispatch)
+
+    # 回调中的运行时错误终止整个程序
+    for source, expected in [
+        ("map([1], fn(x) { x + true })", "unsupported types for binary operation: INTEGER BOOLEAN"),
+        ("reduce([1], 0, fn(x) { x })", "wrong number of arguments: want=1, got=2"),
+    ]:
+        comp = Compiler()
+        comp.compile(parser.parse(source))
+        err = VM(comp.bytecode()).run()
+        assert err == expected, f"{source}: want={expected} got={err}"
+
+
+def test_vm_call():
+    program = """
+    let add = fn(a, b) { a + b };
+    let twice = fn(f, x) { f(f(x)) };
+    let inc = fn(x) { x + 1 };
+    let down = fn(n) { if (n == 0) { 0 } else { down(n - 1) } };
+    """
+    comp = Compiler()
+    comp.compile(parser.parse(program))
+    machine = VM(comp.bytecode())
+    err = machine.run()
+    assert err is None, err
+    add, twice, inc, down = machine.global_variables[:4]
+    sp, frame_index = machine.sp, machine.frame_index
+
+    # 宿主程序调用全局变量中的闭包
+    cases = [
+        (add, [object.Integer(2), object.Integer(3)], 5),
+        (twice, [inc, object.Integer(1)], 3),
+        (down, [object.Integer(5000)], 0),
+        (machine.global_variables[0], [object.Integer(-1), object.Integer(1)], 0),
+    ]
+    for fn, args, expected in cases:
+        result, err = machine.call(fn, args)
+        assert err is None, err
+        assert native(result) == expected, f"want={expected} got={result.inspect()}"
+
+    # 宿主定义的高阶内置函数通过 call 回调 Monkey 闭包
+    call_inc = object.Builtin(fn=lambda call, x: call(inc, [x]), higher_order=True)
+    result, err = machine.call(twice, [call_inc, object.Integer(10)])
+    assert err is None and native(result) == 12, f"wrong result of a higher-order builtin: {result} {err}"
+
+    # 出错后虚拟机恢复到调用前的状态，可以继续使用
+    for fn, args, expected in [
+        (add, [object.Integer(1)], "wrong number of arguments: want=2, got=1"),
+        (add, [object.Integer(1), object.TRUE], "unsupported types for binary operation: INTEGER BOOLEAN"),
+        (object.Integer(1), [], "calling non-function and non-built-in"),
+    ]:
+        _, err = machine.call(fn, args)
+        assert err == expected, f"want={expected} got={err}"
+        assert (machine.sp, machine.frame_index) == (sp, frame_index), "vm state not restored after an error"
+    result, err = machine.call(add, [object.Integer(20), object.Integer(22)])
+    assert err is None and native(result) == 42, f"vm unusable after an error: {err}"
+
+
+def test_nested_calls():
+    nested = """
+    let f = fn(n) { if (n == 0) { 0 } else { sum(map([n], fn(x) { f(x - 1) })) } };
+    f(%d)
+    """
+    # 嵌套层数超过 Python 默认的递归上限所能容纳的深度
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(1000)
+    try:
+        check_vm_results([(nested % 50, 0), (nested % 300, 0)])
+        # 递归上限只在嵌套调用期间提高，返回后恢复
+        assert sys.getrecursionlimit() == 1000, f"recursion limit not restored: {sys.getrecursionlimit()}"
+    finally:
+        sys.setrecursionlimit(limit)
+    comp = Compiler()
+    comp.compile(parser.parse(nested % 1000))
+    err = VM(comp.bytecode(), max_nested_calls=100).run()
+    assert err == "too many nested calls: max_nested_calls=100", f"wrong error for deeply nested calls: {err}"
+    err = VM(comp.bytecode(), max_stack=65536, max_frames=4096).run()
+    assert err is None, f"vm error: {err}"
+    assert sys.getrecursionlimit() == limit, f"recursion limit not restored: {sys.getrecursionlimit()}"
+
+
 def test_closures():
     cases = [
         ("""
@@ -594,6 +757,316 @@ def test_recursive_fibonacci():
         print(f'test_recursive_fibonacci failed: {err}')
 
 
+def test_tail_calls():
+    cases = [
+        ("""
+        let countDown = fn(x) { if (x == 0) { 0 } else { countDown(x - 1) } };
+        countDown(5000);
+        """, 0),
+        ("""
+        let sum = fn(x, acc) { if (x == 0) { return acc; } sum(x - 1, acc + x); };
+        sum(3000, 0);
+        """, 4501500),
+        ("""
+        let build = fn(arr, n) { if (n == 0) { arr } else { build(push(arr, n), n - 1) } };
+        let reduce = fn(arr, acc, f) {
+            if (len(arr) == 0) { acc } else { reduce(rest(arr), f(acc, first(arr)), f) }
+        };
+        reduce(build([], 2000), 0, fn(a, b) { a + b });
+        """, 2001000),
+        ("""
+        let flip = fn(n, b) { if (n == 0) { b } else { flip(n - 1, !b) } };
+        flip(3001, true);
+        """, False),
+        ("let f = fn(arr) { len(arr) }; f([1, 2, 3]) + 1", 4),
+        ("let g = fn(a, b) { a * b }; let f = fn(x) { g(x, x + 1) }; f(3) + f(4)", 32),
+    ]
+    for dispatch in [vm.DISPATCH_TABLE, vm.DISPATCH_SWITCH]:
+        check_vm_results(cases, dispatch=dispatch)
+
+
+def test_loops():
+    cases = [
+        ("while (false) { 1 }", vm.NULL),
+        ("let f = fn() { while (true) { return 7; } }; f()", 7),
+        ("let f = fn(n) { while (n > 0) { if (n > 2) { return n; } } }; f(5)", 5),
+        ("for (x in [1, 2, 3]) { x }", vm.NULL),
+        ("for (x in [4, 5]) { x * 2 }; x", 5),
+        ("let f = fn(arr) { for (x in arr) { if (x > 2) { return x; } } }; f([1, 3, 5])", 3),
+        ("let f = fn(arr) { for x in arr { for y in arr { if (x * y > 10) { return x * 10 + y; } } } }; f([1, 3, 5])", 35),
+        ("let f = fn() { for (x in []) { return 1; } }; f()", vm.NULL),
+        ("let f = fn(a) { let t = 0; for (x in a) { let t = x; } t }; f([1, 2])", 2),
+        ("if (true) { for (x in [1]) { } } else { 2 }", vm.NULL),
+        ("let k = 3; let f = fn() { for (x in [1, 2]) { if (x == 2) { return fn() { x + k }; } } }; f()()", 5),
+    ]
+    for dispatch in [vm.DISPATCH_TABLE, vm.DISPATCH_SWITCH]:
+        for optimize in [False, True]:
+            check_vm_results(cases, dispatch=dispatch, optimize=optimize)
+
+    # 被遍历的值不是数组时报错，与求值器相同
+    for source, expected in [
+        ("for (x in 5) { x }", "for-in not supported: INTEGER"),
+        ('let f = fn() { for (c in "ab") { c } }; f()', "for-in not supported: STRING"),
+        ("for (x in {1: 2}) { x }", "for-in not supported: HASH"),
+    ]:
+        for dispatch in [vm.DISPATCH_TABLE, vm.DISPATCH_SWITCH]:
+            comp = Compiler()
+            comp.compile(parser.parse(source))
+            err = VM(comp.bytecode(), dispatch=dispatch).run()
+            assert err == expected, f"{source} ({dispatch}): want={expected} got={err}"
+
+
+def test_loop_variable_capture():
+    """函数中的循环变量每次迭代都是新的绑定"""
+    cases = [
+        ("let g = fn() { let out = []; for (x in [1, 2, 3]) { out = push(out, fn() { x }); } out }; "
+         "let hs = g(); [hs[0](), hs[1](), hs[2]()]", [1, 2, 3]),
+        ("let g = fn() { let out = []; for (x in [1, 2]) { out = push(out, fn() { x = x * 10 }); }; out }; "
+         "let hs = g(); [hs[0](), hs[0](), hs[1]()]", [10, 100, 20]),
+        ("let g = fn() { let out = []; for (x in [1, 2]) { for (y in [3, 4]) { out = push(out, fn() { x * y }); } }; "
+         "map(out, fn(h) { h() }) }; g()", [3, 4, 6, 8]),
+        ("let g = fn(a) { let t = 0; for (x in a) { let t = x; x = x * 3; }; [t, x] }; g([1, 2])", [2, 6]),
+        # 顶层的循环变量是全局变量
+        ("let out = []; for (x in [1, 2]) { out = push(out, fn() { x }); }; [out[0](), out[1]()]", [2, 2]),
+    ]
+    for dispatch in [vm.DISPATCH_TABLE, vm.DISPATCH_SWITCH]:
+        for optimize in [False, True]:
+            check_vm_results(cases, dispatch=dispatch, optimize=optimize)
+
+
+def test_assignments():
+    cases = [
+        ("let x = 1; x = x + 1; x", 2),
+        ("let a = 1; let b = 2; a = b = 3; a + b", 6),
+        ("let s = 0; for (x in [1, 2, 3]) { s = s + x }; s", 6),
+        ("let f = fn(n) { let s = 0; let i = 0; while (i < n) { i = i + 1; s = s + i; } s }; f(100)", 5050),
+        ("let g = 1; let f = fn() { g = g + 1 }; f(); f(); g", 3),
+        ("let one = 1; let f = fn() { one }; one = 5; f()", 5),
+        # 闭包与外层函数共享被赋值的变量
+        ("let counter = fn() { let c = 0; fn() { c = c + 1 } }; let c = counter(); c(); c(); c()", 3),
+        ("let f = fn(a) { let g = fn() { a = a * 2 }; g(); g(); a }; f(3)", 12),
+        ("let f = fn() { let c = 0; let inc = fn() { fn() { c = c + 10 } }; inc()(); inc()(); c }; f()", 20),
+        ("let f = fn(n) { if (n == 0) { return 0; } let x = n; fn() { x = x + 1 }(); f(n - 1) + x }; f(3)", 9),
+        ("let f = fn(arr) { let m = 0; for (x in arr) { if (x > m) { m = x; } } m }; f([3, 9, 2])", 9),
+    ]
+    for dispatch in [vm.DISPATCH_TABLE, vm.DISPATCH_SWITCH]:
+        for optimize in [False, True]:
+            check_vm_results(cases, dispatch=dispatch, optimize=optimize)
+
+    # 与 REPL 相同逐行编译：之前输入的变量可以重新赋值，之前定义的闭包读到的是新值
+    symbol_table = Compiler().symbol_table
+    constants = []
+    global_variables = []
+    for text, expected in [("let x = 1;", None), ("let f = fn() { x };", None), ("x = 5;", None),
+                           ("x", 5), ("f()", 5), ("x = x + f()", 10)]:
+        comp = Compiler.new_with_state(symbol_table, constants, optimize=True)
+        err = comp.compile(parser.parse(text))
+        assert err is None, f"{text}: compiler error: {err}"
+        constants = comp.bytecode().constants
+        machine = VM.new_with_global_state(comp.bytecode(), global_variables)
+        err = machine.run()
+        assert err is None, f"{text}: vm error: {err}"
+        if expected is not None:
+            got = native(machine.last_popped_stack_elem())
+            assert got == expected, f"{text}: want={expected} got={got}"
+
+
+def test_persistent_arrays():
+    cases = [
+        ("let a = [1, 2]; let b = push(a, 3); let c = push(a, 4); b", [1, 2, 3]),
+        ("let a = [1, 2]; let b = push(a, 3); let c = push(a, 4); c", [1, 2, 4]),
+        ("let a = [1, 2]; let b = push(a, 3); let c = push(a, 4); a", [1, 2]),
+        ("let a = [1, 2, 3]; let b = rest(a); let c = push(b, 9); a", [1, 2, 3]),
+        ("let a = [1, 2, 3]; let b = rest(a); let c = push(b, 9); c", [2, 3, 9]),
+        ("let a = [1, 2, 3]; let b = rest(a); let c = push(b, 9); c[2] + len(rest(b))", 10),
+        ("rest(rest(rest([1, 2])))", vm.NULL),
+        ("rest([1, 2, 3])[5]", vm.NULL),
+        ("[1, 2, 3] == push(rest([0, 1, 2]), 3)", True),
+        ("let a = [1, 2]; let b = push(a, \"x\"); len(b) + a[1] + len(b[2])", 6),
+        ("let a = push([], 1); let b = push(a, 2); if (a == [1]) { b[1] }", 2),
+    ]
+    check_vm_results(cases)
+
+    # push 与 rest 不再复制整个数组，十万个元素的构建与遍历都是线性的
+    program = """
+    let build = fn(arr, n) { if (n == 0) { arr } else { build(push(arr, n), n - 1) } };
+    let total = fn(arr, acc) { if (len(arr) == 0) { acc } else { total(rest(arr), acc + first(arr)) } };
+    total(build([], 100000), 0);
+    """
+    comp = Compiler()
+    comp.compile(parser.parse(program))
+    machine = VM(comp.bytecode())
+    start = time.time()
+    err = machine.run()
+    elapsed = time.time() - start
+    assert err is None, err
+    assert native(machine.last_popped_stack_elem()) == 5000050000
+    assert elapsed < 10, f"100k elements took {elapsed:.1f}s"
+
+
+def letters(i: int) -> str:
+    """标识符不能包含数字，把下标转换为字母名"""
+    name = "v"
+    while True:
+        name += chr(ord('a') + i % 26)
+        i //= 26
+        if i == 0:
+            return name
+
+
+def test_growable_stacks():
+    deep = """
+    let depth = fn(x) { if (x == 0) { 0 } else { 1 + depth(x - 1) } };
+    depth(3000);
+    """
+    cases = [
+        (deep, {}, "Stack Overflow"),
+        (deep, {"max_stack": 65536}, "Frame Overflow: max_frames=1024"),
+        (deep, {"max_frames": 4096, "max_stack": 16384}, 3000),
+        ("let f = fn(x) { if (x == 0) { 0 } else { 1 + f(x - 1) } }; f(100)", {"max_stack": 50}, "Stack Overflow"),
+        ("[" + ", ".join(str(i) for i in range(500)) + "][499]", {}, 499),
+        ("".join(f"let {letters(i)} = {i}; " for i in range(300)) + letters(299), {}, 299),
+        ("let a = 1; let b = 2; let c = 3;", {"max_globals": 2}, "too many globals: max_globals=2"),
+    ]
+    for text, limits, expected in cases:
+        comp = Compiler()
+        err = comp.compile(parser.parse(text))
+        assert err is None, f"compiler error: {err}"
+        machine = VM(comp.bytecode(), **limits)
+        assert len(machine.stack) <= vm.INITIAL_STACK_SIZE and len(machine.frames) <= vm.INITIAL_FRAMES, \
+            f"stacks preallocated. stack={len(machine.stack)}"
+        err = machine.run()
+        if isinstance(expected, str):
+            assert err == expected, f"wrong VM error: want={expected}, got={err}"
+            continue
+        assert err is None, f"vm error: {err}"
+        assert native(machine.last_popped_stack_elem()) == expected
+
+    # 多个虚拟机共享同一个全局变量列表，列表原地增长
+    global_variables = [None] * vm.INITIAL_GLOBALS
+    symbol_table = None
+    constants = []
+    for i in range(40):
+        comp = Compiler() if symbol_table is None else Compiler.new_with_state(symbol_table, constants)
+        symbol_table = comp.symbol_table
+        err = comp.compile(parser.parse(f"let {letters(i)} = {i};"))
+        assert err is None, f"compiler error: {err}"
+        constants = comp.bytecode().constants
+        err = VM.new_with_global_state(comp.bytecode(), global_variables).run()
+        assert err is None, f"vm error: {err}"
+    assert len(global_variables) >= 40 and global_variables[39].value == 39, "shared globals not grown in place"
+
+    # 上一行定义了全局变量但在赋值前出错，共享列表没有增长到它的下标，读取时不能越界
+    for optimize in [False, True]:
+        global_variables = []
+        comp = Compiler(optimize)
+        err = comp.compile(parser.parse("let f = 1 + true;"))
+        assert err is None, f"compiler error: {err}"
+        err = VM.new_with_global_state(comp.bytecode(), global_variables).run()
+        assert err == "unsupported types for binary operation: INTEGER BOOLEAN", f"wrong VM error: {err}"
+        for text, expected in [("f", None), ("f()", "calling non-function and non-built-in")]:
+            comp = Compiler.new_with_state(comp.symbol_table, comp.bytecode().constants, optimize)
+            err = comp.compile(parser.parse(text))
+            assert err is None, f"compiler error: {err}"
+            err = VM.new_with_global_state(comp.bytecode(), global_variables).run()
+            assert err == expected, f"{text}: want={expected} got={err}"
+
+
+def test_global_constants():
+    cases = [
+        ("let one = 1; let two = fn() { one + one }; two() + one", 3),
+        ("let twice = fn(f, x) { f(f(x)) }; let inc = fn(x) { x + 1 }; twice(inc, 1)", 3),
+        ("let size = fn(arr) { len(arr) }; size([1, 2]) + size(rest([1, 2]))", 3),
+        ("let greeting = \"hi\"; let f = fn() { greeting + greeting }; f()", "hihi"),
+        ("let fib = fn(x) { if (x < 2) { x } else { fib(x - 1) + fib(x - 2) } }; fib(10)", 55),
+        ("if (true) { let a = 1; }; let b = fn() { a }; b()", 1),
+    ]
+    for dispatch in [vm.DISPATCH_TABLE, vm.DISPATCH_SWITCH]:
+        check_vm_results(cases, dispatch=dispatch, optimize=True)
+
+    # 同一份字节码在两个虚拟机中执行，预解码的指令被共享
+    comp = Compiler(optimize=True)
+    comp.compile(parser.parse("let f = fn(x) { len(x) }; f([1, 2, 3])"))
+    bytecode = comp.bytecode()
+    for _ in range(2):
+        machine = VM(bytecode)
+        err = machine.run()
+        assert err is None and native(machine.last_popped_stack_elem()) == 3, f"shared bytecode: {err}"
+
+
+def test_switch_dispatch():
+    cases = [
+        ("(5+10*2+15/3) * 2 + -10", 50),
+        ("if ((if (false) { 10 })) { 10 } else { 20 }", 20),
+        ("let one = 1; let two = one + one; one + two", 3),
+        ('"mon" + "key"', "monkey"),
+        ("{1: 1, 2: 2}[2]", 2),
+        ('len([1, 2, 3])', 3),
+        ("""
+        let newAdder = fn(a, b) {
+            let c = a + b;
+            fn(d) { c + d };
+        };
+        let adder = newAdder(1, 2);
+        adder(8);
+        """, 11),
+        ("""
+        let countDown = fn(x) {
+            if (x == 0) {
+                return 0;
+            } else {
+                countDown(x - 1);
+            }
+        };
+        countDown(1);
+        """, 0),
+    ]
+    check_vm_results(cases, dispatch=vm.DISPATCH_SWITCH)
+
+
+def test_superinstructions():
+    cases = [
+        ("let add = fn(a) { a + 1 }; add(41)", 42),
+        ('let add = fn(a) { a + "key" }; add("mon")', "monkey"),
+        ("let add = fn(a, b) { a + b }; add(1, 2)", 3),
+        ("let f = fn(a) { if (a > 10) { 1 } else { 2 } }; f(11) + f(10) * 10", 21),
+        ("let f = fn(a) { if (a > 10) { 1 } }; f(1)", vm.NULL),
+        ("let one = fn() { 1 }; let two = fn() { one() + one() }; two()", 2),
+        ("""
+        let fibonacci = fn(x) {
+            if (x == 0) {
+                return 0;
+            } else {
+                if (x == 1) {
+                    return 1;
+                } else {
+                    fibonacci(x - 1) + fibonacci(x - 2);
+                }
+            }
+        };
+        fibonacci(15);
+        """, 610),
+    ]
+    for dispatch in [vm.DISPATCH_TABLE, vm.DISPATCH_SWITCH]:
+        check_vm_results(cases, dispatch=dispatch, optimize=True)
+
+
+def test_constant_folding():
+    cases = [
+        ("(5+10*2+15/3) * 2 + -10", 50),
+        ("!(if (false) { 5; })", True),
+        ("if ((if (false) { 10 })) { 10 } else { 20 }", 20),
+        ("if (1 > 2) { 10 }", vm.NULL),
+        ("if (1 < 2) { let a = 1; a + 2 }", 3),
+        ("(1 < 2) == false", False),
+        ('"mon" + "key" + "banana"', "monkeybanana"),
+        ("[1 + 2, 3 * 4, 5 + 6]", [3, 12, 11]),
+        ("{1 + 1: 2 * 2, 3 + 3: 4 * 4}[6]", 16),
+        ("let f = fn(x) { x * (2 + 3) }; f(2 - 1)", 5),
+    ]
+    check_vm_results(cases, optimize=True)
+
+
 if __name__ == '__main__':
     test_integer_arithmetic()
     test_boolean_expressions()
@@ -613,3 +1086,19 @@ if __name__ == '__main__':
     test_closures()
     test_recursive_functions()
     test_recursive_fibonacci()
+    test_util.run_cases([
+        test_persistent_hashes,
+        test_bulk_builtins,
+        test_vm_call,
+        test_nested_calls,
+        test_tail_calls,
+        test_loops,
+        test_loop_variable_capture,
+        test_assignments,
+        test_persistent_arrays,
+        test_growable_stacks,
+        test_global_constants,
+        test_switch_dispatch,
+        test_superinstructions,
+        test_constant_folding,
+    ])
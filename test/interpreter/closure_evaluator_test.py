@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+from monkey_evaluate import closure_evaluator, evaluator
+from monkey_object.object import Environment, Function
+from monkey_parser.parser import parse
+from util.test_util import run_cases
+
+PROGRAMS = [
+    "(5 + 10 * 2 + 15 / 3) * 2 + -10",
+    "!!5 == true",
+    "if (1 > 2) { 10 }",
+    "if (1 < 2) { 10 } else { 20 }",
+    "if (10 > 1) { if (10 > 1) { return 10; } return 1; }",
+    "let f = fn() { let x = if (true) { return 1; }; let g = fn() { return 2; }; g(); x }; f()",
+    "let f = fn() { let a = [if (true) { return 1; }]; let g = fn() { return 2; }; g(); a[0] }; f()",
+    "let f = fn() { let id = fn(v) { let g = fn() { return 2; }; g(); v }; id(if (true) { return 1; }) }; f()",
+    'let f = fn() { let x = if (true) { return 1; }; 5 }; f()',
+    'let f = fn() { let a = [2, if (true) { return 1; }]; 5 }; f()',
+    'let f = fn() { let h = {"a": if (true) { return 1; }}; 5 }; f()',
+    'let f = fn() { let g = fn(a, b) { 5 }; g(2, if (true) { return 1; }) + 10 }; f()',
+    'let f = fn() { 10 + if (true) { return 1; } }; f()',
+    'let f = fn() { if (if (true) { return 1; }) { 5 } else { 6 } }; f()',
+    'let f = fn() { return if (true) { return 1; } else { 2 }; }; f()',
+    'let g = fn() { return 2; }; let f = fn() { let x = if (true) { return g() + 1; }; 5 }; f()',
+    "let a = 5; let b = a * 2; a + b",
+    "let a = 5;",
+    '"Hello" + " " + "World!"',
+    "[1, 2 * 2, 3 + 3][1]",
+    "[1, 2, 3][3]",
+    'let f = fn(x) { x * 3 }; {"one": 10 - 9, true: 2, 3: f(1)}',
+    '{"one": 1}["two"]',
+    "let fib = fn(x) { if (x < 2) { return x; } fib(x - 1) + fib(x - 2) }; fib(15)",
+    "let newAdder = fn(a) { fn(b) { a + b } }; let add = newAdder(3); add(4)",
+    "let a = fn(x) { fn(y) { fn(z) { x + y + z } } }; a(1)(2)(3)",
+    "let f = fn() { g() }; let g = fn() { 5 }; f()",
+    "let x = 1; let f = fn() { let y = x; let x = 2; y * 10 + x }; f()",
+    "let f = fn(len) { len }; f(3)",
+    "let f = fn() { let n = if (false) { 1 }; n }; f()",
+    "let f = fn() { let c = 0; let inc = fn() { c = c + 1 }; inc(); inc(); c }; f()",
+    "let s = 0; for (x in [1, 2, 3]) { s = s + x }; s",
+    "let f = fn(n) { let s = 0; let i = 0; while (i < n) { i = i + 1; s = s + i; } s }; f(100)",
+    "let f = fn(arr) { for (x in arr) { if (x > 2) { return x; } } }; f([1, 3, 5])",
+    "let g = fn() { let out = []; for (x in [1, 2, 3]) { out = push(out, fn() { x }); } out }; "
+    "let hs = g(); [hs[0](), hs[1](), hs[2]()]",
+    "let g = fn() { let out = []; for (x in [1, 2]) { out = push(out, fn() { x = x * 10 }); }; out }; "
+    "let hs = g(); [hs[0](), hs[0](), hs[1]()]",
+    "let g = fn() { let out = []; for (x in [1, 2]) { for (y in [3, 4]) { out = push(out, fn() { x * y }); } }; "
+    "map(out, fn(h) { h() }) }; g()",
+    "let g = fn(a) { let t = 0; for (x in a) { let t = x; x = x * 3; }; [t, x] }; g([1, 2])",
+    "let out = []; for (x in [1, 2]) { out = push(out, fn() { x }); }; [out[0](), out[1]()]",
+    "let k = 2; sum(map(filter(range(10), fn(x) { x > 6 }), fn(x) { x * k }))",
+    "reduce(range(4), 0, fn(a, b) { a + b })",
+    'len("four") + len([1, 2]) + first([7, 8]) + last([7, 8])',
+    "rest(push([1, 2], 3))",
+    "quote(1 + unquote(2 + 2))",
+    "5 + true; 5",
+    "-true",
+    'if (10 > 1) { true + false; }',
+    "foobar",
+    "let f = fn() { y }; f()",
+    "for (x in 1) { x }",
+    "x = 1",
+    "let f = fn(x) { x(); }; f(1)",
+]
+
+
+def test_same_results_as_evaluator():
+    for source in PROGRAMS:
+        expected = evaluator.evaluate(parse(source), Environment())
+        got = closure_evaluator.evaluate(parse(source), Environment())
+        expected = expected.inspect() if expected is not None else None
+        got = got.inspect() if got is not None else None
+        assert got == expected, f"{source}: want={expected} got={got}"
+
+
+def test_compiled_functions():
+    env = Environment()
+    ret = closure_evaluator.evaluate(parse("let twice = fn(f, x) { f(f(x)) }; twice"), env)
+    assert isinstance(ret, Function) and ret.code is not None, f"function body is not compiled: {ret}"
+    # 编译好的函数也可以交给 evaluator 调用，例如 map 等内置函数回调时
+    ret = evaluator.evaluate(parse("twice(fn(x) { x * 3 }, 2)"), env)
+    assert ret.inspect() == "18", f"wrong result of calling a compiled function: {ret.inspect()}"
+
+
+if __name__ == '__main__':
+    cases = [
+        test_same_results_as_evaluator,
+        test_compiled_functions,
+    ]
+    run_cases(cases)
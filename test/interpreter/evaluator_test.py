@@ -81,6 +81,19 @@ def test_null_object(obj: object.Object):
     return True
 
 
+def check_eval_results(cases):
+    """依次求值用例并与期望比较：整数为结果的值，None 表示 NULL，字符串为错误信息；不符时抛出 AssertionError"""
+    for code, expected in cases:
+        ret = test_util.get_eval(code)
+        if isinstance(expected, int):
+            assert isinstance(ret, Integer) and ret.value == expected, f"{code}: want={expected} got={ret}"
+        elif expected is None:
+            assert ret == evaluator.NULL, f"{code}: want=NULL got={ret}"
+        else:
+            assert isinstance(ret, Error) and ret.message == expected, \
+                f'{code}: wrong error message. expected "{expected}" got "{ret}"'
+
+
 def test_if_else_expression():
     cases = [
         ("if (true) { 10 }", 10),
@@ -146,13 +159,24 @@ def test_return_statements():
         ("return 10; 9;", 10),
         ("return 2 * 5; 9;", 10),
         ("9; return 2 * 5; 9;", 10),
+        ("if (10 > 1) { if (10 > 1) { return 10; } return 1; }", 10),
+        ("let f = fn(x) { return g(x) + 1; }; let g = fn(x) { return x * 2; }; f(3)", 7),
+        ("let f = fn(n) { for (x in [1, 2, 3]) { if (x == n) { return x * 10; } } return 0; }; f(2) + f(4)", 20),
+        ("let f = fn(n) { if (n == 0) { return 0; } return n + f(n - 1); }; f(10)", 55),
+        ("let f = fn() { let x = if (true) { return 1; }; let g = fn() { return 2; }; g(); x }; f()", 1),
+        ("let f = fn() { let a = [if (true) { return 1; }]; let g = fn() { return 2; }; g(); a[0] }; f()", 1),
+        ("let f = fn() { let id = fn(v) { let g = fn() { return 2; }; g(); v }; id(if (true) { return 1; }) }; f()", 1),
+        # return 直接结束函数，不会作为 let 的值、数组和哈希的元素、参数或运算数留下来
+        ('let f = fn() { let x = if (true) { return 1; }; 5 }; f()', 1),
+        ('let f = fn() { let a = [2, if (true) { return 1; }]; 5 }; f()', 1),
+        ('let f = fn() { let h = {"a": if (true) { return 1; }}; 5 }; f()', 1),
+        ('let f = fn() { let g = fn(a, b) { 5 }; g(2, if (true) { return 1; }) + 10 }; f()', 1),
+        ('let f = fn() { 10 + if (true) { return 1; } }; f()', 1),
+        ('let f = fn() { if (if (true) { return 1; }) { 5 } else { 6 } }; f()', 1),
+        ('let f = fn() { return if (true) { return 1; } else { 2 }; }; f()', 1),
+        ('let g = fn() { return 2; }; let f = fn() { let x = if (true) { return g() + 1; }; 5 }; f()', 3),
     ]
-    for case in cases:
-        ret = test_util.get_eval(case[0])
-        output = test_integer_object(case[1], ret)
-        if type(output) == tuple:
-            return output
-    return True
+    check_eval_results(cases)
 
 
 def test_error_handling():
@@ -435,6 +459,94 @@ def test_hash_index_expression():
     return True
 
 
+def test_hash_builtins():
+    cases = [
+        ('let h = {"a": 1}; let g = set(h, "b", 2); g["a"] + g["b"]', 3),
+        ('let h = {"a": 1}; let g = set(h, "a", 5); h["a"] * 10 + g["a"]', 15),
+        ('let h = {"a": 1, "b": 2}; let g = delete(h, "a"); h["a"] + g["b"]', 3),
+        ('merge({"a": 1, "b": 2}, {"b": 3})["b"]', 3),
+        ('set(1, 2, 3)', "argument to 'set' must be HASH, got INTEGER"),
+        ('merge({}, [])', "arguments to 'merge' must be HASH, got ARRAY"),
+    ]
+    check_eval_results(cases)
+    assert not test_util.get_eval('delete({"a": 1}, "a")').pairs, "deleted key still present"
+
+
+def test_bulk_builtins():
+    cases = [
+        ('sum(range(1, 11))', 55),
+        ('sum(map(range(4), fn(x) { x * x }))', 14),
+        ('len(filter([1, 2, 3, 4], fn(x) { x > 2 }))', 2),
+        ('reduce(range(5), 100, fn(acc, x) { acc - x })', 90),
+        ('let k = 10; sort(map([3, 1, 2], fn(x) { x + k }))[0]', 11),
+        ('map([1], fn(x) { x + true })', "type mismatch: INTEGER + BOOLEAN"),
+        ('reduce([1], 0, fn(x) { x })', "wrong number of arguments: want=1, got=2"),
+        ('sum(1)', "argument to 'sum' must be ARRAY, got INTEGER"),
+    ]
+    check_eval_results(cases)
+
+
+def test_loops():
+    cases = [
+        ("while (false) { 1 }", None),
+        ("let f = fn() { while (true) { return 7; } }; f()", 7),
+        ("for (x in [4, 5]) { x * 2 }", None),
+        ("let f = fn(arr) { for (x in arr) { if (x > 2) { return x; } } }; f([1, 3, 5])", 3),
+        ("let f = fn(arr) { for x in arr { for y in arr { if (x * y > 10) { return x * 10 + y; } } } }; f([1, 3, 5])", 35),
+        ("for (x in [1]) { x + true }", "type mismatch: INTEGER + BOOLEAN"),
+        ("for (x in 1) { x }", "for-in not supported: INTEGER"),
+    ]
+    check_eval_results(cases)
+
+
+def test_loop_variable_capture():
+    """函数中的循环变量每次迭代都是新的绑定，闭包捕获的是本次迭代的变量"""
+    cases = [
+        ("let g = fn() { let out = []; for (x in [1, 2, 3]) { out = push(out, fn() { x }); } out }; "
+         "let hs = g(); [hs[0](), hs[1](), hs[2]()]", "[1, 2, 3]"),
+        ("let g = fn() { let out = []; for (x in [1, 2]) { out = push(out, fn() { x = x * 10 }); }; out }; "
+         "let hs = g(); [hs[0](), hs[0](), hs[1]()]", "[10, 100, 20]"),
+        ("let g = fn() { let out = []; for (x in [1, 2]) { for (y in [3, 4]) { out = push(out, fn() { x * y }); } }; "
+         "map(out, fn(h) { h() }) }; g()", "[3, 4, 6, 8]"),
+        ("let g = fn(a) { let t = 0; for (x in a) { let t = x; x = x * 3; }; [t, x] }; g([1, 2])", "[2, 6]"),
+        # 顶层的循环变量是全局变量
+        ("let out = []; for (x in [1, 2]) { out = push(out, fn() { x }); }; [out[0](), out[1]()]", "[2, 2]"),
+    ]
+    for source, expected in cases:
+        got = test_util.get_eval(source).inspect()
+        assert got == expected, f"{source}: want={expected} got={got}"
+
+
+def test_assignments():
+    cases = [
+        ("let x = 1; x = x + 1; x", 2),
+        ("let a = 1; let b = 2; a = b = 3; a + b", 6),
+        ("let s = 0; for (x in [1, 2, 3]) { s = s + x }; s", 6),
+        ("let f = fn(n) { let s = 0; let i = 0; while (i < n) { i = i + 1; s = s + i; } s }; f(100)", 5050),
+        ("let counter = fn() { let c = 0; fn() { c = c + 1 } }; let c = counter(); c(); c(); c()", 3),
+        ("let g = 1; let f = fn() { g = g + 1 }; f(); f(); g", 3),
+        ("x = 1", "identifier not found: x"),
+        ("let x = 1; x = x + true", "type mismatch: INTEGER + BOOLEAN"),
+    ]
+    check_eval_results(cases)
+
+
+def test_lexical_scoping():
+    cases = [
+        ("let a = fn(x) { fn(y) { fn(z) { x + y + z } } }; a(1)(2)(3)", 6),
+        ("let f = fn() { g() }; let g = fn() { 5 }; f()", 5),
+        ("let f = fn() { let g = fn() { h() }; let h = fn() { 1 }; g() }; f()", 1),
+        # 同名的局部变量定义之前，读到的仍是外层的变量
+        ("let x = 1; let f = fn() { let y = x; let x = 2; y * 10 + x }; f()", 12),
+        ("let f = fn(len) { len }; f(3)", 3),
+        ("let f = fn(x) { if (x == 0) { 0 } else { x + f(x - 1) } }; f(10)", 55),
+        ("let f = fn() { let c = 0; let inc = fn() { c = c + 1 }; inc(); inc(); c }; f()", 2),
+        ("let f = fn() { let n = if (false) { 1 }; n }; f()", None),
+        ("let f = fn() { y }; f()", "identifier not found: y"),
+    ]
+    check_eval_results(cases)
+
+
 if __name__ == '__main__':
     tests = [
         test_eval_integer_expression,
@@ -452,6 +564,12 @@ if __name__ == '__main__':
         test_array_literal,
         test_array_index_expression,
         test_hash_literal,
-        test_hash_index_expression
+        test_hash_index_expression,
+        test_hash_builtins,
+        test_bulk_builtins,
+        test_loops,
+        test_loop_variable_capture,
+        test_assignments,
+        test_lexical_scoping,
     ]
     test_util.run_cases(tests)
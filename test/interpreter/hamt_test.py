@@ -0,0 +1,71 @@
+import random
+
+from parser_test import run_cases
+from monkey_object.hamt import HamtMap
+
+
+class Colliding:
+    """哈希值相同但不相等的键"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __hash__(self):
+        return 42
+
+    def __eq__(self, other):
+        return isinstance(other, Colliding) and other.name == self.name
+
+    def __repr__(self):
+        return f"Colliding({self.name})"
+
+
+def test_matches_dict():
+    rnd = random.Random(7)
+    m = HamtMap()
+    d = {}
+    history = []
+    for _ in range(5000):
+        key = rnd.randrange(2000)
+        if rnd.random() < 0.3:
+            m = m.delete(key)
+            d.pop(key, None)
+        else:
+            m = m.set(key, key * 2)
+            d[key] = key * 2
+        history.append((m, dict(d)))
+    for snapshot, expected in history[::250]:
+        assert len(snapshot) == len(expected) and dict(snapshot.items()) == expected, "map differs from dict"
+        for key in range(0, 2000, 37):
+            assert snapshot.get(key) == expected.get(key) and (key in snapshot) == (key in expected), \
+                f"lookup of {key} differs"
+
+
+def test_structural_sharing():
+    base = HamtMap((i, i) for i in range(1000))
+    updated = base.set(5, 50)
+    assert base[5] == 5 and updated[5] == 50 and len(updated) == 1000, "set modified the original map"
+    assert base.set(5, base[5]) is base and base.delete(-1) is base, "no-op update created a new map"
+    shared = [a for a, b in zip(base.root.array, updated.root.array) if a is b]
+    assert len(shared) >= len(base.root.array) - 1, "set copied unrelated subtrees"
+    merged = base.update({5: 55, 1000: 1000})
+    assert len(merged) == 1001 and merged[5] == 55 and base.get(1000) is None, "update is wrong"
+    assert HamtMap({1: 2}) == {1: 2} and HamtMap({1: 2}) != {1: 3}, "equality with dict is wrong"
+
+
+def test_hash_collisions():
+    a, b, c = Colliding("a"), Colliding("b"), Colliding("c")
+    m = HamtMap([(a, 1), (b, 2), (1, 3)]).set(c, 4)
+    assert [m.get(k) for k in (a, b, c, 1)] == [1, 2, 4, 3], f"wrong values with colliding keys: {m}"
+    m2 = m.delete(b).delete(a)
+    assert len(m2) == 2 and b not in m2 and m2[c] == 4 and m[b] == 2, f"delete with colliding keys is wrong: {m2}"
+    assert len(m2.delete(c).delete(1)) == 0, "map not empty after deleting every key"
+
+
+if __name__ == '__main__':
+    cases = [
+        test_matches_dict,
+        test_structural_sharing,
+        test_hash_collisions,
+    ]
+    run_cases(cases)
@@ -83,9 +83,18 @@ def test_expand_macro():
     return True
 
 
+def test_evaluate_macro_literal():
+    # 宏字面量的求值函数由 macro_expansion 注册到 evaluator
+    env = object.Environment()
+    obj = evaluate(parse("let m = macro(x, y) { x + y; }; m"), env)
+    assert isinstance(obj, object.Macro), f"object is not Macro. got {obj}"
+    assert obj.env is env and obj.body.string() == "(x + y)", f"wrong macro: {obj.inspect()}"
+
+
 if __name__ == '__main__':
     tests = [
         test_define_macro,
-        test_expand_macro
+        test_expand_macro,
+        test_evaluate_macro_literal,
     ]
     run_cases(tests)
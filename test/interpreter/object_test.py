@@ -1,5 +1,6 @@
 from parser_test import run_cases
-from monkey_object.object import String
+from monkey_object.object import String, Integer, Boolean, TRUE, FALSE, HashPair, new_integer, Array, \
+    IntegerArray, new_array
 
 
 def test_string_hash_key():
@@ -19,8 +20,68 @@ def test_string_hash_key():
     return True
 
 
+def test_hash_keys_by_type():
+    keys = [Integer(1).hash_key(), TRUE.hash_key(), String("1").hash_key(), Integer(0).hash_key(),
+            FALSE.hash_key(), String("").hash_key()]
+    assert len(set(keys)) == len(keys), f"hash keys of different types collide: {keys}"
+    assert Integer(7).hash_key() == new_integer(7).hash_key() and Boolean(True).hash_key() == TRUE.hash_key(), \
+        "equal values have different hash keys"
+    pairs = {String("k").hash_key(): HashPair(String("k"), Integer(1))}
+    assert pairs.get(String("k").hash_key()) is not None, "lookup with an equal key failed"
+
+
+def test_hash_key_cached():
+    s = String("cached")
+    assert s.hash_key() is s.hash_key(), "string hash key is recomputed"
+    i = Integer(123456)
+    assert i.hash_key() is i.hash_key(), "integer hash key is recomputed"
+
+
+def test_array_structural_sharing():
+    a = Array([Integer(1), Integer(2)])
+    b = a.push(Integer(3))
+    c = a.push(Integer(4))
+    assert [e.value for e in a.elements] == [1, 2], f"push modified the original array: {a.inspect()}"
+    assert [e.value for e in b.elements] == [1, 2, 3], \
+        f"push on a shared array changed an earlier result: {b.inspect()}"
+    assert [e.value for e in c.elements] == [1, 2, 4], f"wrong push result: {c.inspect()}"
+    assert b.items is a.items, "first push did not share the backing list"
+
+    r = b.rest()
+    assert r.items is b.items and r.length() == 2 and r.get(0).value == 2, f"rest copied the elements: {r.inspect()}"
+    assert r.get(2) is None and r.get(-1) is None, "out of range index returned an element"
+    assert r == Array([Integer(2), Integer(3)]) and r != Array([Integer(2)]), "array equality changed"
+
+
+def test_integer_array():
+    a = new_array([Integer(1), Integer(2), Integer(1 << 40)])
+    assert isinstance(a, IntegerArray) and a.items.typecode == "q", \
+        f"integer literal is not stored in a typed buffer: {type(a)}"
+    assert a.get(2).value == 1 << 40 and a.get(3) is None and a.length() == 3, "wrong element access"
+    assert a == Array([Integer(1), Integer(2), Integer(1 << 40)]) and \
+        a.rest() == new_array([Integer(2), Integer(1 << 40)]), "integer array equality is wrong"
+
+    b = a.push(Integer(3))
+    c = a.push(Integer(4))
+    assert isinstance(b, IntegerArray) and b.items is a.items and [e.value for e in c.elements][-1] == 4, \
+        "push of an integer did not stay typed"
+    assert b.get(3).value == 3 and a.length() == 3, "push changed an earlier version"
+
+    mixed = a.push(String("x"))
+    assert not isinstance(mixed, IntegerArray) and mixed.get(3).value == "x" and mixed.get(0).value == 1, \
+        f"push of a string did not convert the array: {mixed}"
+    for elements in ([Integer(1), String("a")], [Integer(1 << 70)], [Integer(10 / 4)]):
+        assert not isinstance(new_array(elements), IntegerArray), \
+            f"non int64 elements stored in a typed buffer: {elements}"
+    assert isinstance(new_array([]).push(Integer(1)), IntegerArray), "push chain from an empty array is not typed"
+
+
 if __name__ == '__main__':
     cases = [
-        test_string_hash_key
+        test_string_hash_key,
+        test_hash_keys_by_type,
+        test_hash_key_cached,
+        test_array_structural_sharing,
+        test_integer_array,
     ]
     run_cases(cases)
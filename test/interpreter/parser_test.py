@@ -531,6 +531,50 @@ def test_function_literal_with_name():
         print(f"function literal name wrong. want 'myFunction', got={func.name}")
 
 
+
+def test_while_expression():
+    program = parse("while (x < y) { x }")
+    check_len(1, program.statements)
+    stmt, _ = check_type(ExpressionStatement, program.statements[0])
+    exp, ok = check_type(WhileExpression, stmt.expression)
+    assert ok, f"stmt.expression is not WhileExpression. got={type(stmt.expression)}"
+    assert test_infix_expression(exp.condition, "x", "<", "y")
+    check_len(1, exp.body.statements)
+    body, _ = check_type(ExpressionStatement, exp.body.statements[0])
+    assert test_identifier(body.expression, "x")
+
+
+def test_for_expression():
+    # 循环头的括号可以省略
+    for code in ["for (x in [1, 2]) { x }", "for x in [1, 2] { x }"]:
+        program = parse(code)
+        check_len(1, program.statements)
+        stmt, _ = check_type(ExpressionStatement, program.statements[0])
+        exp, ok = check_type(ForExpression, stmt.expression)
+        assert ok, f"stmt.expression is not ForExpression. got={type(stmt.expression)}"
+        assert test_identifier(exp.variable, "x")
+        iterable, ok = check_type(ArrayLiteral, exp.iterable)
+        assert ok and len(iterable.elements) == 2, f"wrong iterable: {exp.iterable}"
+        assert str(exp) == "for (x in [1, 2]) {x}", f"wrong string: {exp}"
+
+
+
+def test_assign_expression():
+    cases = [
+        ("x = 5;", "(x = 5)"),
+        ("x = y + 1", "(x = (y + 1))"),
+        ("a = b = c", "(a = (b = c))"),
+        ("f(x = 1)", "f((x = 1))"),
+    ]
+    for code, expected in cases:
+        program = parse(code)
+        check_len(1, program.statements)
+        stmt, _ = check_type(ExpressionStatement, program.statements[0])
+        assert str(stmt.expression) == expected, f"expected={expected}, got={stmt.expression}"
+    _, ok = check_type(AssignExpression, parse("x = 5").statements[0].expression)
+    assert ok, "x = 5 is not AssignExpression"
+
+
 if __name__ == '__main__':
     cases = [
         test_let_statements,
@@ -551,6 +595,9 @@ if __name__ == '__main__':
         test_parsing_hash_literal_string_key,
         test_parsing_empty_hash_literal,
         test_parsing_macro_literal,
-        test_function_literal_with_name
+        test_function_literal_with_name,
+        test_while_expression,
+        test_for_expression,
+        test_assign_expression,
     ]
     run_cases(cases)
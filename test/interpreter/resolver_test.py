@@ -0,0 +1,42 @@
+from monkey_ast import ast
+from monkey_evaluate.resolver import GLOBAL, resolve
+from monkey_parser.parser import parse
+from util.test_util import run_cases
+
+
+def identifiers(node: ast.Node):
+    if isinstance(node, ast.Identifier):
+        yield node
+    for child in ast.children(node):
+        yield from identifiers(child)
+
+
+def test_lexical_addresses():
+    program = parse("let a = 1; fn(x) { let y = x; fn(z) { x + y + z + a + len } }")
+    resolve(program)
+    outer = program.statements[1].expression
+    inner = outer.body.statements[1].expression
+    assert outer.layout == {"x": 0, "y": 1}, f"wrong layout of outer function: {outer.layout}"
+    assert inner.layout == {"z": 0}, f"wrong layout of inner function: {inner.layout}"
+    expected = [(1, 0), (1, 1), (0, 0), (GLOBAL, 0), (GLOBAL, 0)]
+    got = [(i.depth, i.slot) for i in identifiers(inner.body)]
+    assert got == expected, f"wrong addresses in inner function: want={expected} got={got}"
+    assert program.statements[0].name.depth == GLOBAL, "top-level let is not global"
+
+
+def test_declarations_are_hoisted():
+    # 代码块和循环不创建作用域，函数体中所有 let 和 for 变量在进入函数时分配槽位
+    program = parse("fn(a) { if (a) { let b = 1; } for (c in a) { let d = fn(e) { let f = e; }; } b }")
+    resolve(program)
+    fn = program.statements[0].expression
+    assert fn.layout == {"a": 0, "b": 1, "c": 2, "d": 3}, f"wrong layout: {fn.layout}"
+    b = fn.body.statements[2].expression
+    assert (b.depth, b.slot) == (0, 1), f"wrong address of b: {(b.depth, b.slot)}"
+
+
+if __name__ == '__main__':
+    cases = [
+        test_lexical_addresses,
+        test_declarations_are_hoisted,
+    ]
+    run_cases(cases)
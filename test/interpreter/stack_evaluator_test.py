@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import sys
+
+from monkey_evaluate import evaluator, stack_evaluator
+from monkey_object.object import Environment
+from monkey_parser.parser import parse
+from util.test_util import run_cases
+
+PROGRAMS = [
+    "(5 + 10 * 2 + 15 / 3) * 2 + -10",
+    "if (10 > 1) { if (10 > 1) { return 10; } return 1; }",
+    "let f = fn() { let x = if (true) { return 1; }; let g = fn() { return 2; }; g(); x }; f()",
+    "let f = fn() { let a = [if (true) { return 1; }]; let g = fn() { return 2; }; g(); a[0] }; f()",
+    "let f = fn() { let id = fn(v) { let g = fn() { return 2; }; g(); v }; id(if (true) { return 1; }) }; f()",
+    'let f = fn() { let x = if (true) { return 1; }; 5 }; f()',
+    'let f = fn() { let a = [2, if (true) { return 1; }]; 5 }; f()',
+    'let f = fn() { let h = {"a": if (true) { return 1; }}; 5 }; f()',
+    'let f = fn() { let g = fn(a, b) { 5 }; g(2, if (true) { return 1; }) + 10 }; f()',
+    'let f = fn() { 10 + if (true) { return 1; } }; f()',
+    'let f = fn() { if (if (true) { return 1; }) { 5 } else { 6 } }; f()',
+    'let f = fn() { return if (true) { return 1; } else { 2 }; }; f()',
+    'let g = fn() { return 2; }; let f = fn() { let x = if (true) { return g() + 1; }; 5 }; f()',
+    "let a = 5; let b = a * 2; a + b",
+    "let a = 5;",
+    "[1, 2 * 2, 3 + 3][1]",
+    'let f = fn(x) { x * 3 }; {"one": 10 - 9, true: 2, 3: f(1)}',
+    "let fib = fn(x) { if (x < 2) { return x; } fib(x - 1) + fib(x - 2) }; fib(15)",
+    "let a = fn(x) { fn(y) { fn(z) { x + y + z } } }; a(1)(2)(3)",
+    "let x = 1; let f = fn() { let y = x; let x = 2; y * 10 + x }; f()",
+    "let f = fn() { let c = 0; let inc = fn() { c = c + 1 }; inc(); inc(); c }; f()",
+    "let f = fn(n) { let s = 0; let i = 0; while (i < n) { i = i + 1; s = s + i; } s }; f(100)",
+    "let f = fn(arr) { for (x in arr) { if (x > 2) { return x; } } }; f([1, 3, 5])",
+    "let g = fn() { let out = []; for (x in [1, 2, 3]) { out = push(out, fn() { x }); } out }; "
+    "let hs = g(); [hs[0](), hs[1](), hs[2]()]",
+    "let g = fn() { let out = []; for (x in [1, 2]) { out = push(out, fn() { x = x * 10 }); }; out }; "
+    "let hs = g(); [hs[0](), hs[0](), hs[1]()]",
+    "let g = fn() { let out = []; for (x in [1, 2]) { for (y in [3, 4]) { out = push(out, fn() { x * y }); } }; "
+    "map(out, fn(h) { h() }) }; g()",
+    "let g = fn(a) { let t = 0; for (x in a) { let t = x; x = x * 3; }; [t, x] }; g([1, 2])",
+    "let out = []; for (x in [1, 2]) { out = push(out, fn() { x }); }; [out[0](), out[1]()]",
+    "let k = 2; sum(map(filter(range(10), fn(x) { x > 6 }), fn(x) { x * k }))",
+    "map([1], fn(x) { -true })",
+    'len("four") + len([1, 2]) + first([7, 8]) + last([7, 8])',
+    "quote(1 + unquote(2 + 2))",
+    "5 + true; 5",
+    "foobar",
+    "for (x in 1) { x }",
+    "let f = fn(x) { x(); }; f(1)",
+]
+
+
+def test_same_results_as_evaluator():
+    for source in PROGRAMS:
+        expected = evaluator.evaluate(parse(source), Environment())
+        got = stack_evaluator.evaluate(parse(source), Environment())
+        expected = expected.inspect() if expected is not None else None
+        got = got.inspect() if got is not None else None
+        assert got == expected, f"{source}: want={expected} got={got}"
+
+
+def test_deep_recursion():
+    # 递归深度远超 Python 的递归限制
+    cases = [
+        ("let f = fn(n) { if (n == 0) { 0 } else { n + f(n - 1) } }; f(20000)", "200010000"),
+        ("let even = fn(n) { if (n == 0) { true } else { odd(n - 1) } };"
+         "let odd = fn(n) { if (n == 0) { false } else { even(n - 1) } }; even(15001)", "false"),
+        ("let f = fn(n) { if (n == 0) { return []; } push(f(n - 1), n) }; len(f(5000))", "5000"),
+    ]
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(1000)
+    try:
+        for source, expected in cases:
+            got = stack_evaluator.evaluate(parse(source), Environment()).inspect()
+            assert got == expected, f"{source}: want={expected} got={got}"
+    finally:
+        sys.setrecursionlimit(limit)
+
+
+if __name__ == '__main__':
+    cases = [
+        test_same_results_as_evaluator,
+        test_deep_recursion,
+    ]
+    run_cases(cases)
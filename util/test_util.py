@@ -12,7 +12,11 @@ def run_cases(funcs: List[Callable]):
     total_cases = len(funcs)
     failed_list = {}
     for func in funcs:
-        output = func()
+        try:
+            output = func()
+        except AssertionError as e:
+            # 用 assert 编写的用例，失败时在 pytest 中同样会报错
+            output = False, str(e)
         if type(output) == tuple:
             failed_list[func.__name__] = output[1]
         else: